@@ -0,0 +1,270 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# =========================
+# ARTIFACT STORE
+# =========================
+# Heatmaps, SHAP plots and saved uploads are stored under the SHA-256 of their
+# bytes (`<hash>.<ext>`), so two uploads that share a client filename can no
+# longer overwrite each other, and identical artifacts are written once. Once
+# a name exists its bytes never change, which is what lets the server hand out
+# an ETag and `Cache-Control: immutable`. Files are written to a temp name and
+# renamed into place, so readers never see a partial file.
+
+HASH_CHARS = 32  # 128 bits of the digest is plenty for a file name
+NAME_RE = re.compile(r"^([0-9a-f]{%d})\.([a-z0-9]{1,8})$" % HASH_CHARS)
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ArtifactStore:
+    """Content-addressed files in one directory, bounded by size and age.
+
+    Entries are evicted least recently used first once the total passes
+    `max_bytes`, and dropped once unused for `ttl_s`. Only files named like
+    store entries are managed; anything else in the directory is left alone.
+    Last use is kept in each file's mtime, and every sweep rebuilds the index
+    from disk, so several processes sharing the directory (see
+    shm_serving.py) converge on the same view and budget.
+
+    Args:
+        root: Directory holding the files (created if missing).
+        max_bytes: Size budget for stored artifacts; None for no limit.
+        ttl_s: Seconds an unused artifact is kept; None to keep forever.
+        sweep_interval_s: Minimum time between sweeps (re-index + expiry),
+            which run on writes rather than on a timer.
+    """
+
+    def __init__(self, root, max_bytes=None, ttl_s=None, sweep_interval_s=60.0):
+        self.root = root
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.ttl_s = float(ttl_s) if ttl_s else None
+        self.sweep_interval_s = sweep_interval_s
+        os.makedirs(root, exist_ok=True)
+
+        self._entries = OrderedDict()  # name -> [size, last_used]; oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._writes = 0
+        self._deduped = 0
+        self._evicted = 0
+        self._expired = 0
+        self.sweep()
+
+    @staticmethod
+    def name_for(data, ext):
+        """Store name for `data`: `<sha256 prefix>.<ext>`."""
+        return f"{hashlib.sha256(data).hexdigest()[:HASH_CHARS]}.{ext.lstrip('.').lower()}"
+
+    def put(self, data, ext):
+        """Store `data` atomically; returns its name. Existing content is only touched."""
+        name = self.name_for(data, ext)
+        path = os.path.join(self.root, name)
+        now = time.time()
+        with self._lock:
+            known = name in self._entries
+        if known and os.path.exists(path):
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+            with self._lock:
+                if name in self._entries:
+                    self._entries[name][1] = now
+                    self._entries.move_to_end(name)
+                self._deduped += 1
+        else:
+            # A unique temp name per writer: concurrent puts of the same bytes
+            # race only on the final rename, which is atomic and idempotent.
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            with self._lock:
+                self._add(name, len(data), now)
+                self._writes += 1
+        self._maintain(now)
+        return name
+
+    def path(self, name):
+        """Filesystem path for a served name, or None if it is not a plain file here."""
+        if not name or name != os.path.basename(name) or name.startswith("."):
+            return None
+        path = os.path.join(self.root, name)
+        return path if os.path.isfile(path) else None
+
+    def read(self, name):
+        """(bytes, etag) for `name`, or None when missing.
+
+        Store entries use their content hash as the ETag and count as a use;
+        other files get a weak size/mtime tag.
+        """
+        path = self.path(name)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            st = os.stat(path)
+        except OSError:
+            return None
+        match = NAME_RE.match(name)
+        if match is None:
+            return data, f'W/"{st.st_size:x}-{int(st.st_mtime):x}"'
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                touch = now - entry[1] >= self.sweep_interval_s
+                entry[1] = now
+                self._entries.move_to_end(name)
+        if entry is not None and touch:
+            # Persist the use for the next rescan (ours or another process's).
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+        return data, f'"{match.group(1)}"'
+
+    def sweep(self, now=None):
+        """Re-index from disk, drop expired entries, then evict down to the size budget."""
+        now = time.time() if now is None else now
+        self._scan()
+        doomed = []
+        with self._lock:
+            self._last_sweep = now
+            if self.ttl_s is not None:
+                for name, (size, last_used) in list(self._entries.items()):
+                    if now - last_used < self.ttl_s:
+                        break  # ordered by last use
+                    doomed.append(name)
+                    self._drop(name)
+                    self._expired += 1
+            doomed += self._over_budget()
+        self._unlink(doomed)
+        return len(doomed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_s,
+                "writes": self._writes,
+                "deduped": self._deduped,
+                "evicted": self._evicted,
+                "expired": self._expired,
+            }
+
+    # ---- internals ----
+
+    def _scan(self):
+        found = []
+        now = time.time()
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".tmp") and entry.is_file():
+                # Left behind by a crash mid-write (another process's write in
+                # flight is only seconds old).
+                try:
+                    if now - entry.stat().st_mtime > 3600:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            if not NAME_RE.match(entry.name) or not entry.is_file():
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue  # evicted by another process
+            found.append((st.st_mtime, entry.name, st.st_size))
+        with self._lock:
+            # Uses seen here since the file was last touched are newer than its mtime.
+            previous = self._entries
+            self._entries = OrderedDict()
+            self._bytes = 0
+            found = [(max(mtime, previous[name][1]) if name in previous else mtime, name, size)
+                     for mtime, name, size in found]
+            for last_used, name, size in sorted(found):
+                self._add(name, size, last_used)
+
+    def _add(self, name, size, last_used):
+        if name in self._entries:
+            self._bytes -= self._entries[name][0]
+        self._entries[name] = [size, last_used]
+        self._entries.move_to_end(name)
+        self._bytes += size
+
+    def _drop(self, name):
+        size, _ = self._entries.pop(name)
+        self._bytes -= size
+
+    def _over_budget(self):
+        doomed = []
+        if self.max_bytes is None:
+            return doomed
+        # Never evict the entry just written, even if it alone is over budget.
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            name = next(iter(self._entries))
+            doomed.append(name)
+            self._drop(name)
+            self._evicted += 1
+        return doomed
+
+    def _maintain(self, now):
+        if now - self._last_sweep >= self.sweep_interval_s:
+            self.sweep(now)
+            return
+        with self._lock:
+            doomed = self._over_budget()
+        self._unlink(doomed)
+
+    def _unlink(self, names):
+        for name in names:
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Could not evict artifact %s: %s", name, e)
+
+
+def parse_range(header, size):
+    """Resolve a single `Range: bytes=...` header against `size`.
+
+    Returns (start, end) inclusive, None to ignore the header (absent,
+    malformed or multi-range: serve the whole file), or "unsatisfiable".
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last != "" and int(last) < start:
+        return None  # invalid range-spec: ignored, per RFC 9110
+    if start >= size:
+        return "unsatisfiable"
+    return start, size - 1 if last == "" else min(int(last), size - 1)
@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# =========================
+# DYNAMIC MICRO-BATCHING
+# =========================
+
+class _Pending:
+    """One caller's slice of work waiting for a batch."""
+
+    __slots__ = ("inputs", "future", "enqueued_at")
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Collect concurrent inference requests into batched forward passes.
+
+    Callers submit an array shaped (n, H, W, C) and get back a Future that
+    resolves to their own n rows of the model output. A single worker thread
+    waits for the first request, keeps collecting until either
+    `max_batch_size` rows are queued or `max_wait_ms` has passed since that
+    first request, then runs one forward pass for the whole batch.
+
+    Args:
+        predict_fn: Callable taking a stacked batch and returning an array,
+            or a tuple/list of arrays, whose first axis matches the batch.
+        max_batch_size: Upper bound on rows per forward pass.
+        max_wait_ms: How long the oldest request may wait for company.
+        name: Label used in logs and stats.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0, name="model"):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._waits_ms = deque(maxlen=2048)
+        self._infer_ms = deque(maxlen=2048)
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+
+    # ---- lifecycle ----
+    def start(self):
+        with self._cond:
+            if self._running:
+                return self
+            self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name=f"batcher-{self.name}", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            "Micro-batcher '%s' started (max_batch_size=%d, max_wait_ms=%g)",
+            self.name, self.max_batch_size, self.max_wait * 1000,
+        )
+        return self
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # Fail anything still queued so no caller hangs forever.
+        with self._cond:
+            while self._queue:
+                pending = self._queue.popleft()
+                if not pending.future.done():
+                    pending.future.set_exception(RuntimeError("Batcher stopped"))
+
+    # ---- public API ----
+    def submit(self, inputs):
+        """Queue `inputs` (n, ...) and return a Future for the n output rows."""
+        inputs = np.asarray(inputs)
+        if inputs.ndim == 0:
+            raise ValueError("Batched inputs need a leading batch axis")
+        pending = _Pending(inputs)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError(f"Batcher '{self.name}' is not running")
+            self._queue.append(pending)
+            self._cond.notify()
+        return pending.future
+
+    def stats(self):
+        """Batch-size distribution and queue-wait/inference latency summary."""
+        with self._stats_lock:
+            waits = np.array(self._waits_ms, dtype=np.float64)
+            infers = np.array(self._infer_ms, dtype=np.float64)
+            return {
+                "name": self.name,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batches,
+                "items": self._items,
+                "errors": self._errors,
+                "mean_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                "queue_wait_ms": _summarize(waits),
+                "inference_ms": _summarize(infers),
+                "queue_depth": len(self._queue),
+            }
+
+    # ---- worker ----
+    def _collect(self):
+        """Block for the next batch; returns a list of pending items or None on stop."""
+        with self._cond:
+            while self._running and not self._queue:
+                self._cond.wait()
+            if not self._running:
+                return None
+
+            batch = [self._queue.popleft()]
+            rows = len(batch[0].inputs)
+            deadline = batch[0].enqueued_at + self.max_wait
+
+            while rows < self.max_batch_size:
+                if self._queue:
+                    nxt = self._queue[0]
+                    if rows + len(nxt.inputs) > self.max_batch_size:
+                        break
+                    batch.append(self._queue.popleft())
+                    rows += len(nxt.inputs)
+                    continue
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or not self._running:
+                    break
+                self._cond.wait(remaining)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            started = time.perf_counter()
+            sizes = [len(p.inputs) for p in batch]
+            try:
+                stacked = batch[0].inputs if len(batch) == 1 else np.concatenate(
+                    [p.inputs for p in batch], axis=0
+                )
+                outputs = self.predict_fn(stacked)
+            except Exception as e:
+                logger.exception("Batched inference failed (%s): %s", self.name, e)
+                with self._stats_lock:
+                    self._errors += 1
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            offset = 0
+            for p, n in zip(batch, sizes):
+                p.future.set_result(_slice_outputs(outputs, offset, offset + n))
+                offset += n
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += offset
+                self._batch_sizes[offset] += 1
+                self._infer_ms.append((finished - started) * 1000)
+                for p in batch:
+                    self._waits_ms.append((started - p.enqueued_at) * 1000)
+
+
+def _slice_outputs(outputs, start, stop):
+    if isinstance(outputs, (tuple, list)):
+        return type(outputs)(
+            None if o is None else o[start:stop] for o in outputs
+        )
+    return outputs[start:stop]
+
+
+def _summarize(values):
+    if values.size == 0:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(p50), 3),
+        "p95": round(float(p95), 3),
+        "p99": round(float(p99), 3),
+        "max": round(float(values.max()), 3),
+    }
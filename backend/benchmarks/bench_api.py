@@ -0,0 +1,317 @@
+"""Prediction API load test: throughput and p50/p95/p99 latency per mode.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_api --modes fast,gradcam,batch --concurrency 1,4,16
+    python -m benchmarks.bench_api --url http://127.0.0.1:5000   # a running server
+
+By default the FastAPI app is driven in-process (startup/shutdown included)
+through httpx's ASGI transport, with uploads, jobs and models in a temp
+directory. The models/ brain model is used when present, otherwise the
+synthetic stand-in. Modes:
+
+    fast     deep_scan=false, gradcam=false   (prediction only)
+    gradcam  deep_scan=false, gradcam=true    (prediction + heatmap)
+    deep     deep_scan=true; latency runs until the SHAP job has finished
+    batch    /predict/brain/batch with --batch-images files per request
+
+Every request uploads a distinct image so the result cache never answers.
+Results are written to runs/bench_api/<timestamp>-<commit>.json (or --json);
+--compare an earlier file to print the change per mode and concurrency.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL = os.path.join(BASE_DIR, "models", "global_Brain_model.keras")
+DEFAULT_OUT = os.path.join(BASE_DIR, "runs", "bench_api")
+MODES = ("fast", "gradcam", "deep", "batch")
+
+
+# =========================
+# REQUESTS
+# =========================
+
+def make_uploads(n, seed=0):
+    """`n` distinct JPEG uploads derived from the sample scan."""
+    from PIL import Image
+
+    from benchmarks.synthetic_model import sample_images
+
+    uploads = []
+    for image in sample_images(n, seed=seed):
+        buffer = io.BytesIO()
+        Image.fromarray((image * 255).astype(np.uint8)).save(buffer, "JPEG", quality=90)
+        uploads.append(buffer.getvalue())
+    return uploads
+
+
+class Uploads:
+    """Hands out a fresh upload per request; never repeats within a run."""
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.used = 0
+        self._pool = []
+
+    def take(self, n=1):
+        while len(self._pool) < n:
+            self.seed += 1
+            self._pool.extend(make_uploads(64, seed=self.seed))
+        taken, self._pool = self._pool[:n], self._pool[n:]
+        self.used += n
+        return taken
+
+
+async def wait_for_job(client, job_id, poll_s=0.05):
+    while True:
+        response = await client.get(f"/jobs/{job_id}")
+        job = response.json()
+        if job["status"] in ("done", "failed"):
+            return job["status"] == "done"
+        await asyncio.sleep(poll_s)
+
+
+async def one_request(client, mode, uploads, batch_images):
+    """Send one request of `mode`; returns (ok, images scored)."""
+    if mode == "batch":
+        files = [("images", (f"bench_{uploads.used + i}.jpg", data, "image/jpeg"))
+                 for i, data in enumerate(uploads.take(batch_images))]
+        response = await client.post("/predict/brain/batch", files=files)
+        if response.status_code != 200:
+            return False, 0
+        summary = json.loads(response.text.strip().splitlines()[-1])
+        return summary.get("errors", 1) == 0, summary.get("count", 0)
+
+    data = uploads.take()[0]
+    form = {
+        "deep_scan": "true" if mode == "deep" else "false",
+        "gradcam": "false" if mode == "fast" else "true",
+    }
+    response = await client.post(
+        "/predict/brain",
+        files={"image": (f"bench_{uploads.used}.jpg", data, "image/jpeg")},
+        data=form,
+    )
+    if response.status_code != 200:
+        return False, 0
+    job_id = response.json().get("job_id")
+    if mode == "deep" and job_id:
+        return await wait_for_job(client, job_id), 1
+    return True, 1
+
+
+async def run_level(client, mode, concurrency, requests, uploads, batch_images):
+    """`requests` requests of `mode`, `concurrency` in flight at a time."""
+    latencies = []
+    failures = 0
+    images = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, failures, images
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                ok, scored = await one_request(client, mode, uploads, batch_images)
+            except Exception:
+                ok, scored = False, 0
+            latencies.append((time.perf_counter() - started) * 1000)
+            failures += not ok
+            images += scored
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    lat = np.array(latencies)
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": failures,
+        "seconds": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 2),
+        "images_per_s": round(images / elapsed, 2),
+        "p50_ms": round(float(np.percentile(lat, 50)), 1),
+        "p95_ms": round(float(np.percentile(lat, 95)), 1),
+        "p99_ms": round(float(np.percentile(lat, 99)), 1),
+    }
+
+
+# =========================
+# TARGETS
+# =========================
+
+def prepare_in_process(workdir, model_path):
+    """Point the app at temp folders (and a model) before importing it."""
+    models = os.path.join(workdir, "models")
+    os.makedirs(models, exist_ok=True)
+    target = os.path.join(models, "global_Brain_model.keras")
+    if os.path.exists(model_path):
+        os.symlink(os.path.abspath(model_path), target)
+        source = model_path
+    else:
+        from benchmarks.synthetic_model import ensure_model_file
+
+        ensure_model_file(target)
+        source = "synthetic"
+    os.environ["MODEL_FOLDER"] = models
+    os.environ["UPLOAD_FOLDER"] = os.path.join(workdir, "uploads")
+    os.environ["JOBS_DB"] = os.path.join(workdir, "jobs.sqlite3")
+    os.environ.setdefault("MODEL_PRELOAD", "brain")
+    os.environ.pop("RESULT_CACHE_DIR", None)
+    return source
+
+
+async def run_suite(args, plan):
+    import httpx
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        async with client:
+            return await _run_plan(client, args, plan)
+
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            return await _run_plan(client, args, plan)
+
+
+async def _run_plan(client, args, plan):
+    uploads = Uploads(seed=args.seed)
+    # One untimed request per mode so tracing and first-use setup stay out.
+    for mode in dict.fromkeys(mode for mode, _ in plan):
+        await one_request(client, mode, uploads, args.batch_images)
+
+    rows = []
+    for mode, concurrency in plan:
+        requests = args.deep_requests if mode == "deep" else args.requests
+        row = await run_level(client, mode, concurrency, requests, uploads, args.batch_images)
+        print(
+            f"  {mode:<8} c={concurrency:<3} {row['requests_per_s']:>8} req/s "
+            f"p50 {row['p50_ms']:>8} ms  p95 {row['p95_ms']:>8} ms  p99 {row['p99_ms']:>8} ms"
+            + (f"  ({row['errors']} errors)" if row["errors"] else "")
+        )
+        rows.append(row)
+    return rows
+
+
+# =========================
+# REPORTING
+# =========================
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=BASE_DIR, capture_output=True, text=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = "unknown", False
+    settings = {
+        key: os.environ[key]
+        for key in sorted(os.environ)
+        if key.startswith(("BATCH_", "SHAP_", "FAST_POOL_", "SLOW_POOL_", "INFERENCE_", "TFLITE_", "RESULT_CACHE_"))
+    }
+    return {
+        "commit": commit + ("-dirty" if dirty else ""),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": settings,
+    }
+
+
+def compare(rows, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    before = {(r["mode"], r["concurrency"]): r for r in baseline["rows"]}
+    print(f"\n=== Change vs {baseline['env']['commit']} ({os.path.basename(baseline_path)}) ===")
+    print(f"{'mode':<8} {'conc':>4} {'req/s':>16} {'p95 ms':>20}")
+    for row in rows:
+        old = before.get((row["mode"], row["concurrency"]))
+        if old is None:
+            continue
+        print(
+            f"{row['mode']:<8} {row['concurrency']:>4} "
+            f"{old['requests_per_s']:>7} -> {row['requests_per_s']:<7} "
+            f"{old['p95_ms']:>8} -> {row['p95_ms']:<8} ({_change(old['p95_ms'], row['p95_ms'])})"
+        )
+
+
+def _change(old, new):
+    return f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Model for in-process runs (synthetic if missing)")
+    parser.add_argument("--modes", default="fast,gradcam,deep,batch")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per mode and concurrency level")
+    parser.add_argument("--deep-requests", type=int, default=8, help="Requests per level for the deep mode")
+    parser.add_argument("--batch-images", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Results file (default: runs/bench_api/<timestamp>-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"Unknown mode(s): {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    plan = [(mode, c) for mode in modes for c in levels]
+
+    env = environment()
+    workdir = None
+    if args.url:
+        env["target"] = args.url
+    else:
+        workdir = tempfile.mkdtemp(prefix="bench_api_")
+        env["target"] = "in-process"
+        env["model"] = prepare_in_process(workdir, args.model)
+
+    print(f"🏁 Benchmarking {env['target']} at {env['commit']}: {', '.join(modes)} x concurrency {levels}")
+    try:
+        rows = asyncio.run(run_suite(args, plan))
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {"env": env, "args": vars(args), "rows": rows}
+    out_path = args.json
+    if out_path is None:
+        os.makedirs(DEFAULT_OUT, exist_ok=True)
+        stamp = env["timestamp"].replace(":", "").replace("-", "")
+        out_path = os.path.join(DEFAULT_OUT, f"{stamp}-{env['commit']}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results written to {out_path}")
+
+    if args.compare:
+        compare(rows, args.compare)
+    return 1 if any(row["errors"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
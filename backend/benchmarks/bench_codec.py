@@ -0,0 +1,181 @@
+"""Client-update compression: bytes per round, codec throughput, accuracy cost.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_codec --schemes fp32,fp16,int8,top0.01+int8
+
+Part 1 encodes one simulated client update of the serving model
+(models/global_Brain_model.keras, or the synthetic stand-in) with every
+scheme and reports wire bytes and encode/decode throughput in MB/s of float32
+weights. Part 2 runs a few real FedAvg rounds of a small model of the same
+layer stack on a synthetic 4-class task, sending updates through each scheme
+(top-k schemes with error feedback unless suffixed "-noef"), and reports
+held-out accuracy against uncompressed float32 weights.
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic_model import build_synthetic_brain_model, keras
+from federated.codec import ErrorFeedback, UpdateCodec, decode_update, encode_update, write_stream
+from federated.fedavg import fedavg
+from federated.shards import UpdateShard, export_model
+from federated.simulate import export_base, run_client
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL = os.path.join(BASE_DIR, "models", "global_Brain_model.keras")
+DEFAULT_SCHEMES = "fp32,fp16,int8,top0.1+int8,top0.01+int8,top0.01+int8-noef"
+
+
+def parse_scheme(spec):
+    """"top0.01+int8-noef" -> (UpdateCodec(int8, topk=0.01), use_feedback=False)."""
+    feedback = not spec.endswith("-noef")
+    codec = UpdateCodec.from_spec(spec[: -len("-noef")] if not feedback else spec)
+    return codec, feedback and codec.topk is not None
+
+
+# =========================
+# PART 1: WIRE SIZE + THROUGHPUT
+# =========================
+
+def bench_wire(model_path, schemes, workdir):
+    base_path = export_base(model_path, os.path.join(workdir, "base.weights"))
+    client_path = run_client(base_path, os.path.join(workdir, "client.shard"), 0)
+    base = UpdateShard(base_path)
+    raw_bytes = sum(t["nbytes"] for t in base.tensors)
+    raw_mb = raw_bytes / (1024 * 1024)
+
+    rows = []
+    for spec in schemes:
+        codec, use_feedback = parse_scheme(spec)
+        feedback = ErrorFeedback() if use_feedback else None
+        buffer = io.BytesIO()
+        started = time.perf_counter()
+        wire_bytes = write_stream(encode_update(client_path, base_path, codec, feedback), buffer)
+        encode_s = time.perf_counter() - started
+
+        buffer.seek(0)
+        started = time.perf_counter()
+        decode_update(buffer, base_path, os.path.join(workdir, "decoded.shard"))
+        decode_s = time.perf_counter() - started
+        rows.append({
+            "scheme": spec,
+            "bytes_per_round": wire_bytes,
+            "ratio": round(raw_bytes / wire_bytes, 1),
+            "encode_mb_s": round(raw_mb / encode_s, 1),
+            "decode_mb_s": round(raw_mb / decode_s, 1),
+        })
+    return {"model": base.metadata.get("base"), "raw_bytes": raw_bytes, "rows": rows}
+
+
+# =========================
+# PART 2: ACCURACY COST
+# =========================
+
+def make_dataset(n, size=32, seed=0):
+    """4-class task: a bright square in the quadrant given by the label."""
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, 4, n)
+    images = rng.normal(0.3, 0.1, (n, size, size, 3)).astype(np.float32)
+    half = size // 2
+    for i, label in enumerate(labels):
+        y, x = divmod(int(label), 2)
+        oy, ox = rng.integers(2, half - 8, 2)
+        images[i, y * half + oy : y * half + oy + 6, x * half + ox : x * half + ox + 6] += 0.6
+    return np.clip(images, 0, 1), labels
+
+
+def run_rounds(spec, rounds, clients, samples, workdir, seed=0):
+    """FedAvg rounds with updates sent through `spec`; returns held-out accuracy per round."""
+    codec, use_feedback = (None, False) if spec == "uncompressed" else parse_scheme(spec)
+    keras.utils.set_random_seed(seed)
+    model = build_synthetic_brain_model(input_shape=(32, 32, 3), width=8, seed=seed)
+    data = [make_dataset(samples, seed=seed + 1 + c) for c in range(clients)]
+    test_x, test_y = make_dataset(1000, seed=seed + 999)
+    feedback = [ErrorFeedback() if use_feedback else None for _ in range(clients)]
+    global_weights = model.get_weights()
+
+    history = []
+    for r in range(rounds):
+        round_dir = os.path.join(workdir, f"{spec}-round{r}")
+        os.makedirs(round_dir, exist_ok=True)
+        base_path = export_model(model, os.path.join(round_dir, "base.weights"))
+        paths = []
+        for c, (x, y) in enumerate(data):
+            # Each client starts from the global weights with a fresh optimizer.
+            model.compile(optimizer=keras.optimizers.Adam(1e-3), loss="sparse_categorical_crossentropy", metrics=["accuracy"])
+            model.set_weights(global_weights)
+            model.fit(x, y, epochs=1, batch_size=32, verbose=0, shuffle=False)
+            trained = export_model(model, os.path.join(round_dir, f"trained_{c}.weights"), num_examples=len(y))
+            if codec is None:
+                paths.append(trained)
+                continue
+            # Over the "wire" and back, exactly as the server would receive it.
+            buffer = io.BytesIO()
+            write_stream(encode_update(trained, base_path, codec, feedback[c]), buffer)
+            buffer.seek(0)
+            received = os.path.join(round_dir, f"client_{c}.shard")
+            decode_update(buffer, base_path, received)
+            paths.append(received)
+
+        averaged = os.path.join(round_dir, "global.avg")
+        fedavg(paths, averaged)
+        shard = UpdateShard(averaged)
+        global_weights = [np.array(shard.array(name)) for name in shard.names]
+        model.set_weights(global_weights)
+        _, accuracy = model.evaluate(test_x, test_y, verbose=0)
+        history.append(round(float(accuracy), 4))
+        shutil.rmtree(round_dir, ignore_errors=True)
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--schemes", default=DEFAULT_SCHEMES)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--samples", type=int, default=256, help="Training images per client")
+    parser.add_argument("--skip-accuracy", action="store_true")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    schemes = [s.strip() for s in args.schemes.split(",") if s.strip()]
+    workdir = tempfile.mkdtemp(prefix="bench_codec_")
+    try:
+        wire = bench_wire(args.model, schemes, workdir)
+        accuracy = {}
+        if not args.skip_accuracy:
+            for spec in ["uncompressed", *schemes]:
+                accuracy[spec] = run_rounds(spec, args.rounds, args.clients, args.samples, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("\n=== Update wire size / throughput ===")
+    print(f"Model: {wire['model']} ({wire['raw_bytes'] / (1024 * 1024):.2f} MB float32 per round)")
+    print(f"{'scheme':<22} {'bytes/round':>12} {'ratio':>7} {'enc MB/s':>9} {'dec MB/s':>9}")
+    for row in wire["rows"]:
+        print(
+            f"{row['scheme']:<22} {row['bytes_per_round']:>12,} {row['ratio']:>6}x "
+            f"{row['encode_mb_s']:>9} {row['decode_mb_s']:>9}"
+        )
+
+    if accuracy:
+        reference = accuracy["uncompressed"][-1]
+        print(f"\n=== Held-out accuracy after {args.rounds} FedAvg rounds ({args.clients} clients) ===")
+        for spec, history in accuracy.items():
+            print(f"{spec:<22} {history[-1]:.4f} ({history[-1] - reference:+.4f})  per round: {history}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"wire": wire, "accuracy": accuracy}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""FedAvg aggregation time and peak RSS vs. number of clients.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_fedavg --clients 2,8,32
+
+Simulates the largest client count once (separate processes, see
+federated.simulate), then aggregates the first N updates for each N in a fresh
+process, both with the streaming memory-mapped aggregator and with a naive
+baseline that loads every client model into RAM first. Uses
+models/global_Brain_model.keras when present, otherwise a synthetic stand-in.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from federated.fedavg import fedavg
+from federated.shards import UpdateShard
+from federated.simulate import export_base, simulate_clients
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL = os.path.join(BASE_DIR, "models", "global_Brain_model.keras")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    # Linux: VmHWM belongs to the current address space. ru_maxrss would also
+    # count the parent's pages from before the spawned child exec'd.
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, other Unixes KiB.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def in_memory_fedavg(shard_paths):
+    """Baseline: every client's full weights resident, then averaged."""
+    shards = [UpdateShard(p) for p in shard_paths]
+    clients = [[np.array(s.array(name)) for name in s.names] for s in shards]
+    examples = np.array([s.num_examples for s in shards], dtype=np.float64)
+    weights = examples / examples.sum()
+    return [
+        sum(w * client[i].astype(np.float64) for w, client in zip(weights, clients))
+        for i in range(len(clients[0]))
+    ]
+
+
+def _measure(mode, shard_paths, out_path, results):
+    before = peak_rss_mb()
+    started = time.perf_counter()
+    if mode == "streaming":
+        fedavg(shard_paths, out_path)
+    else:
+        averaged = in_memory_fedavg(shard_paths)
+        del averaged
+    results.put({
+        "seconds": round(time.perf_counter() - started, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "baseline_rss_mb": before,
+    })
+
+
+def measure(mode, shard_paths, out_path):
+    """Run one aggregation in a fresh process so peak RSS is its own."""
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(mode, shard_paths, out_path, results))
+    proc.start()
+    result = results.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--clients", default="2,8,32", help="Comma-separated client counts")
+    parser.add_argument("--processes", type=int, help="Concurrent client processes (default: CPUs)")
+    parser.add_argument("--no-baseline", action="store_true", help="Skip the in-memory baseline")
+    parser.add_argument("--workdir", help="Where to write shards (default: a temp dir, removed after)")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    counts = sorted({int(c) for c in args.clients.split(",") if c.strip()})
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_fedavg_")
+    try:
+        base_path = export_base(args.model, os.path.join(workdir, "base.weights"))
+        base = UpdateShard(base_path)
+        model_mb = sum(t["nbytes"] for t in base.tensors) / (1024 * 1024)
+
+        started = time.perf_counter()
+        paths = simulate_clients(base_path, workdir, counts[-1], args.processes)
+        simulate_s = time.perf_counter() - started
+
+        rows = []
+        for n in counts:
+            row = {"clients": n, "streaming": measure("streaming", paths[:n], os.path.join(workdir, "out.avg"))}
+            if not args.no_baseline:
+                row["in_memory"] = measure("in_memory", paths[:n], None)
+            rows.append(row)
+
+        results = {
+            "model": base.metadata.get("base"),
+            "model_mb": round(model_mb, 2),
+            "simulate_seconds": round(simulate_s, 2),
+            "rows": rows,
+        }
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print("\n=== FedAvg aggregation ===")
+    print(f"Model: {results['model']} ({results['model_mb']} MB of weights per client)")
+    print(f"{'clients':>8} {'stream s':>9} {'stream RSS MB':>14} {'in-RAM s':>9} {'in-RAM RSS MB':>14}")
+    for row in rows:
+        s, m = row["streaming"], row.get("in_memory") or {}
+        print(
+            f"{row['clients']:>8} {s['seconds']:>9} {str(s['peak_rss_mb']):>14} "
+            f"{str(m.get('seconds', '-')):>9} {str(m.get('peak_rss_mb', '-')):>14}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
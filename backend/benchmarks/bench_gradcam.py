@@ -0,0 +1,108 @@
+"""All-class Grad-CAM: one compiled pass vs one Grad-CAM call per class.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_gradcam --batch-sizes 1,8
+
+Times, per batch, the serving engine's single top-class Grad-CAM, the
+all-class step (GradCamEngine.explain_classes) for Grad-CAM and Grad-CAM++,
+and the naive alternative: a full forward and backward pass per class. Also
+checks that the all-class maps match the per-class ones.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.synthetic_model import load_or_build
+from explain import GradCamEngine
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL = os.path.join(BASE_DIR, "models", "global_Brain_model.keras")
+
+
+def latency_ms(fn, batch, repeats):
+    fn(batch)  # warm (and trace)
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(batch)
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(float(np.median(timings)), 2)
+
+
+def per_class_step(engine, classes):
+    """A full Grad-CAM call for one fixed class, compiled once per class."""
+
+    def explain(x, index):
+        with tf.GradientTape() as tape:
+            tape.watch(x)
+            conv_output, predictions = engine._forward(x)
+            if predictions.shape[-1] == 1:
+                predictions = tf.concat([1 - predictions, predictions], axis=-1)
+            score = predictions[:, index]
+        grads = tape.gradient(score, conv_output)
+        heatmap = tf.einsum("bhwc,bc->bhw", conv_output, tf.reduce_mean(grads, axis=(1, 2)))
+        heatmap = tf.maximum(heatmap, 0)
+        return heatmap / (tf.reduce_max(heatmap, axis=(1, 2), keepdims=True) + 1e-8)
+
+    steps = [tf.function(lambda x, i=i: explain(x, i), input_signature=engine._signature) for i in range(classes)]
+
+    def run(batch):
+        x = tf.convert_to_tensor(batch, dtype=tf.float32)
+        return np.stack([step(x).numpy() for step in steps], axis=1)
+
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--batch-sizes", default="1,8")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    model, source = load_or_build(args.model)
+    engine = GradCamEngine(model)
+    classes = max(model.output_shape[-1], 2)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",") if b.strip()]
+    rng = np.random.default_rng(0)
+    naive = per_class_step(engine, classes)
+
+    variants = {
+        "top-1 (serving)": engine,
+        "all, one pass": lambda b: engine.explain_classes(b),
+        "all++, one pass": lambda b: engine.explain_classes(b, method="gradcam++"),
+        "all, per class": naive,
+    }
+    rows = []
+    for n in batch_sizes:
+        batch = rng.random((n,) + engine.input_shape, dtype=np.float32)
+        _, order, maps = engine.explain_classes(batch)
+        expected = np.take_along_axis(naive(batch), order[:, :, None, None], axis=1)
+        drift = float(np.max(np.abs(maps - expected)))
+        for name, fn in variants.items():
+            rows.append({"variant": name, "batch": n, "latency_ms": latency_ms(fn, batch, args.repeats)})
+        rows[-len(variants)]["max_map_drift"] = drift
+
+    print("\n=== All-class Grad-CAM ===")
+    print(f"Model: {source}; {classes} classes")
+    print(f"{'variant':<18} {'batch':>5} {'ms':>9} {'x top-1':>8}")
+    for row in rows:
+        base = next(r for r in rows if r["batch"] == row["batch"])["latency_ms"]
+        print(f"{row['variant']:<18} {row['batch']:>5} {row['latency_ms']:>9} {row['latency_ms'] / base:>8.2f}")
+    for row in rows:
+        if "max_map_drift" in row:
+            print(f"batch {row['batch']}: one-pass maps vs per-class maps, max abs difference {row['max_map_drift']:.2e}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"model": source, "classes": classes, "rows": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""SHAP throughput: per-call explainer vs. the shared, cross-request ShapService.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_shap --images 8 --workers 4
+    python -m benchmarks.bench_shap --budget-ms 2000   # anytime refinement
+
+Uses models/global_Brain_model.keras when present, otherwise a synthetic
+stand-in with the same layer stack.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.synthetic_model import load_or_build, sample_images
+from explain import ShapService, compute_shap
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL = os.path.join(BASE_DIR, "models", "global_Brain_model.keras")
+
+
+def run_per_call(model, images):
+    """Today's path: a fresh masker + explainer per image, model.predict per call."""
+    started = time.perf_counter()
+    for img in images:
+        shap_values, _, _ = compute_shap(model, img[None])
+        if shap_values is None:
+            raise RuntimeError("per-call SHAP failed")
+    return time.perf_counter() - started
+
+
+def run_service(model, images, workers, batch_size, wait_ms, budget_s=None, target=None):
+    lock = threading.Lock()
+
+    def forward(batch):
+        with lock:
+            return np.asarray(model(batch, training=False))
+
+    service = ShapService(
+        forward, images.shape[1:], max_batch_size=batch_size, max_wait_ms=wait_ms
+    )
+    try:
+        # First call per thread builds its explainer; keep that out of the timing
+        # the same way the server amortises it across its lifetime.
+        service.explain(images[:1])
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(
+                lambda img: compute_shap(None, img[None], service=service, budget_s=budget_s, target=target),
+                images,
+            ))
+        elapsed = time.perf_counter() - started
+        if any(r[0] is None for r in results):
+            raise RuntimeError("service SHAP failed")
+        return elapsed, service.stats(), [r[2] for r in results]
+    finally:
+        service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--wait-ms", type=float, default=20.0)
+    parser.add_argument("--budget-ms", type=float, help="Refinement budget per image for the service")
+    parser.add_argument("--target", type=float, help="Convergence target for the service")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    model, source = load_or_build(args.model)
+    images = sample_images(args.images, tuple(model.input_shape[1:]))
+    model(images[:1], training=False)  # build/trace once before timing
+
+    per_call_s = run_per_call(model, images)
+    service_s, service_stats, qualities = run_service(
+        model, images, args.workers, args.batch_size, args.wait_ms,
+        budget_s=args.budget_ms / 1000 if args.budget_ms else None, target=args.target,
+    )
+    scores = [q["convergence"] for q in qualities if q["convergence"] is not None]
+
+    results = {
+        "model": source,
+        "images": args.images,
+        "workers": args.workers,
+        "per_call": {
+            "seconds": round(per_call_s, 3),
+            "images_per_minute": round(60 * args.images / per_call_s, 2),
+        },
+        "service": {
+            "seconds": round(service_s, 3),
+            "images_per_minute": round(60 * args.images / service_s, 2),
+            "mean_batch_size": service_stats["mean_batch_size"],
+            "batches": service_stats["batches"],
+            "mean_evals": round(float(np.mean([q["evals"] for q in qualities])), 1),
+            "mean_convergence": round(float(np.mean(scores)), 4) if scores else None,
+            "max_ms": max(q["ms"] for q in qualities),
+        },
+    }
+    results["speedup"] = round(per_call_s / service_s, 2)
+
+    print("\n=== SHAP throughput ===")
+    print(f"Model: {source}, images: {args.images}, service workers: {args.workers}")
+    print(f"Per-call explainer : {results['per_call']['images_per_minute']:8.2f} images/min")
+    print(
+        f"Batched service    : {results['service']['images_per_minute']:8.2f} images/min "
+        f"(mean model batch {results['service']['mean_batch_size']})"
+    )
+    print(f"Speedup            : {results['speedup']}x")
+    service = results["service"]
+    print(
+        f"Service refinement : {service['mean_evals']} evals/image, convergence "
+        f"{service['mean_convergence']}, slowest image {service['max_ms']} ms"
+    )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
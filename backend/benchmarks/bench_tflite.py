@@ -0,0 +1,103 @@
+"""TFLite vs Keras: top-1 agreement, probability drift and CPU latency.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_tflite --samples-dir uploads --quant none,float16,dynamic,int8
+
+Converts the serving model (models/global_Brain_model.keras, or the synthetic
+stand-in) with each quantization mode, then compares every converted graph
+against the Keras model on the same inputs: top-1 agreement, mean/p99/max
+absolute probability drift, graph size, and per-batch latency at batch sizes
+1 and 16. Point --samples-dir at real scans before turning INFERENCE_BACKEND
+on; synthetic inputs only show that the conversion is sound.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from benchmarks.synthetic_model import load_or_build
+from explain import GradCamEngine
+from tflite_backend import QUANT_MODES, TFLiteModel, convert_model, parity, sample_inputs
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL = os.path.join(BASE_DIR, "models", "global_Brain_model.keras")
+
+
+def latency_ms(fn, batch, repeats):
+    fn(batch)  # warm
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(batch)
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(float(np.median(timings)), 2)
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--quant", default=",".join(QUANT_MODES), help="Comma-separated quantization modes")
+    parser.add_argument("--samples-dir", help="Folder of scans to compare on (default: synthetic inputs)")
+    parser.add_argument("--samples", type=int, default=64)
+    parser.add_argument("--threads", type=int, help="TFLite/XNNPACK threads (default: all cores)")
+    parser.add_argument("--batch-sizes", default="1,16")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    model, source = load_or_build(args.model)
+    engine = GradCamEngine(model)
+    inputs, inputs_source = sample_inputs(args.samples_dir, args.samples, engine.input_shape)
+    if inputs_source == "synthetic":
+        print(
+            "⚠️ Comparing on SYNTHETIC inputs: agreement on noise says nothing about real scans. "
+            "Pass --samples-dir with real scans before choosing a quantization mode."
+        )
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",") if b.strip()]
+    engine.warmup(batch_sizes=batch_sizes)
+
+    keras_bytes = sum(w.numpy().nbytes for w in model.weights)
+    rows = [{
+        "backend": "keras",
+        "bytes": keras_bytes,
+        "latency_ms": {str(n): latency_ms(engine.predict, inputs[:n], args.repeats) for n in batch_sizes},
+    }]
+    for mode in [q.strip() for q in args.quant.split(",") if q.strip()]:
+        started = time.perf_counter()
+        content = convert_model(model, mode, representative=inputs)
+        convert_s = time.perf_counter() - started
+        fast = TFLiteModel(content, args.threads, name=f"tflite-{mode}")
+        rows.append({
+            "backend": fast.name,
+            "bytes": fast.nbytes,
+            "convert_s": round(convert_s, 2),
+            "latency_ms": {str(n): latency_ms(fast.predict, inputs[:n], args.repeats) for n in batch_sizes},
+            **parity(engine.predict, fast.predict, inputs),
+        })
+
+    print("\n=== TFLite parity vs Keras ===")
+    print(f"Model: {source}; {len(inputs)} {'scans from ' + args.samples_dir if inputs_source == 'scans' else 'synthetic inputs'}")
+    header = f"{'backend':<16} {'MB':>6} {'top-1':>7} {'max drift':>10} {'p99 drift':>10}"
+    print(header + "".join(f" {'ms@' + str(n):>9}" for n in batch_sizes))
+    for row in rows:
+        line = (
+            f"{row['backend']:<16} {row['bytes'] / (1024 * 1024):>6.2f} "
+            f"{_fmt(row.get('top1_agreement'), '.4f'):>7} "
+            f"{_fmt(row.get('max_abs_drift'), '.2e'):>10} {_fmt(row.get('p99_abs_drift'), '.2e'):>10}"
+        )
+        print(line + "".join(f" {row['latency_ms'][str(n)]:>9}" for n in batch_sizes))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"model": source, "samples": len(inputs), "inputs": inputs_source, "rows": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+os.environ["KERAS_BACKEND"] = "tensorflow"
+import numpy as np
+try:
+    import keras
+except ImportError:
+    from tensorflow import keras
+
+
+# =========================
+# SYNTHETIC STAND-IN MODEL
+# =========================
+# Benchmarks must run on machines without the real global model. This builds a
+# small, randomly initialised network with the same layer stack and names as
+# models/global_Brain_model.keras (python inspect_model.py writes its layer
+# report to runs/model_info.txt), so every code path -
+# including Grad-CAM on conv2d_5 - behaves the same, only faster.
+
+def build_synthetic_brain_model(num_classes=4, input_shape=(224, 224, 3), width=16, seed=0):
+    keras.utils.set_random_seed(seed)
+    layers = keras.layers
+    return keras.Sequential(
+        [
+            keras.Input(shape=input_shape),
+            layers.Conv2D(width, 3, activation="relu", name="conv2d_3"),
+            layers.BatchNormalization(name="batch_normalization_3"),
+            layers.MaxPooling2D(name="max_pooling2d_3"),
+            layers.Conv2D(width * 2, 3, activation="relu", name="conv2d_4"),
+            layers.BatchNormalization(name="batch_normalization_4"),
+            layers.MaxPooling2D(name="max_pooling2d_4"),
+            layers.Conv2D(width * 4, 3, activation="relu", name="conv2d_5"),
+            layers.BatchNormalization(name="batch_normalization_5"),
+            layers.MaxPooling2D(name="max_pooling2d_5"),
+            layers.Flatten(name="flatten_1"),
+            layers.Dense(64, activation="relu", name="dense_2"),
+            layers.Dropout(0.3, name="dropout_1"),
+            layers.Dense(num_classes, activation="softmax", name="dense_3"),
+        ],
+        name="synthetic_brain_model",
+    )
+
+
+def load_or_build(model_path=None, **kwargs):
+    """Load `model_path` if it exists, else return a synthetic stand-in.
+
+    Returns (model, description).
+    """
+    if model_path and os.path.exists(model_path):
+        return keras.models.load_model(model_path, compile=False), model_path
+    return build_synthetic_brain_model(**kwargs), "synthetic"
+
+
+def ensure_model_file(model_path, **kwargs):
+    """Write a synthetic model to `model_path` unless a model is already there."""
+    if os.path.exists(model_path):
+        return False
+    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+    build_synthetic_brain_model(**kwargs).save(model_path)
+    return True
+
+
+def sample_images(n, input_shape=(224, 224, 3), seed=0):
+    """Deterministic batch of distinct images in [0, 1] (n, H, W, C).
+
+    Uses the bundled sample scan with per-image noise when available, so SHAP
+    and Grad-CAM see realistic structure; otherwise smooth random fields.
+    """
+    rng = np.random.default_rng(seed)
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sample = os.path.join(base_dir, "uploads", "Te-gl_0010.jpg")
+    h, w, c = input_shape
+    if os.path.exists(sample):
+        from PIL import Image
+        img = Image.open(sample).convert("RGB").resize((w, h))
+        base = np.asarray(img, dtype=np.float32) / 255.0
+    else:
+        base = np.linspace(0, 1, h * w * c, dtype=np.float32).reshape(input_shape)
+    noise = rng.normal(0, 0.05, size=(n,) + tuple(input_shape)).astype(np.float32)
+    return np.clip(base[None] + noise, 0, 1)
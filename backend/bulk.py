@@ -0,0 +1,84 @@
+import os
+import tarfile
+import zipfile
+
+
+# =========================
+# STREAMED BULK INPUTS
+# =========================
+# Bulk requests may carry hundreds of images, loose or inside a zip/tar
+# archive. Members are read one at a time and grouped into fixed-size chunks,
+# so memory depends on the chunk size, never on the archive size.
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+
+def is_image_name(name):
+    base = os.path.basename(name)
+    if not base or base.startswith(".") or "__MACOSX" in name.split("/"):
+        return False
+    return os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_archive(fileobj, max_member_bytes):
+    """Yield (name, bytes_or_error) for image members of a zip or tar stream.
+
+    Tar archives (optionally gzip/bz2/xz compressed) are read as a forward-only
+    stream. Zip needs its central directory, so `fileobj` must be seekable;
+    upload spool files are. Oversized members yield a ValueError instead of
+    bytes so the caller can report them per image.
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not is_image_name(info.filename):
+                    continue
+                if info.file_size > max_member_bytes:
+                    yield info.filename, ValueError("Image exceeds the per-file size limit")
+                    continue
+                yield info.filename, zf.read(info)
+        return
+
+    fileobj.seek(0)
+    try:
+        tar = tarfile.open(fileobj=fileobj, mode="r|*")
+    except tarfile.TarError as e:
+        raise ValueError(f"Unsupported archive (expected zip or tar): {e}") from e
+    with tar:
+        for member in tar:
+            if not member.isfile() or not is_image_name(member.name):
+                continue
+            if member.size > max_member_bytes:
+                yield member.name, ValueError("Image exceeds the per-file size limit")
+                continue
+            yield member.name, tar.extractfile(member).read()
+
+
+def iter_files(uploads, max_member_bytes):
+    """Yield (name, bytes_or_error) for individually uploaded files."""
+    for upload in uploads:
+        upload.file.seek(0, os.SEEK_END)
+        size = upload.file.tell()
+        upload.file.seek(0)
+        if size > max_member_bytes:
+            yield upload.filename, ValueError("Image exceeds the per-file size limit")
+            continue
+        yield upload.filename, upload.file.read()
+
+
+def read_chunk(iterator, size):
+    """Pull up to `size` items from `iterator`; an empty list means exhausted."""
+    chunk = []
+    for item in iterator:
+        chunk.append(item)
+        if len(chunk) >= size:
+            break
+    return chunk
+
+
+def artifact_stem(name):
+    """Filesystem-safe stem for artifacts derived from an archive member name."""
+    stem = os.path.splitext(name)[0].strip("/")
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in stem)
+    return safe or "image"
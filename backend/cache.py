@@ -0,0 +1,236 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# =========================
+# CONTENT-ADDRESSED RESULT CACHE
+# =========================
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CachedResult:
+    """Everything a repeat upload needs: raw predictions plus encoded artifacts."""
+
+    __slots__ = ("preds", "heatmap", "shap")
+
+    def __init__(self, preds, heatmap=None, shap=None):
+        self.preds = np.asarray(preds)
+        self.heatmap = heatmap  # JPEG bytes of the Grad-CAM overlay
+        self.shap = shap  # PNG bytes of the SHAP plot
+
+    @property
+    def nbytes(self):
+        return self.preds.nbytes + len(self.heatmap or b"") + len(self.shap or b"")
+
+
+class ResultCache:
+    """LRU cache of scan results keyed on upload bytes + model version.
+
+    Entries live in memory up to `max_bytes`; least recently used entries are
+    evicted first. When `disk_dir` is set, every entry is also written there
+    (one .npz per key, bounded by `max_disk_bytes`) and memory misses fall back
+    to it, so results survive eviction and restarts.
+
+    Args:
+        max_bytes: Memory budget for cached entries.
+        disk_dir: Optional directory for the on-disk tier.
+        max_disk_bytes: Size budget for the on-disk tier.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, max_disk_bytes=None):
+        self.max_bytes = int(max_bytes)
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes = None  # measured lazily, then tracked per write
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+    @staticmethod
+    def key(contents, model_version):
+        h = hashlib.sha256()
+        h.update(str(model_version).encode("utf-8"))
+        h.update(b"\0")
+        h.update(contents)
+        return h.hexdigest()
+
+    # ---- lookups ----
+    def get(self, key):
+        """Return the CachedResult for `key` or None; checks memory, then disk."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                self._counters["memory_hits"] += 1
+                return entry
+
+        entry = self._load_from_disk(key)
+        with self._lock:
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            self._counters["disk_hits"] += 1
+            self._insert(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._insert(key, entry)
+        self._save_to_disk(key, entry)
+
+    def update(self, key, **artifacts):
+        """Attach artifacts (e.g. shap=...) to an existing entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = self._load_from_disk(key)
+            if entry is None:
+                return
+        with self._lock:
+            # Un-account the entry before it grows, then re-insert at its new size.
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            for name, value in artifacts.items():
+                setattr(entry, name, value)
+            self._insert(key, entry)
+        self._save_to_disk(key, entry)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_dir": self.disk_dir,
+            }
+
+    # ---- memory tier ----
+    def _insert(self, key, entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        if entry.nbytes > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.nbytes
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self._counters["evictions"] += 1
+
+    # ---- disk tier ----
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.npz")
+
+    def _load_from_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with np.load(path) as data:
+                entry = CachedResult(
+                    data["preds"],
+                    heatmap=data["heatmap"].tobytes() if "heatmap" in data else None,
+                    shap=data["shap"].tobytes() if "shap" in data else None,
+                )
+            os.utime(path)
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Dropping unreadable cache file %s: %s", path, e)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _save_to_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        arrays = {"preds": entry.preds}
+        if entry.heatmap is not None:
+            arrays["heatmap"] = np.frombuffer(entry.heatmap, dtype=np.uint8)
+        if entry.shap is not None:
+            arrays["shap"] = np.frombuffer(entry.shap, dtype=np.uint8)
+
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, "wb") as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write cache file %s: %s", path, e)
+            return
+
+        if not self.max_disk_bytes:
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += buffer.getbuffer().nbytes - previous
+            over_budget = self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._trim_disk()
+
+    def _trim_disk(self):
+        """Measure the disk tier and delete least recently used files past the budget."""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".npz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total > self.max_disk_bytes:
+            for _, size, path in sorted(files):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_disk_bytes:
+                    break
+        with self._lock:
+            self._disk_bytes = total
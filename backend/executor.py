@@ -0,0 +1,215 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# =========================
+# BOUNDED WORKER POOLS
+# =========================
+
+class PoolSaturated(Exception):
+    """Raised when a pool has no free worker and its wait queue is full."""
+
+    def __init__(self, pool_name, retry_after):
+        super().__init__(f"'{pool_name}' pool is at capacity, retry in {retry_after}s")
+        self.pool_name = pool_name
+        self.retry_after = retry_after
+
+
+class BoundedPool:
+    """Thread pool with admission control for blocking work called from async code.
+
+    At most `workers` tasks run at once and at most `max_queue` more may wait.
+    Anything beyond that is rejected immediately with PoolSaturated, carrying a
+    Retry-After estimate based on recent task durations, so callers can shed
+    load instead of piling up behind a slow path.
+
+    Args:
+        name: Label used in logs, thread names and stats.
+        workers: Number of worker threads.
+        max_queue: Tasks allowed to wait for a worker before rejecting.
+    """
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix=f"pool-{name}"
+        )
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._avg_task_s = 0.0
+
+    @property
+    def capacity(self):
+        return self.workers + self.max_queue
+
+    def saturated(self):
+        with self._lock:
+            return self._in_flight >= self.capacity
+
+    def retry_after(self):
+        """Seconds until a queued task would likely get a worker (at least 1)."""
+        with self._lock:
+            backlog = max(1, self._in_flight - self.workers + 1)
+            estimate = self._avg_task_s * backlog / self.workers
+        return max(1, math.ceil(estimate))
+
+    async def run(self, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` on the pool and await its result."""
+        with self._lock:
+            admitted = self._in_flight < self.capacity
+            if admitted:
+                self._in_flight += 1
+            else:
+                self._rejected += 1
+        if not admitted:
+            raise PoolSaturated(self.name, self.retry_after())
+
+        # Carry the caller's context (e.g. its request timings) into the worker.
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, self._timed, fn, *args, **kwargs)
+        try:
+            future = self._executor.submit(call)
+        except BaseException:
+            self._release()
+            raise
+        # The slot is freed when the task finishes (or is cancelled before it
+        # starts), not when the caller stops waiting: a cancelled request's
+        # task keeps its worker busy until it returns.
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future=None):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _timed(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._completed += 1
+                # Exponential moving average keeps Retry-After responsive to load.
+                if self._completed == 1:
+                    self._avg_task_s = elapsed
+                else:
+                    self._avg_task_s = 0.8 * self._avg_task_s + 0.2 * elapsed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_task_ms": round(self._avg_task_s * 1000, 3),
+            }
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
+
+
+# =========================
+# MODEL LOCK
+# =========================
+
+class ModelLock:
+    """Lock around model calls that lets background work yield to serving.
+
+    Serving code uses it like a `threading.Lock` (`with model_lock:`), or
+    wraps lock-free model work (TFLite) in `busy()`; both count as demand.
+    Background work enters `idle()`, which waits until there is no demand,
+    so a serving call is delayed by at most one background section. Those
+    delays are recorded in `stats()`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._demand = 0
+        self._background = False
+        self._waits_ms = []
+        self._waits = 0
+        self._max_wait_ms = 0.0
+
+    def acquire(self):
+        with self._cond:
+            self._demand += 1
+            behind_background = self._background
+        if behind_background:
+            started = time.perf_counter()
+            self._lock.acquire()
+            self._record_wait((time.perf_counter() - started) * 1000)
+        else:
+            self._lock.acquire()
+        return True
+
+    def release(self):
+        self._lock.release()
+        with self._cond:
+            self._demand -= 1
+            self._cond.notify_all()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+    @contextlib.contextmanager
+    def busy(self):
+        """Count as demand without taking the lock."""
+        with self._cond:
+            self._demand += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._demand -= 1
+                self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def idle(self):
+        """Hold the lock for background work, once nothing else wants it."""
+        with self._cond:
+            while self._demand or self._background:
+                self._cond.wait()
+            # No serving call holds or waits for the lock, so this is immediate.
+            self._lock.acquire()
+            self._background = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._background = False
+                self._lock.release()
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._waits_ms)
+            return {
+                "serving_waits": self._waits,
+                "serving_wait_ms_p95": round(waits[int(0.95 * (len(waits) - 1))], 2) if waits else None,
+                "serving_wait_ms_max": round(self._max_wait_ms, 2),
+            }
+
+    def _record_wait(self, ms):
+        with self._cond:
+            self._waits += 1
+            self._max_wait_ms = max(self._max_wait_ms, ms)
+            self._waits_ms.append(ms)
+            if len(self._waits_ms) > 2048:
+                del self._waits_ms[:1024]
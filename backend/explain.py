@@ -1,3 +1,7 @@
+import heapq
+import itertools
+import logging
+import time
 import tensorflow as tf
 try:
     from tensorflow import keras
@@ -5,10 +9,17 @@ except ImportError:
     import keras
 import numpy as np
 import cv2
-import shap
-import matplotlib
-matplotlib.use('Agg')  # Non-interactive backend for server
-import matplotlib.pyplot as plt
+from batching import MicroBatcher
+import render
+from telemetry import stage
+
+logger = logging.getLogger(__name__)
+
+
+def import_shap():
+    """Import shap on first use; it (with sklearn and numba) adds seconds to start-up."""
+    import shap
+    return shap
 
 
 def has_nested_model(model):
@@ -19,130 +30,464 @@ def has_nested_model(model):
     return False
 
 
-def grad_cam(model, img_array, last_conv_layer_name):
-    """Compute Grad-CAM heatmap for a given model and image.
-    
-    Optimized for nested Sequential models.
-    """
-    with open("gradcam_debug.log", "a") as f:
-        f.write(f"\n--- New Grad-CAM Request ---\nTarget Layer: {last_conv_layer_name}\n")
+# =========================
+# PRECOMPILED GRAD-CAM ENGINE
+# =========================
 
-    # Check if model has nested structure
-    is_nested = has_nested_model(model)
-    
-    if is_nested:
-        # Use layer-by-layer tracing for nested models
-        return _grad_cam_nested(model, img_array, last_conv_layer_name)
-    else:
-        # Use standard approach for flat models
-        return _grad_cam_standard(model, img_array, last_conv_layer_name)
+CAM_METHODS = ("gradcam", "gradcam++")
 
 
-def _grad_cam_nested(model, img_array, last_conv_layer_name):
-    """Grad-CAM for nested Sequential models using layer-by-layer tracing."""
-    
-    try:
-        with tf.GradientTape(persistent=True) as tape:
-            x = img_array
-            conv_output = None
-            
-            # Forward pass through each layer
-            for layer in model.layers:
-                if hasattr(layer, 'layers') and len(layer.layers) > 0:
-                    # This is a nested model (like Sequential)
-                    for sublayer in layer.layers:
-                        x = sublayer(x)
-                        if sublayer.name == last_conv_layer_name:
-                            tape.watch(x)
-                            conv_output = x
-                else:
-                    x = layer(x)
-                    if layer.name == last_conv_layer_name:
-                        tape.watch(x)
-                        conv_output = x
-            
-            predictions = x
-            class_idx = tf.argmax(predictions[0])
-            class_output = predictions[:, class_idx]
-        
-        if conv_output is not None:
-            grads = tape.gradient(class_output, conv_output)
-            
-            if grads is not None:
-                pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-                conv_output_val = conv_output[0]
-                heatmap = conv_output_val @ pooled_grads[..., tf.newaxis]
-                heatmap = tf.squeeze(heatmap)
-                heatmap = tf.maximum(heatmap, 0) / (tf.math.reduce_max(heatmap) + 1e-8)
-                print("✅ Grad-CAM computed successfully (nested model)")
-                return heatmap.numpy()
-            else:
-                # Fallback: just average conv activations
-                msg = "Gradients are None - falling back to activation averaging"
-                print(f"⚠️ {msg}")
-                with open("gradcam_debug.log", "a") as f:
-                    f.write(f"{msg}\n")
-                    
-                heatmap = tf.reduce_mean(conv_output, axis=-1)[0]
-                heatmap = tf.maximum(heatmap, 0) / (tf.math.reduce_max(heatmap) + 1e-8)
-                return heatmap.numpy()
-        else:
-            msg = f"Target layer {last_conv_layer_name} output not found during forward pass"
-            print(f"❌ {msg}")
-            with open("gradcam_debug.log", "a") as f:
-                f.write(f"{msg}\n")
-                
-    except Exception as e:
-        msg = f"Nested Grad-CAM failed: {e}"
-        print(f"❌ {msg}")
-        with open("gradcam_debug.log", "a") as f:
-            f.write(f"{msg}\n")
-    
+def find_last_conv_layer(model):
+    """Recursively find the name of the last convolutional layer in a model."""
+    for layer in reversed(model.layers):
+        # Check for nested models (e.g., VGG16, ResNet base)
+        if hasattr(layer, 'layers') and len(layer.layers) > 0:
+            result = find_last_conv_layer(layer)
+            if result:
+                return result
+        # Check for direct Conv layer
+        if 'conv' in layer.name.lower() or isinstance(layer, keras.layers.Conv2D):
+            return layer.name
     return None
 
 
-def _grad_cam_standard(model, img_array, last_conv_layer_name):
-    """Standard Grad-CAM for flat models."""
-    
-    try:
-        target_layer = model.get_layer(last_conv_layer_name)
-        
-        grad_model = keras.Model(
-            inputs=model.input,
-            outputs=[target_layer.output, model.output]
-        )
-        
+class GradCamEngine:
+    """Prediction and Grad-CAM for a batch in one traced forward/backward pass.
+
+    Built once when a model is loaded: the target conv layer is located, a
+    grad model exposing (conv activations, predictions) is wired up, and the
+    whole explain step is compiled with `tf.function` for any batch size.
+    Calling the engine returns `(preds, heatmaps)` as NumPy arrays, where
+    heatmaps is (batch, h, w) in [0, 1] for each row's top class, or None if
+    the model has no conv layer to explain. `predict` runs the compiled
+    forward pass alone when no heatmap is needed, and `explain_classes`
+    returns Grad-CAM or Grad-CAM++ maps for several classes at once.
+
+    Args:
+        model: Keras model (flat or with nested Sequential blocks)
+        layer_name: Conv layer to explain; auto-detected when omitted
+    """
+
+    def __init__(self, model, layer_name=None):
+        self.model = model
+        self.layer_name = layer_name or find_last_conv_layer(model)
+        self.input_shape = tuple(model.input_shape[1:])
+
+        signature = [tf.TensorSpec((None,) + self.input_shape, tf.float32)]
+        self._signature = signature
+        self._predict = tf.function(self._predict_only, input_signature=signature)
+        self._class_steps = {}  # (k, method) -> compiled all-class step, traced on first use
+        if self.layer_name is None:
+            logger.warning("No convolutional layer found for Grad-CAM")
+            self._forward = None
+            self._step = self._predict
+        else:
+            self._forward = self._build_forward()
+            self._step = tf.function(self._predict_and_explain, input_signature=signature)
+            logger.info("Grad-CAM engine targeting layer: %s", self.layer_name)
+
+    def __call__(self, img_array):
+        outputs = self._step(tf.convert_to_tensor(img_array, dtype=tf.float32))
+        if self._forward is None:
+            return outputs.numpy(), None
+        preds, heatmaps = outputs
+        return preds.numpy(), heatmaps.numpy()
+
+    def predict(self, img_array):
+        """Predictions only, through the same compiled graph family."""
+        return self._predict(tf.convert_to_tensor(img_array, dtype=tf.float32)).numpy()
+
+    def explain_classes(self, img_array, top_k=None, method="gradcam"):
+        """Heatmaps for each row's `top_k` most likely classes (all when None).
+
+        One compiled step shares the forward pass between classes and
+        differentiates each class score in it. k classes therefore cost one
+        forward pass plus k backward passes through the layers above the
+        target conv layer, not k full Grad-CAM calls. The first call for a
+        given (k, method) traces the step.
+
+        Args:
+            img_array: (batch, H, W, C) float32 model inputs.
+            top_k: Classes per row, most likely first; None for all.
+            method: "gradcam" or "gradcam++".
+
+        Returns:
+            (preds, class_idx, heatmaps): raw predictions (batch, outputs),
+            class indices (batch, k), and (batch, k, h, w) maps in [0, 1].
+            Single-output (sigmoid) models count as two classes, [1 - p, p].
+        """
+        if method not in CAM_METHODS:
+            raise ValueError(f"Unknown Grad-CAM method {method!r}; expected one of {CAM_METHODS}")
+        if self._forward is None:
+            raise ValueError("Model has no convolutional layer to explain")
+        classes = max(self.model.output_shape[-1], 2)
+        k = classes if top_k is None else max(1, min(int(top_k), classes))
+        step = self._class_steps.get((k, method))
+        if step is None:
+            step = tf.function(
+                lambda x: self._explain_classes(x, k, method == "gradcam++"), input_signature=self._signature
+            )
+            self._class_steps[(k, method)] = step
+        preds, class_idx, heatmaps = step(tf.convert_to_tensor(img_array, dtype=tf.float32))
+        return preds.numpy(), class_idx.numpy(), heatmaps.numpy()
+
+    def warmup(self, batch_sizes=(1,)):
+        """Run dummy batches so the first real request doesn't pay for tracing."""
+        for n in batch_sizes:
+            batch = np.zeros((n,) + self.input_shape, dtype=np.float32)
+            self(batch)
+            self.predict(batch)
+
+    def _build_forward(self):
+        if not has_nested_model(self.model):
+            try:
+                grad_model = keras.Model(
+                    inputs=self.model.inputs,
+                    outputs=[self.model.get_layer(self.layer_name).output, self.model.output],
+                )
+                return lambda x: grad_model(x, training=False)
+            except Exception as e:
+                logger.warning("Standard grad model unavailable (%s), tracing layer by layer", e)
+        return self._nested_forward
+
+    def _nested_forward(self, x):
+        """Layer-by-layer trace that also exposes layers inside nested models."""
+        conv_output = None
+        for layer in self.model.layers:
+            sublayers = layer.layers if hasattr(layer, 'layers') and len(layer.layers) > 0 else [layer]
+            for sublayer in sublayers:
+                x = sublayer(x, training=False)
+                if sublayer.name == self.layer_name:
+                    conv_output = x
+        if conv_output is None:
+            raise ValueError(f"Target layer {self.layer_name} output not found during forward pass")
+        return conv_output, x
+
+    def _predict_only(self, x):
+        return self.model(x, training=False)
+
+    def _predict_and_explain(self, x):
         with tf.GradientTape() as tape:
-            conv_output, predictions = grad_model(img_array, training=False)
-            class_idx = tf.argmax(predictions[0])
-            class_output = predictions[:, class_idx]
-        
+            tape.watch(x)
+            conv_output, predictions = self._forward(x)
+            class_idx = tf.argmax(predictions, axis=-1)
+            # Rows are independent at inference time, so the gradient of the
+            # summed per-row scores gives every row its own gradient.
+            class_output = tf.gather(predictions, class_idx, axis=1, batch_dims=1)
+
         grads = tape.gradient(class_output, conv_output)
-        
         if grads is None:
-            raise ValueError("Gradients are None")
-        
-        pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-        conv_output = conv_output[0]
-        heatmap = conv_output @ pooled_grads[..., tf.newaxis]
-        heatmap = tf.squeeze(heatmap)
-        heatmap = tf.maximum(heatmap, 0) / (tf.math.reduce_max(heatmap) + 1e-8)
-        print("✅ Grad-CAM computed successfully (standard model)")
-        return heatmap.numpy()
-        
-    except Exception as e:
-        msg = f"Standard Grad-CAM failed: {e}, trying nested approach..."
-        print(f"⚠️ {msg}")
-        with open("gradcam_debug.log", "a") as f:
-            f.write(f"{msg}\n")
-        return _grad_cam_nested(model, img_array, last_conv_layer_name)
+            # Fallback: just average conv activations
+            heatmaps = tf.reduce_mean(conv_output, axis=-1)
+        else:
+            pooled_grads = tf.reduce_mean(grads, axis=(1, 2))
+            heatmaps = tf.einsum("bhwc,bc->bhw", conv_output, pooled_grads)
+        heatmaps = tf.maximum(heatmaps, 0)
+        heatmaps = heatmaps / (tf.reduce_max(heatmaps, axis=(1, 2), keepdims=True) + 1e-8)
+        return predictions, heatmaps
+
+    def _explain_classes(self, x, k, plus_plus):
+        with tf.GradientTape(persistent=True) as tape:
+            tape.watch(x)
+            conv_output, predictions = self._forward(x)
+            probs = predictions
+            if predictions.shape[-1] == 1:
+                probs = tf.concat([1 - predictions, predictions], axis=-1)
+            class_idx = tf.math.top_k(probs, k=k).indices
+            scores = tf.gather(probs, class_idx, axis=1, batch_dims=1)
+            columns = [scores[:, i] for i in range(k)]
+
+        # As in _predict_and_explain, each summed column gives every row its
+        # own gradient. Measured on the serving model, these k gradients in
+        # one graph run faster than a pfor batch_jacobian of `scores`.
+        grads = [tape.gradient(column, conv_output) for column in columns]
+        if grads[0] is None:
+            # Fallback: just average conv activations
+            heatmaps = tf.repeat(tf.reduce_mean(conv_output, axis=-1)[:, tf.newaxis], k, axis=1)
+        else:
+            grads = tf.stack(grads, axis=1)  # (batch, k, h, w, channels)
+            if plus_plus:
+                weights = gradcam_pp_weights(conv_output, grads)
+            else:
+                weights = tf.reduce_mean(grads, axis=(2, 3))
+            heatmaps = tf.einsum("bhwc,bkc->bkhw", conv_output, weights)
+        heatmaps = tf.maximum(heatmaps, 0)
+        heatmaps = heatmaps / (tf.reduce_max(heatmaps, axis=(2, 3), keepdims=True) + 1e-8)
+        return predictions, class_idx, heatmaps
+
+
+def gradcam_pp_weights(conv_output, grads):
+    """Grad-CAM++ channel weights (Chattopadhay et al., 2018) from first-order gradients.
+
+    Args:
+        conv_output: (batch, h, w, channels) activations.
+        grads: (batch, k, h, w, channels) gradients of k class scores.
+    """
+    grads_2 = tf.square(grads)
+    grads_3 = grads_2 * grads
+    activation_sum = tf.reduce_sum(conv_output, axis=(1, 2))[:, tf.newaxis, tf.newaxis, tf.newaxis, :]
+    alpha = tf.math.divide_no_nan(grads_2, 2.0 * grads_2 + activation_sum * grads_3)
+    return tf.reduce_sum(alpha * tf.nn.relu(grads), axis=(2, 3))
 
 
 # =========================
 # SHAP IMPLEMENTATION
 # =========================
+# ShapService computes the hierarchical Owen values that shap's Partition
+# explainer computes with a blur masker, but as a resumable refinement: the
+# image is halved recursively (longer side first, down to single pixels) and
+# the regions with the largest pending effect are split first, a batch of
+# model evaluations at a time. The priority queue of pending regions is the
+# whole state, so evaluation can stop after any batch and a snapshot spreads
+# each pending region's effect evenly over its pixels: coarse superpixels
+# first, finer detail as the budget allows.
+
 
-def compute_shap(model, img_array, background_data=None, num_samples=50):
+class OwenRefiner:
+    """Anytime Owen-value attributions for one image.
+
+    Args:
+        predict: Callable mapping a (n, H, W, C) batch to (n, outputs)
+        image: The image to explain, (H, W, C) float32
+        blur_kernel: Box blur that stands in for masked-out pixels
+    """
+
+    def __init__(self, predict, image, blur_kernel=(10, 10)):
+        self.predict = predict
+        self.image = np.ascontiguousarray(image, dtype=np.float32)
+        # Every masked sample starts from the same blurred copy.
+        self.blurred = cv2.blur(self.image, blur_kernel).reshape(self.image.shape)
+        f00, f11 = np.asarray(predict(np.stack([self.blurred, self.image])), dtype=np.float64)
+        self.base_value = f00
+        self.output = f11
+        self.evals = 2
+        height, width = self.image.shape[:2]
+        self._settled = np.zeros((height, width, len(f00)), dtype=np.float64)
+        self._queue = []
+        self._order = itertools.count()
+        self._push((0, height, 0, width), (), f00, f11, 1.0)
+
+    def refine(self, evals):
+        """Spend up to `evals` evaluations on the largest pending effects; returns the number used."""
+        nodes = []
+        while self._queue and len(nodes) < max(1, evals // 2):
+            _, _, rect, context, f00, f11, weight = heapq.heappop(self._queue)
+            halves = _split(rect)
+            if halves is None:  # a single pixel: its value is final
+                _spread(self._settled, rect, (f11 - f00) * weight)
+                continue
+            nodes.append((halves, context, f00, f11, weight))
+        if not nodes:
+            return 0
+
+        samples = np.empty((2 * len(nodes),) + self.image.shape, dtype=np.float32)
+        for i, ((left, right), context, _, _, _) in enumerate(nodes):
+            samples[2 * i] = self._masked(context + (left,))
+            samples[2 * i + 1] = self._masked(context + (right,))
+        outputs = np.asarray(self.predict(samples), dtype=np.float64)
+        self.evals += len(samples)
+
+        for i, ((left, right), context, f00, f11, weight) in enumerate(nodes):
+            f10, f01 = outputs[2 * i], outputs[2 * i + 1]
+            # Each half, with its sibling masked and with it present.
+            half = weight / 2
+            self._push(left, context, f00, f10, half)
+            self._push(right, context, f00, f01, half)
+            self._push(left, context + (right,), f01, f11, half)
+            self._push(right, context + (left,), f10, f11, half)
+        return len(samples)
+
+    @property
+    def done(self):
+        return not self._queue
+
+    def snapshot(self):
+        """Attributions so far, (H, W, outputs); they sum to output - base_value."""
+        values = self._settled.copy()
+        for _, _, rect, _, f00, f11, weight in self._queue:
+            _spread(values, rect, (f11 - f00) * weight)
+        return values
+
+    def _push(self, rect, context, f00, f11, weight):
+        priority = -float(np.max(np.abs(f11 - f00))) * weight
+        heapq.heappush(self._queue, (priority, next(self._order), rect, context, f00, f11, weight))
+
+    def _masked(self, present):
+        sample = self.blurred.copy()
+        for y0, y1, x0, x1 in present:
+            sample[y0:y1, x0:x1] = self.image[y0:y1, x0:x1]
+        return sample
+
+
+def _split(rect):
+    """Halve a (y0, y1, x0, x1) region across its longer side; None for one pixel."""
+    y0, y1, x0, x1 = rect
+    if y1 - y0 >= x1 - x0:
+        if y1 - y0 < 2:
+            return None
+        mid = (y0 + y1) // 2
+        return (y0, mid, x0, x1), (mid, y1, x0, x1)
+    mid = (x0 + x1) // 2
+    return (y0, y1, x0, mid), (y0, y1, mid, x1)
+
+
+def _spread(values, rect, effect):
+    y0, y1, x0, x1 = rect
+    values[y0:y1, x0:x1] += effect / ((y1 - y0) * (x1 - x0))
+
+
+def map_similarity(a, b):
+    """Pearson correlation of two saliency maps (1.0 when both are flat)."""
+    a = np.ravel(a) - np.mean(a)
+    b = np.ravel(b) - np.mean(b)
+    norm = np.sqrt(np.dot(a, a) * np.dot(b, b))
+    if norm == 0:
+        return 1.0 if not a.any() and not b.any() else 0.0
+    return float(np.dot(a, b) / norm)
+
+
+class ShapService:
+    """Long-lived SHAP explainer that batches model evaluations across requests.
+
+    Every explanation's masked samples go through one MicroBatcher, so
+    several deep scans running at the same time fill a single model batch
+    instead of each sending a partial one.
+
+    By default each image gets `max_evals` evaluations. Given a time budget
+    or a convergence target, the attributions are refined in steps instead:
+    the map is compared with the one from the previous step (checkpoints at
+    `first_evals`, then doubling), and refinement stops when the remaining
+    budget cannot fit another batch (the last one is shrunk to fit), the two
+    maps agree to `target`, or `max_refine_evals` is reached. The first step
+    always completes.
+
+    Args:
+        forward_fn: Callable mapping a (n, H, W, C) batch to (n, classes) outputs
+        input_shape: (H, W, C) of model inputs
+        max_batch_size: Largest merged batch sent to the model
+        max_wait_ms: How long a partial batch waits for other explanations
+        max_evals: SHAP evaluation budget per image when no budget or target is given
+        max_refine_evals: Evaluation cap for budgeted / targeted explanations
+        first_evals: Evaluations in the first refinement step
+        step_evals: Evaluations per batch; the budget is checked between batches
+        target: Default convergence target for budgeted explanations
+    """
+
+    def __init__(self, forward_fn, input_shape, max_batch_size=128, max_wait_ms=20.0, max_evals=50,
+                 max_refine_evals=4096, first_evals=32, step_evals=64, target=0.98):
+        self.forward_fn = forward_fn
+        self.input_shape = tuple(input_shape)
+        self.max_evals = max_evals
+        self.max_refine_evals = max_refine_evals
+        self.first_evals = first_evals
+        self.step_evals = step_evals
+        self.target = target
+        self._batcher = MicroBatcher(
+            self._forward, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, name="shap"
+        ).start()
+
+    def _forward(self, batch):
+        preds = np.asarray(self.forward_fn(batch))
+        # Handle binary classification (1 output node)
+        if preds.shape[-1] == 1:
+            return np.hstack([1 - preds, preds])
+        return preds
+
+    def submit(self, X):
+        """Queue model evaluations alongside the explanations' own; returns a Future of (n, classes)."""
+        return self._batcher.submit(np.asarray(X, dtype=np.float32))
+
+    def _predict(self, X):
+        return self.submit(X).result()
+
+    def explain(self, img_array, progress=None, budget_s=None, target=None):
+        """Explain one image (1, H, W, C).
+
+        Args:
+            img_array: Preprocessed image batch of one
+            progress: Optional callback receiving the completed fraction in [0, 1]
+            budget_s: Seconds to spend refining; None for no time limit
+            target: Stop once consecutive steps' maps correlate this well;
+                defaults to `self.target` when a budget is given
+
+        Returns:
+            (shap_values, expected_value, quality): values are
+            (1, H, W, 1, classes), one attribution per pixel; quality holds
+            `evals`, `steps`, `convergence` (similarity to the previous step's
+            map, None after one step), `stopped` ("max_evals", "budget",
+            "converged" or "exhausted") and `ms`.
+        """
+        started = time.perf_counter()
+        refining = budget_s is not None or target is not None
+        if refining and target is None:
+            target = self.target
+        limit = self.max_refine_evals if refining else self.max_evals
+        deadline = started + budget_s if budget_s is not None else None
+
+        refiner = OwenRefiner(self._predict, img_array[0])
+        pred_class = int(np.argmax(refiner.output))
+        checkpoint = min(self.first_evals, limit)
+        previous = convergence = stopped = None
+        steps = snapshot_evals = 0
+        eval_s = 0.0
+
+        while True:
+            while refiner.evals < checkpoint and stopped is None:
+                now = time.perf_counter()
+                evals = min(self.step_evals, checkpoint - refiner.evals)
+                if deadline is not None and steps > 0:
+                    # Shrink the batch to what fits; stop when not even one split does.
+                    evals = min(evals, int((deadline - now) / eval_s) if eval_s else evals)
+                    if evals < 2:
+                        stopped = "budget"
+                        break
+                used = refiner.refine(evals)
+                if not used:
+                    stopped = "exhausted"  # every pixel has its final value
+                    break
+                # The slowest rate so far predicts the next batch (other
+                # explanations share the batcher, so it varies with load).
+                eval_s = max(eval_s, (time.perf_counter() - now) / used)
+                if progress is not None:
+                    fraction = refiner.evals / limit
+                    if budget_s:
+                        fraction = max(fraction, (time.perf_counter() - started) / budget_s)
+                    progress(min(fraction, 1.0))
+
+            if refiner.evals > snapshot_evals:
+                steps += 1
+                snapshot_evals = refiner.evals
+                values = refiner.snapshot()
+                current = np.abs(values[..., pred_class])
+                if previous is not None:
+                    convergence = map_similarity(previous, current)
+                previous = current
+            if stopped is not None:
+                break
+            if convergence is not None and refining and convergence >= target:
+                stopped = "converged"
+            elif refiner.evals >= limit:
+                stopped = "max_evals"
+            checkpoint = min(checkpoint * 2, limit)
+
+        quality = {
+            "evals": refiner.evals,
+            "steps": steps,
+            "convergence": round(convergence, 4) if convergence is not None else None,
+            "stopped": stopped,
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        return values[np.newaxis, :, :, np.newaxis, :], refiner.base_value, quality
+
+    def stats(self):
+        return self._batcher.stats()
+
+    def stop(self):
+        self._batcher.stop()
+
+
+def compute_shap(model, img_array, background_data=None, num_samples=50, progress=None, service=None,
+                 budget_s=None, target=None):
     """
     Compute SHAP values for image classification.
     
@@ -151,25 +496,40 @@ def compute_shap(model, img_array, background_data=None, num_samples=50):
         img_array: Input image array (1, H, W, C)
         background_data: Background samples for SHAP (optional)
         num_samples: Number of samples for GradientExplainer
+        progress: Optional callback receiving the evaluated fraction in [0, 1]
+        service: Optional ShapService; when given, it does the work instead of
+            a one-off explainer around `model`
+        budget_s: Refinement time budget (ShapService only)
+        target: Convergence target (ShapService only)
     
     Returns:
         shap_values: SHAP values array
         base_value: Base value (expected prediction)
+        quality: Evaluations spent, refinement steps, convergence score and
+            why refinement stopped (see ShapService.explain)
     """
     
     try:
-        # Debug Logging
-        with open("shap_debug.log", "a") as log_file:
-            log_file.write(f"\n--- New SHAP Request ---\n")
-            log_file.write(f"Input shape: {img_array.shape}\n")
-        
-        print("🔄 Computing SHAP values...")
-        
+        if service is not None:
+            shap_values, expected_value, quality = service.explain(
+                img_array, progress=progress, budget_s=budget_s, target=target
+            )
+            logger.debug("SHAP computed using shared ShapService (%d evals, stopped: %s)", quality["evals"], quality["stopped"])
+            return shap_values, expected_value, quality
+
+        logger.debug("SHAP request, input shape: %s", img_array.shape)
+
         # 1. Define Prediction Wrapper
+        max_evals = 50
+        evaluated = [0]
+
         def f(X):
             if isinstance(X, list):
                 X = np.array(X)
             preds = model.predict(X)
+            if progress is not None:
+                evaluated[0] += len(X)
+                progress(min(evaluated[0] / max_evals, 1.0))
             # Handle binary classification (1 output node)
             if preds.shape[-1] == 1:
                 return np.hstack([1 - preds, preds])
@@ -177,138 +537,65 @@ def compute_shap(model, img_array, background_data=None, num_samples=50):
 
         # 2. Try generic Explainer (Permutation/Partition/Exact)
         try:
+            shap = import_shap()
             # Use 'blur' for significantly faster masking than 'inpaint_telea'
             masker = shap.maskers.Image("blur(10,10)", img_array[0].shape)
             # Create explainer - output_names will be auto-detected or 0,1
             explainer = shap.Explainer(f, masker)
             # Reduced evals for speed (User requested "fast scan")
-            shap_values = explainer(img_array, max_evals=50, batch_size=100)
-            print("✅ SHAP computed using shap.Explainer (Optimized)")
+            shap_values = explainer(img_array, max_evals=max_evals, batch_size=100)
+            logger.debug("SHAP computed using shap.Explainer")
             
             # Return values (shap_values, expected_value)
             # Handle different explainer return types
             expected_value = 0
             if hasattr(explainer, 'expected_value'):
                  expected_value = explainer.expected_value
+            quality = {"evals": evaluated[0], "steps": 1, "convergence": None, "stopped": "max_evals"}
             
-            return shap_values, expected_value
+            return shap_values, expected_value, quality
 
         except Exception as e:
-            err_msg = f"shap.Explainer process failed: {str(e)}"
-            print(f"⚠️ {err_msg}")
-            with open("shap_debug.log", "a") as log_file:
-                log_file.write(f"{err_msg}\n")
-            import traceback
-            traceback.print_exc() 
-            return None, None
+            logger.exception("shap.Explainer process failed: %s", e)
+            return None, None, None
     
     except Exception as e:
-        err_msg = f"❌ compute_shap wrapper failed: {str(e)}"
-        print(err_msg)
-        with open("shap_debug.log", "a") as log_file:
-            log_file.write(f"{err_msg}\n")
-        return None, None
+        logger.exception("compute_shap wrapper failed: %s", e)
+        return None, None, None
 
 
-def generate_shap_plot(model, img_array, original_image, save_path, class_names=None):
+def render_shap_image(model, img_array, original_rgb, class_names=None, preds=None,
+                      progress=None, shap_service=None, fmt="png", budget_s=None, target=None):
     """
-    Generate and save a SHAP visualization plot.
-    
+    Run SHAP for one image and render the three-panel explanation in memory.
+
     Args:
-        model: Keras model
+        model: Keras model (only called when neither preds nor shap_service is given)
         img_array: Preprocessed image array (1, H, W, C)
-        original_image: Original image for overlay
-        save_path: Path to save the SHAP plot
+        original_rgb: Original image, (H, W, 3) uint8 RGB
         class_names: List of class names
-    
+        preds: Prediction vector already computed for img_array (skips a forward pass)
+        progress: Optional callback receiving SHAP progress in [0, 1]
+        shap_service: Optional ShapService to batch evaluations with other requests
+        fmt: Image encoding, "png" or "webp"
+        budget_s: Refinement time budget for the ShapService
+        target: Convergence target for the ShapService
+
     Returns:
-        True if successful, False otherwise
+        (encoded image bytes, quality), or (None, None) if SHAP failed
     """
-    
-    try:
-        shap_values, base_value = compute_shap(model, img_array)
-        
-        if shap_values is None:
-            return False
-        
-        # Get prediction
-        pred = model(img_array, training=False).numpy()
-        pred_class = np.argmax(pred[0])
-        
-        # Create the SHAP visualization
-        plt.figure(figsize=(12, 4))
-        
-        # Handle different SHAP value formats
-        if isinstance(shap_values, list):
-            # Multi-class output
-            shap_val = shap_values[pred_class][0]
-        elif hasattr(shap_values, 'values'):
-            # Explanation object
-            shap_val = shap_values.values[0]
-            if len(shap_val.shape) > 3:
-                shap_val = shap_val[..., pred_class]
-        else:
-            shap_val = shap_values[0]
-            if len(shap_val.shape) > 3:
-                shap_val = shap_val[..., pred_class]
-        
-        # Sum across color channels for visualization
-        if len(shap_val.shape) == 3:
-            shap_val_2d = np.sum(np.abs(shap_val), axis=-1)
-        else:
-            shap_val_2d = shap_val
-        
-        # Normalize
-        shap_val_2d = (shap_val_2d - shap_val_2d.min()) / (shap_val_2d.max() - shap_val_2d.min() + 1e-8)
-        
-        # Plot 1: Original Image
-        plt.subplot(1, 3, 1)
-        if isinstance(original_image, np.ndarray):
-            plt.imshow(cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB) if len(original_image.shape) == 3 else original_image)
-        else:
-            plt.imshow(img_array[0])
-        plt.title("Original Image")
-        plt.axis('off')
-        
-        # Plot 2: SHAP Values Heatmap
-        plt.subplot(1, 3, 2)
-        plt.imshow(shap_val_2d, cmap='RdBu_r')
-        plt.colorbar(label='SHAP Value')
-        class_label = class_names[pred_class] if class_names and pred_class < len(class_names) else f"Class {pred_class}"
-        plt.title(f"SHAP: {class_label}")
-        plt.axis('off')
-        
-        # Plot 3: Overlay
-        plt.subplot(1, 3, 3)
-        # Resize SHAP values to match original image
-        shap_resized = cv2.resize(shap_val_2d, (224, 224))
-        
-        # Create overlay
-        if isinstance(original_image, np.ndarray):
-            base_img = cv2.cvtColor(cv2.resize(original_image, (224, 224)), cv2.COLOR_BGR2RGB) / 255.0
-        else:
-            base_img = img_array[0]
-        
-        # Apply colormap to SHAP
-        shap_colored = plt.cm.RdBu_r(shap_resized)[:, :, :3]
-        
-        # Blend
-        overlay = 0.6 * base_img + 0.4 * shap_colored
-        overlay = np.clip(overlay, 0, 1)
-        
-        plt.imshow(overlay)
-        plt.title("SHAP Overlay")
-        plt.axis('off')
-        
-        plt.tight_layout()
-        plt.savefig(save_path, dpi=100, bbox_inches='tight', facecolor='white')
-        plt.close()
-        
-        print(f"✅ SHAP plot saved to {save_path}")
-        return True
-        
-    except Exception as e:
-        print(f"❌ SHAP plot generation failed: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+    with stage("shap"):
+        shap_values, base_value, quality = compute_shap(
+            model, img_array, progress=progress, service=shap_service, budget_s=budget_s, target=target
+        )
+    if shap_values is None:
+        return None, None
+
+    if preds is None:
+        preds = np.asarray(model(img_array, training=False))
+    pred_class = int(np.argmax(np.reshape(preds, (-1,))))
+    class_label = class_names[pred_class] if class_names and pred_class < len(class_names) else f"Class {pred_class}"
+
+    with stage("render"):
+        saliency = render.shap_map(shap_values, pred_class)
+        return render.render_shap_panels(original_rgb, saliency, f"SHAP: {class_label}", fmt=fmt), quality
@@ -0,0 +1,292 @@
+import json
+import struct
+
+import numpy as np
+
+from federated.shards import ShardWriter, UpdateShard
+
+
+# =========================
+# COMPRESSED UPDATE STREAM
+# =========================
+# Clients send what changed, not their whole model: the delta against the
+# round's base weights, cut into fixed-size chunks that are each optionally
+# top-k sparsified and quantized (float16, or int8 with a per-chunk scale).
+# Frames are encoded and decoded one chunk at a time, so neither side holds
+# more than a chunk of the update in memory. The decoder adds the delta back
+# onto the base and writes a regular weight shard for the aggregator.
+
+STREAM_MAGIC = b"FEDDLT1\n"
+FRAME = struct.Struct("<HQIBI")  # tensor index, start, count, kind, payload bytes
+
+RAW = 0  # non-float tensor, sent verbatim in its own dtype (not a delta)
+FP32 = 1
+FP16 = 2
+INT8 = 3
+TOPK = 0x10  # flag: payload holds k indices + k values instead of every value
+
+QUANT_KINDS = {"fp32": FP32, "fp16": FP16, "int8": INT8}
+
+
+class UpdateCodec:
+    """Encoding settings for client updates.
+
+    Args:
+        quant: Value encoding: "fp32", "fp16" or "int8" (symmetric, one float32
+            scale per chunk).
+        topk: Fraction of each chunk's entries to keep (largest magnitude), or
+            None to send every entry. Pair with ErrorFeedback so dropped mass
+            is carried into the next round instead of lost.
+        chunk_elems: Elements per frame; at most 65536 keeps top-k indices at
+            two bytes each.
+        min_topk_elems: Tensors smaller than this (biases, BatchNorm
+            statistics) are always sent dense; they cost little and do not
+            tolerate sparsification.
+    """
+
+    def __init__(self, quant="int8", topk=None, chunk_elems=65536, min_topk_elems=4096):
+        if quant not in QUANT_KINDS:
+            raise ValueError(f"Unknown quantization {quant!r}; expected one of {sorted(QUANT_KINDS)}")
+        if topk is not None and not 0 < topk <= 1:
+            raise ValueError("topk must be a fraction in (0, 1]")
+        self.quant = quant
+        self.topk = topk
+        self.chunk_elems = int(chunk_elems)
+        self.min_topk_elems = int(min_topk_elems)
+
+    @classmethod
+    def from_spec(cls, spec, **kwargs):
+        """Parse "int8", "fp16", "top0.01+int8" (top-k fraction + quantization)."""
+        topk = None
+        if spec.startswith("top"):
+            fraction, _, spec = spec[3:].partition("+")
+            topk = float(fraction)
+            spec = spec or "fp32"
+        return cls(quant=spec, topk=topk, **kwargs)
+
+    @property
+    def name(self):
+        return self.quant if self.topk is None else f"top{self.topk:g}+{self.quant}"
+
+    def describe(self):
+        return {
+            "quant": self.quant,
+            "topk": self.topk,
+            "chunk_elems": self.chunk_elems,
+            "min_topk_elems": self.min_topk_elems,
+        }
+
+    # ---- one chunk ----
+    def encode_chunk(self, values, sparse=True):
+        """Return (kind, payload, decoded) for a float chunk of the delta."""
+        kind = QUANT_KINDS[self.quant]
+        indices = None
+        if sparse and self.topk is not None and self.topk < 1:
+            k = max(1, int(np.ceil(self.topk * values.size)))
+            indices = np.sort(np.argpartition(np.abs(values), -k)[-k:])
+            kept = values[indices]
+            kind |= TOPK
+        else:
+            kept = values
+
+        payload, restored = _quantize(kept, kind & 0x0F)
+        if indices is not None:
+            index_dtype = np.uint16 if values.size <= 1 << 16 else np.uint32
+            payload = indices.astype(index_dtype).tobytes() + payload
+            decoded = np.zeros_like(values)
+            decoded[indices] = restored
+        else:
+            decoded = restored
+        return kind, payload, decoded
+
+
+class ErrorFeedback:
+    """Per-client residuals: what compression dropped, re-sent next round.
+
+    Residuals are kept per tensor in memory (one model's worth of float32 on
+    the client) and can be persisted between rounds with save()/load().
+    """
+
+    def __init__(self):
+        self.residuals = {}
+
+    def apply(self, name, start, values):
+        residual = self.residuals.get(name)
+        if residual is None:
+            return values
+        return values + residual[start : start + values.size]
+
+    def update(self, name, start, size, error):
+        residual = self.residuals.get(name)
+        if residual is None:
+            residual = self.residuals[name] = np.zeros(size, dtype=np.float32)
+        residual[start : start + error.size] = error
+
+    def save(self, path):
+        np.savez(path, **{_safe_key(k): v for k, v in self.residuals.items()}, __names__=np.array(list(self.residuals)))
+
+    @classmethod
+    def load(cls, path):
+        feedback = cls()
+        with np.load(path) as data:
+            for name in data["__names__"]:
+                feedback.residuals[str(name)] = data[_safe_key(str(name))]
+        return feedback
+
+
+# =========================
+# ENCODE / DECODE
+# =========================
+
+def encode_update(shard_path, base_path, codec, feedback=None):
+    """Yield the compressed stream (header, then one frame per chunk) for a client shard.
+
+    `shard_path` holds the client's locally trained weights, `base_path` the
+    round's starting weights. With `feedback`, each chunk's compression error
+    is stored and added to the same chunk next round.
+    """
+    client = UpdateShard(shard_path)
+    base = UpdateShard(base_path)
+    if client.specs != base.specs:
+        raise ValueError(f"{shard_path} does not match the base model architecture")
+
+    header = json.dumps({
+        "specs": client.specs,
+        "num_examples": client.num_examples,
+        "metadata": client.metadata,
+        "base": base.metadata,
+        "codec": codec.describe(),
+    }).encode("utf-8")
+    yield STREAM_MAGIC + struct.pack("<I", len(header)) + header
+
+    for index, spec in enumerate(client.specs):
+        name = spec["name"]
+        size = int(np.prod(spec["shape"], dtype=np.int64))
+        if not np.issubdtype(np.dtype(spec["dtype"]), np.floating):
+            payload = np.array(client.array(name)).tobytes()
+            yield FRAME.pack(index, 0, size, RAW, len(payload)) + payload
+            continue
+        for start in range(0, size, codec.chunk_elems):
+            count = min(codec.chunk_elems, size - start)
+            delta = np.asarray(client.array(name, start, count), dtype=np.float32) - base.array(name, start, count)
+            if feedback is not None:
+                delta = feedback.apply(name, start, delta)
+            kind, payload, decoded = codec.encode_chunk(delta, sparse=size >= codec.min_topk_elems)
+            if feedback is not None:
+                feedback.update(name, start, size, delta - decoded)
+            yield FRAME.pack(index, start, count, kind, len(payload)) + payload
+
+
+def decode_update(stream, base_path, out_path):
+    """Rebuild a client's weight shard from a compressed stream.
+
+    `stream` is a binary file-like object (socket file, upload, open file);
+    it is read frame by frame. Returns the stream header.
+    """
+    if _read_exact(stream, len(STREAM_MAGIC)) != STREAM_MAGIC:
+        raise ValueError("Not a compressed client update stream")
+    (length,) = struct.unpack("<I", _read_exact(stream, 4))
+    header = json.loads(_read_exact(stream, length).decode("utf-8"))
+
+    base = UpdateShard(base_path)
+    if header["specs"] != base.specs:
+        raise ValueError("Update was computed against a different base model")
+
+    specs = header["specs"]
+    with ShardWriter(out_path, specs, header["num_examples"], header["metadata"]) as writer:
+        written = set()
+        while True:
+            raw = stream.read(FRAME.size)
+            if not raw:
+                break
+            if len(raw) < FRAME.size:
+                raw += _read_exact(stream, FRAME.size - len(raw))
+            index, start, count, kind, nbytes = FRAME.unpack(raw)
+            spec = specs[index]
+            payload = _read_exact(stream, nbytes)
+            if kind == RAW:
+                writer.write(spec["name"], np.frombuffer(payload, dtype=np.dtype(spec["dtype"])))
+            else:
+                delta = _dequantize(payload, kind, count)
+                writer.write(spec["name"], base.array(spec["name"], start, count) + delta, start)
+            written.add(index)
+        # Tensors with no frames at all are unchanged from the base.
+        for index, spec in enumerate(specs):
+            if index not in written:
+                writer.write(spec["name"], np.array(base.array(spec["name"])).reshape(-1))
+    return header
+
+
+def write_stream(frames, fileobj):
+    """Write an encoded stream to a file; returns the bytes written."""
+    total = 0
+    for frame in frames:
+        fileobj.write(frame)
+        total += len(frame)
+    return total
+
+
+# =========================
+# QUANTIZATION
+# =========================
+
+def _quantize(values, kind):
+    """Return (payload bytes, dequantized values) for one chunk."""
+    if kind == FP32:
+        data = values.astype(np.float32)
+        return data.tobytes(), data
+    if kind == FP16:
+        data = values.astype(np.float16)
+        return data.tobytes(), data.astype(np.float32)
+    peak = float(np.max(np.abs(values))) if values.size else 0.0
+    scale = peak / 127.0 if peak > 0 else 1.0
+    data = np.clip(np.rint(values / scale), -127, 127).astype(np.int8)
+    return struct.pack("<f", scale) + data.tobytes(), data.astype(np.float32) * np.float32(scale)
+
+
+def _dequantize(payload, kind, count):
+    base_kind = kind & 0x0F
+    indices = None
+    if kind & TOPK:
+        k = _topk_count(len(payload), base_kind, count)
+        index_dtype = np.uint16 if count <= 1 << 16 else np.uint32
+        index_bytes = k * np.dtype(index_dtype).itemsize
+        indices = np.frombuffer(payload[:index_bytes], dtype=index_dtype)
+        payload = payload[index_bytes:]
+
+    if base_kind == FP32:
+        values = np.frombuffer(payload, dtype=np.float32)
+    elif base_kind == FP16:
+        values = np.frombuffer(payload, dtype=np.float16).astype(np.float32)
+    elif base_kind == INT8:
+        (scale,) = struct.unpack("<f", payload[:4])
+        values = np.frombuffer(payload[4:], dtype=np.int8).astype(np.float32) * np.float32(scale)
+    else:
+        raise ValueError(f"Unknown frame kind {kind}")
+
+    if indices is None:
+        return values
+    delta = np.zeros(count, dtype=np.float32)
+    delta[indices] = values
+    return delta
+
+
+def _topk_count(nbytes, base_kind, count):
+    index_size = 2 if count <= 1 << 16 else 4
+    value_size = {FP32: 4, FP16: 2, INT8: 1}[base_kind]
+    overhead = 4 if base_kind == INT8 else 0
+    return (nbytes - overhead) // (index_size + value_size)
+
+
+def _read_exact(stream, n):
+    data = b""
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            raise ValueError("Truncated client update stream")
+        data += chunk
+    return data
+
+
+def _safe_key(name):
+    return name.replace("/", "__").replace(":", "_").replace("#", "_")
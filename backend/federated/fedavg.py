@@ -0,0 +1,189 @@
+"""Streaming FedAvg: average client update shards into a new global model.
+
+Run from the backend directory:
+
+    python -m federated.fedavg --updates runs/round_1 --modality brain --promote
+
+Every `*.shard` in --updates is averaged (weighted by its num_examples) slice
+by slice; compressed `*.delta` streams are first decoded against the round's
+base weights (--base, default <updates>/base.weights). The result is loaded
+into the current global model's architecture and saved as
+models/global_<Modality>_model-<version>.keras. --promote also copies it over
+the live model file, which the API hot-swaps in.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from federated.codec import decode_update
+from federated.shards import ShardWriter, UpdateShard, weight_names
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_FOLDER = os.path.join(BASE_DIR, "models")
+
+# Elements averaged per step; bounds the accumulator (float64) and the pages
+# mapped from each client at once.
+DEFAULT_CHUNK_ELEMS = 1 << 20
+
+
+# =========================
+# STREAMING FEDAVG
+# =========================
+
+def fedavg(shard_paths, output_path, chunk_elems=DEFAULT_CHUNK_ELEMS, metadata=None):
+    """Weighted FedAvg of client shards, written to `output_path` as a shard.
+
+    Works layer by layer and, within a layer, `chunk_elems` elements at a
+    time: each client's slice is memory-mapped, added into a float64
+    accumulator with weight n_k / sum(n), and unmapped again. Peak memory is
+    one chunk plus one accumulator regardless of how many clients there are.
+    Non-float tensors (step counters and the like) are taken from the first
+    client.
+
+    Returns a summary dict (clients, examples, tensors, parameters, seconds).
+    """
+    if not shard_paths:
+        raise ValueError("No client updates to aggregate")
+    started = time.perf_counter()
+    shards = [UpdateShard(p) for p in shard_paths]
+    specs = shards[0].specs
+    for shard in shards[1:]:
+        if shard.specs != specs:
+            raise ValueError(f"{shard.path} does not match the architecture of {shards[0].path}")
+
+    examples = np.array([max(0, s.num_examples) for s in shards], dtype=np.float64)
+    if examples.sum() <= 0:
+        examples[:] = 1.0  # no counts reported: plain average
+    weights = examples / examples.sum()
+
+    parameters = 0
+    summary_meta = {
+        "clients": len(shards),
+        "examples": int(examples.sum()),
+        **(metadata or {}),
+    }
+    with ShardWriter(output_path, specs, int(examples.sum()), summary_meta) as writer:
+        for spec in specs:
+            name = spec["name"]
+            size = int(np.prod(spec["shape"], dtype=np.int64))
+            parameters += size
+            if not np.issubdtype(np.dtype(spec["dtype"]), np.floating):
+                writer.write(name, np.array(shards[0].array(name)).reshape(-1))
+                continue
+            for start in range(0, size, chunk_elems):
+                count = min(chunk_elems, size - start)
+                acc = np.zeros(count, dtype=np.float64)
+                for shard, weight in zip(shards, weights):
+                    part = shard.array(name, start, count)
+                    acc += weight * part
+                    del part  # unmap before touching the next client
+                writer.write(name, acc, start)
+
+    return {
+        "clients": len(shards),
+        "examples": int(examples.sum()),
+        "tensors": len(specs),
+        "parameters": parameters,
+        "seconds": round(time.perf_counter() - started, 3),
+        "output": output_path,
+    }
+
+
+# =========================
+# GLOBAL MODEL OUTPUT
+# =========================
+
+def build_global_model(template_path, shard_path, output_path):
+    """Load `template_path`, set its weights from an averaged shard, save it."""
+    os.environ.setdefault("KERAS_BACKEND", "tensorflow")
+    try:
+        import keras
+    except ImportError:
+        from tensorflow import keras
+
+    model = keras.models.load_model(template_path, compile=False)
+    shard = UpdateShard(shard_path)
+    names = weight_names(model)
+    if len(names) != len(shard.tensors):
+        raise ValueError(
+            f"Aggregated update has {len(shard.tensors)} tensors, model has {len(names)}"
+        )
+    values = []
+    for variable, name, tensor in zip(model.weights, names, shard.tensors):
+        if tuple(variable.shape) != tuple(tensor["shape"]):
+            raise ValueError(f"Shape mismatch for {name}: {tensor['shape']} vs {tuple(variable.shape)}")
+        values.append(np.array(shard.array(tensor["name"])))
+    model.set_weights(values)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    model.save(output_path)
+    return output_path
+
+
+def promote(model_path, live_path):
+    """Atomically replace the live model file; the API's watcher picks it up."""
+    tmp_path = f"{live_path}.incoming"
+    shutil.copyfile(model_path, tmp_path)
+    os.replace(tmp_path, live_path)
+    return live_path
+
+
+def global_model_path(modality, version=None):
+    name = f"global_{modality.capitalize()}_model"
+    if version is None:
+        return os.path.join(MODEL_FOLDER, f"{name}.keras")
+    return os.path.join(MODEL_FOLDER, f"{name}-{version}.keras")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", required=True, help="Directory of client *.shard / *.delta files")
+    parser.add_argument("--modality", default="brain")
+    parser.add_argument("--template", help="Architecture source (default: the live global model)")
+    parser.add_argument("--base", help="Round base weights for *.delta updates (default: <updates>/base.weights)")
+    parser.add_argument("--version", help="Version tag for the output file (default: UTC timestamp)")
+    parser.add_argument("--chunk-elems", type=int, default=DEFAULT_CHUNK_ELEMS)
+    parser.add_argument("--promote", action="store_true", help="Replace the live global model")
+    args = parser.parse_args()
+
+    shard_paths = sorted(glob.glob(os.path.join(args.updates, "*.shard")))
+    delta_paths = sorted(glob.glob(os.path.join(args.updates, "*.delta")))
+    if delta_paths:
+        base_path = args.base or os.path.join(args.updates, "base.weights")
+        decoded_dir = os.path.join(args.updates, "decoded")
+        for path in delta_paths:
+            out = os.path.join(decoded_dir, os.path.basename(path)[: -len(".delta")] + ".shard")
+            with open(path, "rb") as f:
+                decode_update(f, base_path, out)
+            shard_paths.append(out)
+        print(f"📦 Decoded {len(delta_paths)} compressed update(s)")
+    version = args.version or time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    live_path = global_model_path(args.modality)
+    template = args.template or live_path
+    output_path = global_model_path(args.modality, version)
+
+    print(f"🔄 Aggregating {len(shard_paths)} client update(s) from {args.updates}...")
+    averaged = os.path.join(args.updates, f"global-{version}.avg")
+    summary = fedavg(
+        shard_paths, averaged, args.chunk_elems, metadata={"modality": args.modality, "version": version}
+    )
+    print(
+        f"✅ FedAvg over {summary['clients']} clients / {summary['examples']} examples "
+        f"({summary['parameters']:,} parameters) in {summary['seconds']}s"
+    )
+
+    build_global_model(template, averaged, output_path)
+    os.remove(averaged)
+    print(f"💾 Saved {output_path}")
+    if args.promote:
+        promote(output_path, live_path)
+        print(f"🚀 Promoted to {live_path}")
+    print(json.dumps({**summary, "output": output_path, "promoted": args.promote}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+
+# =========================
+# CLIENT UPDATE SHARDS
+# =========================
+# One file per client update: a small JSON header followed by every weight
+# tensor as raw little-endian bytes, each aligned to 64 bytes. Tensors are read
+# back through memory maps, so the aggregator only touches the pages of the
+# slice it is currently averaging.
+
+MAGIC = b"FEDUPD1\n"
+ALIGN = 64
+
+
+def _spec(name, array):
+    array = np.asarray(array)
+    return {"name": name, "shape": list(array.shape), "dtype": array.dtype.str}
+
+
+class ShardWriter:
+    """Write a shard tensor by tensor (or slice by slice) without holding it in RAM.
+
+    The file is written under a temporary name and renamed into place by
+    `close()`, so readers never see a partial shard.
+
+    Args:
+        path: Destination file.
+        specs: List of {"name", "shape", "dtype"} in model weight order.
+        num_examples: Local training examples behind this update (FedAvg weight).
+        metadata: Extra JSON-able fields (client id, round, base version...).
+    """
+
+    def __init__(self, path, specs, num_examples=0, metadata=None):
+        self.path = path
+        self.tensors = []
+        offset = 0
+        for spec in specs:
+            nbytes = int(np.prod(spec["shape"], dtype=np.int64)) * np.dtype(spec["dtype"]).itemsize
+            self.tensors.append({**spec, "offset": offset, "nbytes": nbytes})
+            offset += _aligned(nbytes)
+        header = {
+            "num_examples": int(num_examples),
+            "metadata": metadata or {},
+            "tensors": self.tensors,
+        }
+        encoded = json.dumps(header).encode("utf-8")
+        self.data_start = _aligned(len(MAGIC) + 4 + len(encoded))
+        self._index = {t["name"]: t for t in self.tensors}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._tmp_path = f"{path}.tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+        self._file.truncate(self.data_start + offset)
+
+    def write(self, name, values, start=0):
+        """Write `values` into tensor `name` at flat element offset `start`."""
+        tensor = self._index[name]
+        values = np.ascontiguousarray(values, dtype=np.dtype(tensor["dtype"]))
+        self._file.seek(self.data_start + tensor["offset"] + start * values.itemsize)
+        self._file.write(values.tobytes())
+
+    def close(self):
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class UpdateShard:
+    """Read-only view of a shard; tensors come back as memory maps."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a client update shard")
+            (length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(length).decode("utf-8"))
+        self.num_examples = header["num_examples"]
+        self.metadata = header["metadata"]
+        self.tensors = header["tensors"]
+        self.data_start = _aligned(len(MAGIC) + 4 + length)
+        self._index = {t["name"]: t for t in self.tensors}
+
+    @property
+    def names(self):
+        return [t["name"] for t in self.tensors]
+
+    @property
+    def specs(self):
+        return [{"name": t["name"], "shape": t["shape"], "dtype": t["dtype"]} for t in self.tensors]
+
+    def array(self, name, start=0, count=None):
+        """Memory-mapped tensor `name`; with start/count, a flat slice of it.
+
+        Each call maps only the requested range; the mapping is released when
+        the returned array is garbage collected.
+        """
+        tensor = self._index[name]
+        dtype = np.dtype(tensor["dtype"])
+        size = tensor["nbytes"] // dtype.itemsize
+        if size == 0:
+            return np.zeros(tensor["shape"], dtype=dtype)
+        offset = self.data_start + tensor["offset"]
+        if count is None and start == 0:
+            return np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=tuple(tensor["shape"]))
+        count = size - start if count is None else count
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=offset + start * dtype.itemsize, shape=(count,))
+
+
+def write_update(path, named_arrays, num_examples=0, metadata=None):
+    """Write a list of (name, array) pairs as a shard."""
+    named_arrays = list(named_arrays)
+    with ShardWriter(path, [_spec(n, a) for n, a in named_arrays], num_examples, metadata) as writer:
+        for name, array in named_arrays:
+            writer.write(name, np.asarray(array).reshape(-1))
+    return path
+
+
+def weight_names(model):
+    """Stable, unique names for `model.weights`, in order (Keras 2 and 3)."""
+    names = []
+    for i, w in enumerate(model.weights):
+        name = getattr(w, "path", None) or w.name
+        names.append(name if name not in names else f"{name}#{i}")
+    return names
+
+
+def export_model(model, path, num_examples=0, metadata=None):
+    """Write a Keras model's weights as a shard (e.g. the round's base model)."""
+    return write_update(
+        path, zip(weight_names(model), model.get_weights()), num_examples, metadata
+    )
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
@@ -0,0 +1,113 @@
+"""Simulated federated clients, one OS process each.
+
+Run from the backend directory:
+
+    python -m federated.simulate --clients 8 --out runs/round_1
+
+Exports the current global model (or a synthetic stand-in) as the round's
+base shard, then starts client processes that each write an update shard:
+the base weights plus a deterministic, client-specific perturbation standing
+in for local training, and a random local example count. Clients only need
+NumPy, so many of them can run side by side on a small machine.
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from federated.codec import UpdateCodec, encode_update, write_stream
+from federated.shards import ShardWriter, UpdateShard, export_model
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL = os.path.join(BASE_DIR, "models", "global_Brain_model.keras")
+CHUNK_ELEMS = 1 << 20
+
+
+# =========================
+# SIMULATED CLIENTS
+# =========================
+
+def run_client(base_path, out_path, client_id, seed=0, scale=0.01, codec=None):
+    """Write one client's update shard derived from the base shard.
+
+    Reads the base weights slice by slice through memory maps, so a client's
+    footprint is one chunk, not one model. With a `codec` spec (e.g.
+    "top0.01+int8"), the client instead sends a compressed delta stream
+    (`.delta` next to `out_path`), as it would over the network.
+    """
+    base = UpdateShard(base_path)
+    rng = np.random.default_rng([seed, client_id])
+    num_examples = int(rng.integers(50, 500))
+    meta = {**base.metadata, "client_id": client_id}
+    with ShardWriter(out_path, base.specs, num_examples, meta) as writer:
+        for spec in base.specs:
+            name = spec["name"]
+            size = int(np.prod(spec["shape"], dtype=np.int64))
+            floating = np.issubdtype(np.dtype(spec["dtype"]), np.floating)
+            for start in range(0, size, CHUNK_ELEMS):
+                count = min(CHUNK_ELEMS, size - start)
+                values = np.array(base.array(name, start, count))
+                if floating:
+                    values += scale * rng.standard_normal(count).astype(values.dtype)
+                writer.write(name, values, start)
+    if codec is None:
+        return out_path
+
+    delta_path = os.path.splitext(out_path)[0] + ".delta"
+    with open(delta_path, "wb") as f:
+        write_stream(encode_update(out_path, base_path, UpdateCodec.from_spec(codec)), f)
+    os.remove(out_path)
+    return delta_path
+
+
+def _run_client(args):
+    return run_client(*args)
+
+
+def simulate_clients(base_path, out_dir, num_clients, processes=None, seed=0, scale=0.01, codec=None):
+    """Run `num_clients` simulated clients in a process pool; returns update paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [
+        (base_path, os.path.join(out_dir, f"client_{i:04d}.shard"), i, seed, scale, codec)
+        for i in range(num_clients)
+    ]
+    processes = processes or min(num_clients, os.cpu_count() or 1)
+    # Spawned (not forked) workers, like separate client machines: nothing is
+    # shared with the coordinator but the base shard on disk.
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        return pool.map(_run_client, jobs)
+
+
+def export_base(model_path, out_path, **metadata):
+    """Write the round's starting weights as a shard; returns its path."""
+    from benchmarks.synthetic_model import load_or_build
+
+    model, source = load_or_build(model_path)
+    export_model(model, out_path, metadata={"base": source, **metadata})
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Base global model for the round")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--processes", type=int, help="Concurrent client processes (default: CPUs)")
+    parser.add_argument("--out", required=True, help="Directory for client *.shard files")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=float, default=0.01, help="Std-dev of simulated local updates")
+    parser.add_argument("--codec", help='Send compressed deltas, e.g. "int8" or "top0.01+int8"')
+    args = parser.parse_args()
+
+    base_path = os.path.join(args.out, "base.weights")
+    export_base(args.model, base_path)
+    started = time.perf_counter()
+    paths = simulate_clients(
+        base_path, args.out, args.clients, args.processes, args.seed, args.scale, args.codec
+    )
+    print(f"✅ {len(paths)} client update(s) written to {args.out} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+# =========================
+# IN-MEMORY IMAGE DECODING
+# =========================
+# Uploads are decoded once, straight from the request bytes, into a single
+# 224x224 uint8 buffer. The model tensor, the Grad-CAM overlay and the SHAP
+# plot are all derived from that buffer, so nothing is re-read from disk.
+
+TARGET_SIZE = (224, 224)
+
+
+class DecodedImage:
+    """A decoded upload at model resolution.
+
+    `rgb` is the shared (H, W, 3) uint8 buffer; `bgr` (for OpenCV drawing) and
+    `tensor` (the (1, H, W, 3) float32 model input in [0, 1]) are derived from
+    it on first use and then reused.
+    """
+
+    __slots__ = ("rgb", "source_size", "_bgr", "_tensor")
+
+    def __init__(self, rgb, source_size=None):
+        self.rgb = rgb
+        self.source_size = source_size
+        self._bgr = None
+        self._tensor = None
+
+    @property
+    def bgr(self):
+        if self._bgr is None:
+            self._bgr = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2BGR)
+        return self._bgr
+
+    @property
+    def tensor(self):
+        if self._tensor is None:
+            img = self.rgb.astype(np.float32)
+            img /= 255.0
+            self._tensor = img[np.newaxis]
+        return self._tensor
+
+    def to_bytes(self):
+        """Compact lossless serialisation of the shared buffer (for job inputs)."""
+        buffer = io.BytesIO()
+        np.save(buffer, self.rgb, allow_pickle=False)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(np.load(io.BytesIO(data), allow_pickle=False))
+
+
+def decode_image(data, size=TARGET_SIZE, draft=True):
+    """Decode encoded image bytes into a DecodedImage of `size`.
+
+    With `draft=True`, JPEGs at least twice the target size are decoded at a
+    reduced scale by libjpeg (1/2, 1/4 or 1/8) before the final resize, which
+    skips most of the IDCT work for large scans.
+    """
+    img = Image.open(io.BytesIO(data))
+    source_size = img.size
+    if draft and img.format == "JPEG":
+        img.draft("RGB", size)
+    img = img.convert("RGB").resize(size)
+    return DecodedImage(np.asarray(img), source_size)
+
+
+# =========================
+# IMAGE PREPROCESS
+# =========================
+def preprocess_image(source, size=TARGET_SIZE, draft=False):
+    """Model input (1, H, W, 3) float32 in [0, 1] from a path or encoded bytes."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+    return decode_image(data, size=size, draft=draft).tensor
@@ -1,46 +1,325 @@
+"""Model profiler: per-layer parameters, FLOPs, activation memory and CPU latency.
+
+Run from the backend directory:
+
+    python inspect_model.py
+    python inspect_model.py --model models/global_Chest_model.keras --batch-sizes 1,16
+
+Writes a readable report to runs/model_info.txt and the same numbers as JSON
+to runs/model_profile.json (runs/ is not tracked). Layers are timed one by one on the activations the
+previous layer produced, so a layer's share of the time shows where a forward
+pass goes (e.g. flatten_1 -> dense_2). The end-to-end inference, Grad-CAM and
+all-class Grad-CAM steps are timed through explain.GradCamEngine, as served.
+Layers between the Grad-CAM target and the output are also timed backward,
+because Grad-CAM differentiates through them. --target-layer profiles another
+Grad-CAM target.
+
+FLOPs and memory are computed from the layer shapes: a multiply-add counts as
+two FLOPs, and activations are float32. Layer types without a formula have
+`flops: null`. Without a model file, the synthetic stand-in from
+benchmarks/synthetic_model.py is profiled, and the report says so.
+"""
+import argparse
+import json
 import os
+import time
 os.environ["KERAS_BACKEND"] = "tensorflow"
+
+import numpy as np
 import tensorflow as tf
 try:
     import keras
 except ImportError:
     from tensorflow import keras
 
+from benchmarks.synthetic_model import load_or_build
+from explain import GradCamEngine, find_last_conv_layer
+
 MODEL_PATH = os.path.join("models", "global_Brain_model.keras")
+RUNS_DIR = "runs"
+FLOAT_BYTES = 4
 
-try:
-    print(f"Loading model from {MODEL_PATH}...")
-    model = keras.models.load_model(MODEL_PATH, compile=False)
+
+# =========================
+# LAYER GRAPH
+# =========================
+
+def flat_layers(model):
+    """Layers in execution order, with nested models expanded (as GradCamEngine traces them)."""
+    layers = []
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.InputLayer):
+            continue
+        if hasattr(layer, 'layers') and len(layer.layers) > 0:
+            layers.extend(flat_layers(layer))
+        else:
+            layers.append(layer)
+    return layers
+
+
+def _elements(shape):
+    return int(np.prod([d for d in shape if d is not None]))
+
+
+def _activation_flops(layer, out_elems):
+    activation = getattr(layer, "activation", None)
+    if activation is None or getattr(activation, "__name__", "") == "linear":
+        return 0
+    return out_elems
+
+
+def layer_flops(layer, in_shape, out_shape):
+    """FLOPs for one sample through `layer`, or None for an unknown layer type."""
+    out_elems = _elements(out_shape)
+    in_elems = _elements(in_shape)
+    bias = out_elems if getattr(layer, "use_bias", False) else 0
+    if isinstance(layer, keras.layers.DepthwiseConv2D):
+        macs = out_elems * int(np.prod(layer.kernel_size))
+        return 2 * macs + bias + _activation_flops(layer, out_elems)
+    if isinstance(layer, keras.layers.SeparableConv2D):
+        depthwise = _elements(out_shape[:-1]) * in_shape[-1] * layer.depth_multiplier * int(np.prod(layer.kernel_size))
+        pointwise = out_elems * in_shape[-1] * layer.depth_multiplier
+        return 2 * (depthwise + pointwise) + bias + _activation_flops(layer, out_elems)
+    if isinstance(layer, (keras.layers.Conv1D, keras.layers.Conv2D, keras.layers.Conv3D)):
+        macs = out_elems * int(np.prod(layer.kernel_size)) * (in_shape[-1] // getattr(layer, "groups", 1))
+        return 2 * macs + bias + _activation_flops(layer, out_elems)
+    if isinstance(layer, keras.layers.Dense):
+        return 2 * in_elems * layer.units + bias + _activation_flops(layer, out_elems)
+    if isinstance(layer, (keras.layers.BatchNormalization, keras.layers.LayerNormalization)):
+        return 2 * out_elems  # scale and shift, once the statistics are folded
+    if isinstance(layer, (keras.layers.MaxPooling2D, keras.layers.AveragePooling2D)):
+        return out_elems * int(np.prod(layer.pool_size))
+    if isinstance(layer, (keras.layers.GlobalAveragePooling2D, keras.layers.GlobalMaxPooling2D)):
+        return in_elems
+    if isinstance(layer, (keras.layers.Activation, keras.layers.ReLU, keras.layers.Softmax)):
+        return out_elems
+    if isinstance(layer, (keras.layers.Flatten, keras.layers.Reshape, keras.layers.Dropout,
+                          keras.layers.SpatialDropout2D, keras.layers.GaussianNoise)):
+        return 0
+    return None
+
+
+# =========================
+# TIMING
+# =========================
+
+def latency_ms(fn, x, repeats):
+    fn(x)  # warm (and trace)
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(x)
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(float(np.median(timings)), 3)
+
+
+def _compiled(layer, backward):
+    if not backward:
+        return tf.function(lambda x: layer(x, training=False))
+
+    def forward_backward(x):
+        with tf.GradientTape() as tape:
+            tape.watch(x)
+            y = layer(x, training=False)
+        return tape.gradient(y, x)
+
+    return tf.function(forward_backward)
+
+
+def profile_layers(model, target_layer, batch_sizes, repeats, seed=0):
+    """Per-layer rows: shapes, params, FLOPs, activation bytes and latency per batch size."""
+    layers = flat_layers(model)
+    names = [layer.name for layer in layers]
+    # Grad-CAM backpropagates from the output to the target layer's output,
+    # through every layer after the target.
+    backward_from = names.index(target_layer) + 1 if target_layer in names else len(layers)
+
+    rows = []
+    rng = np.random.default_rng(seed)
+    inputs = {n: tf.constant(rng.random((n,) + tuple(model.input_shape[1:]), dtype=np.float32)) for n in batch_sizes}
+    for position, layer in enumerate(layers):
+        in_shape = tuple(inputs[batch_sizes[0]].shape[1:])
+        outputs = {n: layer(x, training=False) for n, x in inputs.items()}
+        out_shape = tuple(outputs[batch_sizes[0]].shape[1:])
+        forward = _compiled(layer, backward=False)
+        backward = _compiled(layer, backward=True) if position >= backward_from else None
+        rows.append({
+            "name": layer.name,
+            "type": type(layer).__name__,
+            "input_shape": list(in_shape),
+            "output_shape": list(out_shape),
+            "params": int(layer.count_params()),
+            "trainable_params": int(sum(np.prod(w.shape) for w in layer.trainable_weights)),
+            "weight_bytes": int(sum(np.prod(w.shape) * w.dtype.size for w in layer.weights)),
+            "flops": layer_flops(layer, in_shape, out_shape),
+            "activation_bytes": _elements(out_shape) * FLOAT_BYTES,
+            "gradcam_backward": backward is not None,
+            "forward_ms": {str(n): latency_ms(forward, inputs[n], repeats) for n in batch_sizes},
+            "backward_ms": (
+                {str(n): latency_ms(backward, inputs[n], repeats) for n in batch_sizes} if backward is not None else None
+            ),
+        })
+        inputs = outputs
+    return rows
+
+
+def profile_paths(engine, batch_sizes, repeats, seed=0):
+    """End-to-end latency of the served steps at each batch size."""
+    rng = np.random.default_rng(seed)
+    paths = {"inference": engine.predict}
+    if engine.layer_name is not None:
+        paths["gradcam"] = engine
+        paths["gradcam_all_classes"] = engine.explain_classes
+    results = {}
+    for name, fn in paths.items():
+        results[name] = {}
+        for n in batch_sizes:
+            x = rng.random((n,) + engine.input_shape, dtype=np.float32)
+            ms = latency_ms(fn, x, repeats)
+            results[name][str(n)] = {"ms": ms, "images_per_sec": round(n * 1000 / ms, 1)}
+    return results
+
+
+def memory_summary(rows, model, batch_sizes):
+    """Activation memory per batch size (float32, computed from shapes)."""
+    input_bytes = _elements(model.input_shape[1:]) * FLOAT_BYTES
+    sizes = [input_bytes] + [row["activation_bytes"] for row in rows]
+    # Inference holds a layer's input and output at once.
+    peak = max(a + b for a, b in zip(sizes, sizes[1:]))
+    # The Grad-CAM tape keeps every input of the layers it differentiates,
+    # plus the predictions.
+    backward = [i for i, row in enumerate(rows) if row["gradcam_backward"]]
+    retained = sum(sizes[i] for i in backward) + sizes[-1] if backward else 0
+    return {
+        "weight_bytes": sum(row["weight_bytes"] for row in rows),
+        "inference_peak_activation_bytes": {str(n): peak * n for n in batch_sizes},
+        "gradcam_retained_activation_bytes": {str(n): retained * n for n in batch_sizes},
+    }
+
+
+# =========================
+# REPORTS
+# =========================
+
+def _mb(value):
+    return f"{value / (1024 * 1024):.2f} MB"
+
+
+def _top(rows, key, total, count=3):
+    ranked = sorted((r for r in rows if r[key]), key=lambda r: r[key], reverse=True)[:count]
+    return ", ".join(f"{r['name']} {r[key] / total:.0%}" for r in ranked) if total else "-"
+
+
+def write_text_report(path, report):
+    rows = report["layers"]
+    batch_sizes = report["batch_sizes"]
+    largest = str(batch_sizes[-1])
+    total_params = sum(r["params"] for r in rows)
+    total_flops = sum(r["flops"] or 0 for r in rows)
+    forward_total = sum(r["forward_ms"][largest] for r in rows)
+    for r in rows:
+        r["_ms"] = r["forward_ms"][largest]
+
+    lines = [
+        f"Model: {report['model']}",
+        f"Model Output Shape: {report['output_shape']}",
+        f"Parameters: {total_params:,} ({_mb(report['memory']['weight_bytes'])} of weights)",
+        f"FLOPs per image: {total_flops / 1e6:,.1f} M"
+        + (f" (no formula for: {', '.join(report['unknown_flops'])})" if report["unknown_flops"] else ""),
+        "",
+        "--- Layers ---",
+        f"{'layer':<26} {'type':<20} {'output':<16} {'params':>10} {'MFLOPs':>9} {'act KB':>9}"
+        + "".join(f" {'ms@' + str(n):>9}" for n in batch_sizes)
+        + f" {'bwd ms@' + largest:>11} {'time':>6}",
+    ]
+    for r in rows:
+        flops = "-" if r["flops"] is None else f"{r['flops'] / 1e6:.2f}"
+        backward = f"{r['backward_ms'][largest]:.3f}" if r["backward_ms"] else ""
+        share = r["_ms"] / forward_total if forward_total else 0.0
+        lines.append(
+            f"{r['name']:<26} {r['type']:<20} {'x'.join(map(str, r['output_shape'])):<16} {r['params']:>10,} "
+            f"{flops:>9} {r['activation_bytes'] / 1024:>9.1f}"
+            + "".join(f" {r['forward_ms'][str(n)]:>9.3f}" for n in batch_sizes)
+            + f" {backward:>11} {share:>6.1%}"
+        )
+
+    lines += [
+        "",
+        f"Where it goes (batch {largest}):",
+        f"  time:   {_top(rows, '_ms', forward_total)}",
+        f"  FLOPs:  {_top(rows, 'flops', total_flops)}",
+        f"  params: {_top(rows, 'params', total_params)}",
+        "",
+        "--- Paths (as served, explain.GradCamEngine) ---",
+        f"{'path':<22}" + "".join(f" {'ms@' + str(n):>10} {'img/s':>8}" for n in batch_sizes),
+    ]
+    for name, by_batch in report["paths"].items():
+        lines.append(
+            f"{name:<22}"
+            + "".join(f" {by_batch[str(n)]['ms']:>10.2f} {by_batch[str(n)]['images_per_sec']:>8.1f}" for n in batch_sizes)
+        )
+    memory = report["memory"]
+    lines += [
+        f"Sum of per-layer forward times at batch {largest}: {forward_total:.2f} ms",
+        "",
+        "--- Activation memory (float32) ---",
+        "inference peak:     " + ", ".join(
+            f"{_mb(v)} @{n}" for n, v in memory["inference_peak_activation_bytes"].items()),
+        "grad-cam retained:  " + ", ".join(
+            f"{_mb(v)} @{n}" for n, v in memory["gradcam_retained_activation_bytes"].items()),
+        "",
+        f"Last Conv Layer: {report['last_conv_layer']}",
+        f"Grad-CAM Target Layer: {report['target_layer']} "
+        f"(backward through {sum(r['gradcam_backward'] for r in rows)} layers)",
+    ]
+    for r in rows:
+        del r["_ms"]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--target-layer", help="Grad-CAM target to profile (default: the one serving picks)")
+    parser.add_argument("--out", default=os.path.join(RUNS_DIR, "model_info.txt"), help="Readable report")
+    parser.add_argument("--json", default=os.path.join(RUNS_DIR, "model_profile.json"), help="Machine-readable report")
+    args = parser.parse_args()
+
+    print(f"Loading model from {args.model}...")
+    model, source = load_or_build(args.model)
+    if source == "synthetic":
+        print(f"⚠️ {args.model} not found; profiling the synthetic stand-in")
     print("✅ Model loaded.")
-    
-    with open("model_info.txt", "w", encoding="utf-8") as f:
-        f.write(f"Model Output Shape: {model.output_shape}\n")
-        f.write("\n--- Layers ---\n")
-        for layer in model.layers:
-            f.write(f"Layer: {layer.name}, Type: {type(layer).__name__}\n")
-            if hasattr(layer, 'layers'):
-                 f.write(f"  -> Nested layers: {len(layer.layers)}\n")
-                 for sub in layer.layers[-5:]: # Last 5
-                      f.write(f"     Sub: {sub.name}, Type: {type(sub).__name__}\n")
-
-    def find_last_conv_layer(model):
-        """Recursively find the last convolutional layer in a model."""
-        for layer in reversed(model.layers):
-            # Check for nested models (e.g., VGG16, ResNet base)
-            if hasattr(layer, 'layers') and len(layer.layers) > 0:
-                result = find_last_conv_layer(layer)
-                if result:
-                    return result
-            # Check for direct Conv layer
-            if 'conv' in layer.name.lower() or isinstance(layer, keras.layers.Conv2D):
-                return layer.name
-        return None
-
-    last_conv = find_last_conv_layer(model)
-    with open("model_info.txt", "a", encoding="utf-8") as f:
-        f.write(f"\nLast Conv Layer: {last_conv}\n")
-
-except Exception as e:
-    print(f"Error: {e}")
-    with open("model_info.txt", "w", encoding="utf-8") as f:
-        f.write(f"Error: {e}\n")
+    batch_sizes = sorted({int(b) for b in args.batch_sizes.split(",") if b.strip()})
+
+    engine = GradCamEngine(model, layer_name=args.target_layer)
+    print(f"⏱️ Timing {len(flat_layers(model))} layers at batch sizes {batch_sizes}...")
+    rows = profile_layers(model, engine.layer_name, batch_sizes, args.repeats)
+    print("⏱️ Timing inference and Grad-CAM paths...")
+    report = {
+        "model": source,
+        "output_shape": list(model.output_shape),
+        "batch_sizes": batch_sizes,
+        "last_conv_layer": find_last_conv_layer(model),
+        "target_layer": engine.layer_name,
+        "params": int(model.count_params()),
+        "flops_per_image": sum(r["flops"] or 0 for r in rows),
+        "unknown_flops": [r["name"] for r in rows if r["flops"] is None],
+        "layers": rows,
+        "paths": profile_paths(engine, batch_sizes, args.repeats),
+        "memory": memory_summary(rows, model, batch_sizes),
+    }
+
+    for path in (args.out, args.json):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write_text_report(args.out, report)
+    with open(args.json, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Wrote {args.out} and {args.json}")
+
+
+if __name__ == "__main__":
+    main()
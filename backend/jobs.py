@@ -0,0 +1,328 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+# =========================
+# PERSISTENT JOB STORE
+# =========================
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class JobStore:
+    """SQLite-backed record of background jobs.
+
+    Each job keeps its JSON payload and optional binary inputs so that queued
+    or interrupted jobs can be picked up again after a restart, plus status,
+    progress and final result. Inputs are dropped once a job finishes. A single
+    connection is shared between threads behind a lock.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    dedupe_key TEXT,
+                    payload TEXT NOT NULL,
+                    inputs BLOB,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+
+    def create(self, kind, payload, dedupe_key=None, inputs=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, progress, dedupe_key, payload, inputs, created_at, updated_at)"
+                " VALUES (?, ?, ?, 0, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, dedupe_key, json.dumps(payload), inputs, now, now),
+            )
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def active(self):
+        """Jobs that were queued or running, oldest first (used on restart)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                ACTIVE_STATES,
+            ).fetchall()
+        return [_row_to_job(r) for r in rows]
+
+    def update(self, job_id, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+            )
+
+    def purge(self, older_than_s):
+        """Delete finished jobs last updated more than `older_than_s` ago."""
+        cutoff = time.time() - older_than_s
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, cutoff),
+            )
+        return cur.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _row_to_job(row):
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+# =========================
+# BACKGROUND JOB QUEUE
+# =========================
+
+class QueueFull(Exception):
+    """Raised when too many jobs are already waiting."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """Worker threads that drain persisted jobs through a handler.
+
+    `handler(payload, inputs, report_progress)` does the work and returns a
+    JSON-able result; `inputs` is the binary blob given at submit time (or
+    None) and `report_progress(fraction)` may be called with values in [0, 1].
+    Submissions with a `dedupe_key` already queued or running return the
+    existing job id instead of creating a second job. At most `max_pending`
+    jobs may be queued or running; beyond that submit raises QueueFull.
+
+    Args:
+        store: JobStore used for persistence.
+        kind: Job type recorded with each job (e.g. "shap").
+        handler: Callable doing the work for one job.
+        workers: Number of worker threads.
+        max_pending: Admission limit for queued + running jobs.
+    """
+
+    def __init__(self, store, kind, handler, workers=1, max_pending=32):
+        self.store = store
+        self.kind = kind
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._live = {}  # job id -> latest in-memory snapshot of active jobs
+        self._by_key = {}  # dedupe key -> active job id
+        self._threads = []
+        self._avg_job_s = 0.0
+        self._completed = 0
+        self._failed = 0
+
+    def start(self, recover=True):
+        # Anything queued or interrupted mid-run before a restart goes first.
+        recovered = 0
+        for job in self.store.active() if recover else ():
+            if job["kind"] != self.kind:
+                continue
+            self.store.update(job["id"], status=QUEUED, progress=0.0)
+            self._track(job["id"], job.get("dedupe_key"))
+            self._queue.put(job["id"])
+            recovered += 1
+        if recovered:
+            logger.info("Re-queued %d unfinished %s job(s)", recovered, self.kind)
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"jobs-{self.kind}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=5.0):
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def submit(self, payload, dedupe_key=None, inputs=None):
+        with self._lock:
+            if dedupe_key is not None and dedupe_key in self._by_key:
+                return self._by_key[dedupe_key]
+            if len(self._live) >= self.max_pending:
+                raise QueueFull(self._retry_after_locked())
+            job_id = self.store.create(self.kind, payload, dedupe_key=dedupe_key, inputs=inputs)
+            self._track_locked(job_id, dedupe_key)
+        self._queue.put(job_id)
+        return job_id
+
+    def saturated(self):
+        with self._lock:
+            return len(self._live) >= self.max_pending
+
+    def retry_after(self):
+        with self._lock:
+            return self._retry_after_locked()
+
+    def peek(self, job_id):
+        """In-memory view of an active job, or None once it has finished."""
+        with self._lock:
+            live = self._live.get(job_id)
+            return _public_view(live) if live is not None else None
+
+    def get(self, job_id):
+        """Latest view of a job: in-memory while active, from the store after."""
+        with self._lock:
+            live = self._live.get(job_id)
+            if live is not None:
+                return _public_view(live)
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        return _public_view(job)
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for j in self._live.values() if j["status"] == RUNNING)
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "queued": len(self._live) - running,
+                "running": running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_job_ms": round(self._avg_job_s * 1000, 3),
+            }
+
+    # ---- internals ----
+    def _track(self, job_id, dedupe_key):
+        with self._lock:
+            self._track_locked(job_id, dedupe_key)
+
+    def _track_locked(self, job_id, dedupe_key):
+        now = time.time()
+        self._live[job_id] = {
+            "id": job_id,
+            "kind": self.kind,
+            "status": QUEUED,
+            "progress": 0.0,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "_dedupe_key": dedupe_key,
+        }
+        if dedupe_key is not None:
+            self._by_key[dedupe_key] = job_id
+
+    def _set_live(self, job_id, **fields):
+        with self._lock:
+            live = self._live.get(job_id)
+            if live is not None:
+                live.update(fields, updated_at=time.time())
+
+    def _finish(self, job_id, elapsed, ok):
+        with self._lock:
+            live = self._live.pop(job_id, None)
+            if live and live["_dedupe_key"] is not None:
+                self._by_key.pop(live["_dedupe_key"], None)
+            if ok:
+                self._completed += 1
+            else:
+                self._failed += 1
+            done = self._completed + self._failed
+            self._avg_job_s = elapsed if done == 1 else 0.8 * self._avg_job_s + 0.2 * elapsed
+
+    def _retry_after_locked(self):
+        backlog = max(1, len(self._live) - self.workers + 1)
+        return max(1, int(self._avg_job_s * backlog / self.workers + 0.999))
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            job = self.store.get(job_id)
+            if job is None:
+                self._finish(job_id, 0.0, ok=False)
+                continue
+
+            started = time.perf_counter()
+            self.store.update(job_id, status=RUNNING, progress=0.0)
+            self._set_live(job_id, status=RUNNING, progress=0.0)
+
+            last_write = [0.0]
+
+            def report_progress(fraction):
+                fraction = round(min(max(float(fraction), 0.0), 1.0), 3)
+                self._set_live(job_id, progress=fraction)
+                # Progress lives in memory; persist it at most once a second.
+                now = time.perf_counter()
+                if now - last_write[0] >= 1.0:
+                    last_write[0] = now
+                    self.store.update(job_id, progress=fraction)
+
+            try:
+                result = self.handler(job["payload"], job["inputs"], report_progress)
+            except Exception as e:
+                logger.exception("%s job %s failed: %s", self.kind, job_id, e)
+                self.store.update(job_id, status=FAILED, error=str(e), inputs=None)
+                self._set_live(job_id, status=FAILED, error=str(e))
+                self._finish(job_id, time.perf_counter() - started, ok=False)
+                continue
+
+            self.store.update(job_id, status=DONE, progress=1.0, result=result, inputs=None)
+            self._set_live(job_id, status=DONE, progress=1.0, result=result)
+            self._finish(job_id, time.perf_counter() - started, ok=True)
+
+
+def _public_view(job):
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
@@ -1,6 +1,9 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+import time
+STARTED = time.perf_counter()  # start-up phases (see /readyz) are measured from here
+from typing import List, Optional
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 import os
 os.environ["KERAS_BACKEND"] = "tensorflow"
 import tensorflow as tf
@@ -10,10 +13,34 @@ except ImportError:
     from tensorflow import keras
 import numpy as np
 import os
-import cv2
-from PIL import Image
+import asyncio
+import json
+import logging
+import mimetypes
 import shutil
-from explain import grad_cam, generate_shap_plot
+import tempfile
+import threading
+from artifacts import ArtifactStore, parse_range
+from explain import CAM_METHODS, GradCamEngine, ShapService, render_shap_image
+from render import render_gradcam
+from batching import MicroBatcher
+from executor import BoundedPool, ModelLock, PoolSaturated
+from cache import CachedResult, ResultCache, file_digest
+from jobs import JobQueue, JobStore, QueueFull, DONE, FAILED
+from imaging import DecodedImage, decode_image
+from modalities import MODALITIES
+from bulk import artifact_stem, iter_archive, iter_files, read_chunk
+from volume import TopSlices, open_volume, suspicion
+from registry import ModelPool, ModelRegistry
+from shadow import ShadowEvaluator
+import shm_serving
+from telemetry import (
+    StartupTimer, TimingMiddleware, merge_families, metrics, setup_logging, stage, stats_families, stop_logging,
+)
+from tflite_backend import QUANT_MODES, QUANTIZED_MODES, TFLiteModel, load_or_convert, parity, sample_inputs
+
+startup = StartupTimer(STARTED)
+startup.mark("imports")
 
 # =========================
 # APP CONFIG
@@ -27,50 +54,557 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "ETag", "Content-Range"],
 )
 
+# =========================
+# TELEMETRY
+# =========================
+# Per-stage durations (upload read, decode, preprocess, inference, Grad-CAM,
+# SHAP, rendering, artifact writes) feed Prometheus histograms on GET /metrics.
+# SERVER_TIMING=true also returns each request's breakdown in a Server-Timing
+# header. Log records go through an in-memory queue to LOG_FILE (or stderr)
+# on a background thread.
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "false").lower() == "true"
+setup_logging(os.environ.get("LOG_LEVEL", "WARNING"), os.environ.get("LOG_FILE") or None)
+logger = logging.getLogger(__name__)
+app.add_middleware(TimingMiddleware, server_timing=SERVER_TIMING)
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
-MODEL_FOLDER = os.path.join(BASE_DIR, "models")
+UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER") or os.path.join(BASE_DIR, "uploads")
+MODEL_FOLDER = os.environ.get("MODEL_FOLDER") or os.path.join(BASE_DIR, "models")
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Mount static files for serving uploads
-app.mount("/uploads", StaticFiles(directory=UPLOAD_FOLDER), name="uploads")
+# =========================
+# ARTIFACT STORE
+# =========================
+# Heatmaps, SHAP plots and saved uploads are stored in UPLOAD_FOLDER under a
+# hash of their bytes (see artifacts.py) and served from /uploads/<name> with
+# an ETag, a long immutable Cache-Control and Range support. The store keeps
+# to ARTIFACT_MAX_MB, least recently used first out, and drops artifacts
+# unused for ARTIFACT_TTL_HOURS (0 disables either limit).
+ARTIFACT_MAX_MB = float(os.environ.get("ARTIFACT_MAX_MB", "2048"))
+ARTIFACT_TTL_HOURS = float(os.environ.get("ARTIFACT_TTL_HOURS", "168"))
+ARTIFACT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+artifact_store = ArtifactStore(
+    UPLOAD_FOLDER,
+    max_bytes=ARTIFACT_MAX_MB * 1024 * 1024 if ARTIFACT_MAX_MB > 0 else None,
+    ttl_s=ARTIFACT_TTL_HOURS * 3600 if ARTIFACT_TTL_HOURS > 0 else None,
+)
 
 # =========================
 # LOAD MODEL
 # =========================
-MODEL_PATH = os.path.join(MODEL_FOLDER, "global_Brain_model.keras")
+# One global model per modality (model files and class labels: modalities.py).
+# Each is loaded on its first request (or at startup when listed in
+# MODEL_PRELOAD) and resident models are kept within MODEL_POOL_MB, least
+# recently used first out; see MODEL REGISTRY below.
+MODEL_POOL_MB = float(os.environ.get("MODEL_POOL_MB", "1024"))
+MODEL_PRELOAD = [
+    name.strip() for name in os.environ.get("MODEL_PRELOAD", "brain").split(",") if name.strip()
+]
+
+# A new global model copied over a model file (or announced via
+# POST /admin/models/reload) is loaded and warmed in the background, then
+# swapped in without interrupting requests.
+MODEL_WATCH_INTERVAL_S = float(os.environ.get("MODEL_WATCH_INTERVAL_S", "10"))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+
+# =========================
+# MICRO-BATCHING
+# =========================
+# Concurrent /predict/{modality} requests share one forward pass. Tune with
+# BATCH_MAX_SIZE (rows per pass) and BATCH_MAX_WAIT_MS (how long the first
+# request in a batch may wait for others); see GET /stats.
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "5"))
+
+
+# TensorFlow (with oneDNN) is not safe to drive from several Python threads at
+# once, so every model call - batched inference, Grad-CAM and SHAP - takes this
+# lock. TF still parallelises each call internally across cores. Shadow
+# candidates take it only while no serving call wants it (see SHADOW EVALUATION).
+model_lock = ModelLock()
+
+
+class SerializedModel:
+    """Proxy that holds `model_lock` around each call into the wrapped model."""
+
+    def __init__(self, model):
+        self._model = model
+
+    def __call__(self, *args, **kwargs):
+        with model_lock:
+            return self._model(*args, **kwargs)
+
+    def predict(self, *args, **kwargs):
+        with model_lock:
+            return self._model.predict(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+# =========================
+# INFERENCE BACKEND
+# =========================
+# INFERENCE_BACKEND=tflite serves fast scans (gradcam=false) through a TFLite
+# graph (TFLITE_QUANT: none, float16, dynamic or int8) on TFLITE_THREADS
+# XNNPACK threads; Grad-CAM and SHAP always use the Keras model. Each new model
+# version is checked against Keras on TFLITE_PARITY_SAMPLES inputs (images
+# from TFLITE_PARITY_DIR, else synthetic) before it goes live, and stays on
+# Keras if top-1 agreement or probability drift misses the thresholds.
+# Quantized graphs (float16, dynamic, int8) need real scans in
+# TFLITE_PARITY_DIR; checked on synthetic inputs only, they never go live.
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "keras").lower()
+TFLITE_QUANT = os.environ.get("TFLITE_QUANT", "float16").lower()
+TFLITE_THREADS = int(os.environ.get("TFLITE_THREADS", "0")) or None
+TFLITE_PARITY_DIR = os.environ.get("TFLITE_PARITY_DIR") or None
+TFLITE_PARITY_SAMPLES = int(os.environ.get("TFLITE_PARITY_SAMPLES", "64"))
+TFLITE_MIN_AGREEMENT = float(os.environ.get("TFLITE_MIN_AGREEMENT", "0.99"))
+TFLITE_MAX_DRIFT = float(os.environ.get("TFLITE_MAX_DRIFT", "0.05"))
+
+if INFERENCE_BACKEND not in ("keras", "tflite"):
+    print(f"⚠️ Unknown INFERENCE_BACKEND {INFERENCE_BACKEND!r}, using keras")
+    INFERENCE_BACKEND = "keras"
+if INFERENCE_BACKEND == "tflite" and TFLITE_QUANT not in QUANT_MODES:
+    print(f"⚠️ Unknown TFLITE_QUANT {TFLITE_QUANT!r}, using float16")
+    TFLITE_QUANT = "float16"
+
+
+# =========================
+# MODEL REGISTRY
+# =========================
+# Everything built on a model version - the compiled Grad-CAM engine, its
+# micro-batcher and the SHAP service - lives in one runtime object, so a
+# version swap replaces all of it at once. Concurrent SHAP jobs share the
+# runtime's explainer service, whose masked samples are merged into full model
+# batches (SHAP_BATCH_SIZE rows, SHAP_BATCH_WAIT_MS). A deep scan spends
+# SHAP_MAX_EVALS evaluations unless it has a time budget (SHAP_BUDGET_MS or the
+# request's shap_budget_ms) or a convergence target (SHAP_TARGET is the default
+# once a budget is set): then its attributions are refined until the budget,
+# counted from submission, runs out, they converge, or SHAP_REFINE_MAX_EVALS.
+SHAP_BATCH_SIZE = int(os.environ.get("SHAP_BATCH_SIZE", "128"))
+SHAP_BATCH_WAIT_MS = float(os.environ.get("SHAP_BATCH_WAIT_MS", "20"))
+SHAP_MAX_EVALS = int(os.environ.get("SHAP_MAX_EVALS", "50"))
+SHAP_REFINE_MAX_EVALS = int(os.environ.get("SHAP_REFINE_MAX_EVALS", "4096"))
+SHAP_BUDGET_MS = float(os.environ["SHAP_BUDGET_MS"]) if os.environ.get("SHAP_BUDGET_MS") else None
+SHAP_TARGET = float(os.environ.get("SHAP_TARGET", "0.98"))
+
+
+def build_shap_service(forward_fn, input_shape, max_wait_ms=SHAP_BATCH_WAIT_MS):
+    return ShapService(
+        forward_fn,
+        input_shape,
+        max_batch_size=SHAP_BATCH_SIZE,
+        max_wait_ms=max_wait_ms,
+        max_evals=SHAP_MAX_EVALS,
+        max_refine_evals=SHAP_REFINE_MAX_EVALS,
+        target=SHAP_TARGET,
+    )
+
+
+class ModelRuntime:
+    """One loaded model version and the serving machinery built on it."""
+
+    def __init__(self, name, model, version, classes, path=None):
+        self.name = name
+        self.model = model
+        self.version = version
+        self.classes = classes
+        self.path = path
+        # Resident size for the model pool's memory budget.
+        self.nbytes = sum(w.numpy().nbytes for w in model.weights)
+        # Prediction and Grad-CAM share one compiled forward/backward pass; the
+        # target layer is located and the graph traced once, here.
+        self.engine = GradCamEngine(model)
+        self.batcher = MicroBatcher(
+            self._forward,
+            max_batch_size=BATCH_MAX_SIZE,
+            max_wait_ms=BATCH_MAX_WAIT_MS,
+            name=f"{name}-{version}",
+        )
+        # Prediction-only requests batch separately, through the TFLite graph
+        # once it has passed the parity check (see INFERENCE BACKEND).
+        self.fast = None
+        self.parity = None
+        self.predict_batcher = MicroBatcher(
+            self.predict_fast,
+            max_batch_size=BATCH_MAX_SIZE,
+            max_wait_ms=BATCH_MAX_WAIT_MS,
+            name=f"{name}-{version}-predict",
+        )
+        self.shap_service = build_shap_service(self.predict, self.engine.input_shape)
+
+    def _forward(self, batch):
+        with model_lock:
+            preds, heatmaps = self.engine(batch)
+        shadow_models[self.name].observe(batch, preds, self.version)
+        return preds, heatmaps
+
+    def predict(self, batch):
+        """Predictions only (no Grad-CAM), outside the micro-batcher."""
+        with model_lock:
+            return self.engine.predict(batch)
+
+    def explain_classes(self, batch, top_k=None, method="gradcam"):
+        """Predictions plus Grad-CAM(++) maps for each row's top_k classes (all when None)."""
+        with model_lock:
+            return self.engine.explain_classes(batch, top_k, method)
+
+    def predict_fast(self, batch):
+        """Predictions through the fast backend when enabled, else Keras."""
+        fast = self.fast
+        if fast is None:
+            preds = self.predict(batch)
+        else:
+            # TFLite runs outside the TF runtime, so it does not need model_lock,
+            # but shadow work should still stay off the CPU meanwhile.
+            with model_lock.busy():
+                preds = fast.predict(batch)
+        shadow_models[self.name].observe(batch, preds, self.version)
+        return preds
+
+    @property
+    def backend(self):
+        return self.fast.name if self.fast is not None else "keras"
+
+    def load_fast_backend(self):
+        """Convert (or reuse) the TFLite graph and enable it if it matches Keras."""
+        inputs, source = sample_inputs(TFLITE_PARITY_DIR, TFLITE_PARITY_SAMPLES, self.engine.input_shape)
+        name = f"tflite-{TFLITE_QUANT}"
+        if source == "synthetic":
+            if TFLITE_QUANT in QUANTIZED_MODES:
+                self.parity = {
+                    "backend": name,
+                    "accepted": False,
+                    "inputs": source,
+                    "reason": "quantized graphs need real scans in TFLITE_PARITY_DIR",
+                }
+                print(
+                    f"⚠️ {name} for {self.name} {self.version} not enabled: no readable scans in "
+                    f"TFLITE_PARITY_DIR ({TFLITE_PARITY_DIR or 'unset'}) to check a quantized graph on; serving Keras"
+                )
+                return
+            print(
+                f"⚠️ {name} parity for {self.name} {self.version} is checked on SYNTHETIC inputs only; "
+                f"set TFLITE_PARITY_DIR to a folder of real scans"
+            )
+        with model_lock:
+            content = load_or_convert(self.model, self.path, self.version, TFLITE_QUANT, inputs)
+        fast = TFLiteModel(content, TFLITE_THREADS, name=name)
+        fast.warmup(batch_sizes=sorted({1, BATCH_MAX_SIZE}))
+        report = parity(self.predict, fast.predict, inputs, batch_size=BATCH_MAX_SIZE)
+        accepted = (
+            report["top1_agreement"] >= TFLITE_MIN_AGREEMENT
+            and report["max_abs_drift"] <= TFLITE_MAX_DRIFT
+        )
+        self.parity = {**report, "backend": fast.name, "accepted": accepted, "inputs": source}
+        if not accepted:
+            print(
+                f"⚠️ {fast.name} for {self.name} {self.version} failed parity "
+                f"(agreement {report['top1_agreement']}, max drift {report['max_abs_drift']:.4f}); serving Keras"
+            )
+            return
+        self.fast = fast
+        self.nbytes += fast.nbytes
+        print(
+            f"✅ {self.name} {self.version} fast scans on {fast.name} "
+            f"(agreement {report['top1_agreement']}, max drift {report['max_abs_drift']:.2e})"
+        )
+
+    def warmup(self):
+        # Trace and run the batch shapes serving will use before going live.
+        with model_lock:
+            self.engine.warmup(batch_sizes=sorted({1, BATCH_MAX_SIZE}))
+        if INFERENCE_BACKEND == "tflite" and self.path:
+            try:
+                self.load_fast_backend()
+            except Exception as e:
+                print(f"❌ TFLite backend unavailable for {self.name} {self.version}: {e}")
+        self.batcher.start()
+        self.predict_batcher.start()
+
+    def describe_backend(self):
+        return {"fast_scans": self.backend, "gradcam": "keras", "parity": self.parity}
+
+    def close(self):
+        self.batcher.stop()
+        self.predict_batcher.stop()
+        self.shap_service.stop()
+
+
+def runtime_factory(name, classes):
+    def load(path, version):
+        return ModelRuntime(name, keras.models.load_model(path, compile=False), version, classes, path)
+
+    return load
+
+
+# =========================
+# SHADOW EVALUATION
+# =========================
+# Candidate models score a sample (SHADOW_SAMPLE_RATE) of each modality's
+# production batches without touching the responses: the candidates run as
+# one stacked pass on a background thread, and agreement, confidence deltas
+# and their cost appear in GET /admin/shadow (see shadow.py). Shadow chunks
+# run only while no serving call wants model_lock and are sized to
+# SHADOW_MAX_DELAY_MS, the longest a serving call can wait behind one. Candidates
+# are added through POST /admin/shadow or at startup from SHADOW_MODELS
+# ("brain:global_Brain_model-r1.keras,..."). Under shm_serving.py they live in
+# the inference processes and these helpers forward to them.
+SHADOW_MAX_DELAY_MS = float(os.environ.get("SHADOW_MAX_DELAY_MS", "20"))
+SHADOW_SAMPLE_RATE = float(os.environ.get("SHADOW_SAMPLE_RATE", "1.0"))
+SHADOW_MODELS = [entry.strip() for entry in os.environ.get("SHADOW_MODELS", "").split(",") if entry.strip()]
+
+shadow_models = {
+    name: ShadowEvaluator(name, model_lock, max_delay_ms=SHADOW_MAX_DELAY_MS, sample_rate=SHADOW_SAMPLE_RATE)
+    for name in MODALITIES
+}
+
+
+def add_shadow(modality, path):
+    """Load a candidate model file and shadow it; returns its version."""
+    if inference_client is not None:
+        return inference_client.broadcast("shadow_add", modality=modality, path=path)[0]
+    model = keras.models.load_model(path, compile=False)
+    return shadow_models[modality].add(file_digest(path)[:12], model, path)
+
+
+def remove_shadow(modality, version):
+    if inference_client is not None:
+        return inference_client.broadcast("shadow_remove", modality=modality, version=version)[0]
+    return shadow_models[modality].remove(version)
+
+
+def shadow_stats():
+    if inference_client is not None:
+        return inference_client.control("shadow_stats")
+    return {name: evaluator.stats() for name, evaluator in shadow_models.items() if evaluator.versions()}
+
+
+def load_shadow_models():
+    for entry in SHADOW_MODELS:
+        modality, _, filename = entry.partition(":")
+        try:
+            add_shadow(modality, model_file(filename))
+        except Exception as e:
+            print(f"❌ Could not shadow {entry}: {e}")
+
+
+# Served to the HTTP workers by the inference processes (see shm_serving.py).
+SHADOW_COMMANDS = {"shadow_add": add_shadow, "shadow_remove": remove_shadow, "shadow_stats": shadow_stats}
 
-if not os.path.exists(MODEL_PATH):
-    print(f"⚠️ Model not found at {MODEL_PATH}")
-    brain_model = None
+
+def model_file(path):
+    """Absolute path of a file inside MODEL_FOLDER; ValueError for anything outside."""
+    path = os.path.realpath(os.path.join(MODEL_FOLDER, path))
+    if os.path.dirname(path) != os.path.realpath(MODEL_FOLDER):
+        raise ValueError("Model path must be inside the models folder")
+    return path
+
+
+# Under shm_serving.py the HTTP workers hold no models: model_pool forwards
+# to the inference process(es) through shared memory, which run the pool below.
+inference_client = shm_serving.client()
+
+if inference_client is None:
+    model_pool = ModelPool(max_bytes=int(MODEL_POOL_MB * 1024 * 1024))
+    for _name, (_filename, _classes) in MODALITIES.items():
+        model_pool.add(
+            ModelRegistry(
+                _name,
+                os.path.join(MODEL_FOLDER, _filename),
+                runtime_factory(_name, _classes),
+                watch_interval_s=MODEL_WATCH_INTERVAL_S,
+            )
+        )
 else:
-    print("🔄 Loading model...")
-    try:
-        brain_model = keras.models.load_model(MODEL_PATH, compile=False)
-        print("✅ Model loaded successfully")
-    except Exception as e:
-        print(f"❌ Error loading model: {e}")
-        brain_model = None
+    model_pool = shm_serving.RemotePool(
+        inference_client,
+        {name: (os.path.join(MODEL_FOLDER, filename), classes) for name, (filename, classes) in MODALITIES.items()},
+        build_shap_service,
+    )
+
+for _name in MODEL_PRELOAD:
+    if model_pool.get(_name) is None:
+        print(f"⚠️ Unknown modality in MODEL_PRELOAD: {_name}")
+MODEL_PRELOAD = [name for name in MODEL_PRELOAD if model_pool.get(name) is not None]
+
 
 # =========================
-# CLASS LABELS
+# READINESS
 # =========================
-brain_classes = ["Glioma", "Meningioma", "Pituitary", "No Tumor"]
-chest_classes = ["Normal", "Pneumonia", "COVID"]
-skin_classes = ["Benign", "Malignant"]
+# The MODEL_PRELOAD models are loaded and warmed up (every serving batch size
+# traced once) on a background thread started with the app, so the port is
+# bound and GET /healthz answers while they load. GET /readyz returns 503
+# until the preload has finished, then 200 with the start-up phase timings.
+# Requests that arrive earlier wait for the load instead of failing.
+preload_errors = {}
+
+
+def preload_models():
+    for name in MODEL_PRELOAD:
+        registry = model_pool.get(name)
+        if not os.path.exists(registry.path):
+            print(f"⚠️ Model not found at {registry.path}")
+            continue
+        try:
+            model_pool.load(name)
+        except Exception as e:
+            preload_errors[name] = str(e)
+            print(f"❌ Error loading {name} model: {e}")
+            continue
+        model = registry.stats()
+        startup.add(f"model_load:{name}", (model["load_ms"] - model["warmup_ms"]) / 1000)
+        startup.add(f"model_warmup:{name}", model["warmup_ms"] / 1000)
+    startup.ready()
+    phases = ", ".join(f"{p['phase']} {p['ms']:.0f} ms" for p in startup.report()["phases"])
+    print(f"🚀 Ready {startup.report()['ready_ms']:.0f} ms after start ({phases})")
+    # Candidates never hold up readiness; one worker adds them for all.
+    if inference_client is None or inference_client.worker == 0:
+        load_shadow_models()
+
+
+def readiness():
+    """(ready, per-model status) for the preloaded models."""
+    models = {}
+    for name in MODEL_PRELOAD:
+        registry = model_pool.get(name)
+        if registry.resident:
+            models[name] = "live"
+        elif not os.path.exists(registry.path):
+            models[name] = "missing"  # not trained yet; served once the file appears
+        elif not startup.is_ready:
+            models[name] = "loading"
+        elif name in preload_errors:
+            models[name] = f"failed: {preload_errors[name]}"
+        else:
+            models[name] = "unloaded"  # evicted by MODEL_POOL_MB; reloads on demand
+    ready = startup.is_ready and not any(status.startswith("failed") for status in models.values())
+    return ready, models
 
 
 # =========================
-# IMAGE PREPROCESS
+# WORKER POOLS
 # =========================
-def preprocess_image(path):
-    img = Image.open(path).convert("RGB")
-    img = img.resize((224, 224))
-    img = np.array(img, dtype=np.float32) / 255.0
-    return np.expand_dims(img, axis=0)
+# Blocking work (file I/O, Grad-CAM) runs off the event loop on the fast pool;
+# SHAP runs on the deep-scan job workers (see DEEP-SCAN JOBS) so a few deep
+# scans cannot starve triage traffic. When a queue is full the request gets a
+# 503 + Retry-After.
+fast_pool = BoundedPool(
+    "fast",
+    workers=int(os.environ.get("FAST_POOL_WORKERS", str(min(8, os.cpu_count() or 4)))),
+    max_queue=int(os.environ.get("FAST_POOL_QUEUE", "64")),
+)
+
+
+# =========================
+# RESULT CACHE
+# =========================
+# Re-uploads of the same scan (second opinions, page refreshes) are served
+# from here. Keys hash the upload bytes together with the serving model
+# version, so a new global model never returns stale results.
+result_cache = ResultCache(
+    max_bytes=int(float(os.environ.get("RESULT_CACHE_MB", "256")) * 1024 * 1024),
+    disk_dir=os.environ.get("RESULT_CACHE_DIR") or None,
+    max_disk_bytes=int(float(os.environ.get("RESULT_CACHE_DISK_MB", "2048")) * 1024 * 1024),
+)
+
+
+# =========================
+# DEEP-SCAN JOBS
+# =========================
+# Deep scans return the fast result immediately plus a job id; SHAP runs on
+# background workers and clients poll /jobs/{id} or follow /jobs/{id}/events.
+# Jobs are persisted in SQLite so queued work survives a restart.
+JOBS_DB = os.environ.get("JOBS_DB", os.path.join(BASE_DIR, "jobs.sqlite3"))
+JOB_RETENTION_HOURS = float(os.environ.get("JOB_RETENTION_HOURS", "168"))
+
+job_store = JobStore(JOBS_DB)
+
+
+def run_shap_job(payload, inputs, report_progress):
+    """Job handler: SHAP for an already-predicted upload."""
+    modality = payload.get("modality", "brain")
+    with model_pool.acquire(modality) as runtime:
+        if runtime is None:
+            raise RuntimeError(f"{modality} model not available")
+        return _run_shap_job(runtime, payload, inputs, report_progress)
+
+
+def _run_shap_job(runtime, payload, inputs, report_progress):
+    decoded = DecodedImage.from_bytes(inputs)
+    raw_pred = np.asarray(payload["raw_pred"], dtype=np.float32)
+    # The model was swapped since the job was queued: explain the new model's
+    # own prediction, and keep the result out of the old version's cache entry.
+    same_version = payload.get("model_version", runtime.version) == runtime.version
+    if not same_version:
+        with stage("inference"):
+            raw_pred = runtime.predict(decoded.tensor)
+
+    # The budget runs from submission, so time spent queued counts against it.
+    deadline = payload.get("shap_deadline")
+    shap_url, shap_bytes, quality = render_shap(
+        runtime,
+        decoded,
+        raw_pred,
+        payload["base_name"],
+        # Leave the last 10% for plotting; the job reports 1.0 when it is stored.
+        progress=lambda fraction: report_progress(0.9 * fraction),
+        budget_s=max(0.0, deadline - time.time()) if deadline is not None else None,
+        target=payload.get("shap_target"),
+    )
+    if shap_bytes is None:
+        raise RuntimeError("SHAP generation failed")
+    if same_version:
+        result_cache.update(payload["cache_key"], shap=shap_bytes)
+    return {"shap": shap_url, "model_version": runtime.version, "shap_quality": quality}
+
+
+deep_scan_jobs = JobQueue(
+    job_store,
+    "shap",
+    run_shap_job,
+    workers=int(os.environ.get("SLOW_POOL_WORKERS", "4")),
+    max_pending=int(os.environ.get("SLOW_POOL_QUEUE", "32")),
+)
+
+
+@app.on_event("startup")
+def start_jobs():
+    started = time.perf_counter()
+    purged = job_store.purge(JOB_RETENTION_HOURS * 3600)
+    if purged:
+        print(f"🧹 Purged {purged} finished job(s)")
+    # With several HTTP workers on one jobs database, only the first re-queues
+    # jobs interrupted by a restart.
+    deep_scan_jobs.start(recover=inference_client is None or inference_client.worker == 0)
+    model_pool.start()
+    threading.Thread(target=preload_models, name="model-preload", daemon=True).start()
+    startup.add("startup_hooks", time.perf_counter() - started)
+
+
+@app.on_event("shutdown")
+def stop_workers():
+    deep_scan_jobs.stop()
+    model_pool.stop()
+    for evaluator in shadow_models.values():
+        evaluator.stop()
+    fast_pool.shutdown()
+    stop_logging()
+
+
+# =========================
+# IMAGE INGEST
+# =========================
+# Uploads are decoded once from memory (see imaging.py). The original is only
+# written to UPLOAD_FOLDER when SAVE_UPLOADS is set; large JPEGs use libjpeg's
+# reduced-size draft decoding unless JPEG_DRAFT_DECODE=false.
+SAVE_UPLOADS = os.environ.get("SAVE_UPLOADS", "false").lower() == "true"
+JPEG_DRAFT_DECODE = os.environ.get("JPEG_DRAFT_DECODE", "true").lower() == "true"
 
 
 # =========================
@@ -85,172 +619,899 @@ async def root():
             "predict_brain": "/predict/brain (POST)",
             "predict_chest": "/predict/chest (POST)",
             "predict_skin": "/predict/skin (POST)",
-            "uploads": "/uploads (Static files)",
+            "predict_batch": "/predict/{brain|chest|skin}/batch (POST, NDJSON stream)",
+            "uploads": "/uploads/{name} (GET, cacheable artifacts)",
+            "jobs": "/jobs/{job_id} (GET), /jobs/{job_id}/events (SSE)",
+            "stats": "/stats (GET)",
+            "metrics": "/metrics (GET, Prometheus text format)",
+            "health": "/healthz (GET, live), /readyz (GET, models warmed)",
+            "models": "/admin/models (GET), /admin/models/reload (POST)",
         },
         "status": "running",
     }
 
 
+@app.api_route("/uploads/{name}", methods=["GET", "HEAD"])
+async def serve_artifact(name: str, request: Request):
+    """Serve a stored artifact with ETag, Cache-Control and byte-range support."""
+    found = await asyncio.to_thread(artifact_store.read, name)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    data, etag = found
+    headers = {
+        "ETag": etag,
+        # Hash-named artifacts never change; anything else must be revalidated.
+        "Cache-Control": "no-cache" if etag.startswith("W/") else ARTIFACT_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or etag.removeprefix("W/") in tags:
+            return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or (if_range.strip() == etag and not etag.startswith("W/")):
+        byte_range = parse_range(request.headers.get("range"), len(data))
+    if byte_range == "unsatisfiable":
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{len(data)}"})
+    if byte_range is not None:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(data[start : end + 1], status_code=206, headers=headers, media_type=media_type)
+    return Response(data, headers=headers, media_type=media_type)
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "uptime_s": startup.report()["uptime_s"]}
+
+
+@app.get("/readyz")
+async def readyz():
+    ready, models = readiness()
+    body = {"ready": ready, "models": models, **startup.report()}
+    if not ready:
+        return JSONResponse(body, status_code=503)
+    return body
+
+
+@app.get("/stats")
+async def stats():
+    # Under shm_serving.py most of these are round trips to an inference process.
+    return await asyncio.to_thread(service_stats)
+
+
+def service_stats():
+    resident = model_pool.resident()
+    return {
+        "models": model_pool.stats(),
+        "batching": {
+            name: {"gradcam": runtime.batcher.stats(), "predict": runtime.predict_batcher.stats()}
+            for name, runtime in resident.items()
+        },
+        "inference": {name: runtime.describe_backend() for name, runtime in resident.items()},
+        "shap": {name: runtime.shap_service.stats() for name, runtime in resident.items()},
+        "pools": {"fast": fast_pool.stats()},
+        "jobs": {"shap": deep_scan_jobs.stats()},
+        "cache": result_cache.stats(),
+        "ipc": inference_client.stats() if inference_client is not None else None,
+        "shadow": shadow_stats(),
+        "artifacts": artifact_store.stats(),
+        "startup": startup.report(),
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # The collector asks the inference processes for their stats under shm_serving.py.
+    body = await asyncio.to_thread(metrics.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+@metrics.collector
+def collect_service_metrics():
+    """Live queue, pool, cache and model gauges, and their cumulative counters, for /metrics."""
+    families = []
+    resident = model_pool.resident()
+    for name, runtime in resident.items():
+        families += stats_families(
+            "batcher", runtime.batcher.stats(), {"modality": name, "kind": "gradcam"}, skip=("max_wait_ms",)
+        )
+        families += stats_families(
+            "batcher", runtime.predict_batcher.stats(), {"modality": name, "kind": "predict"}, skip=("max_wait_ms",)
+        )
+    families += stats_families("pool", fast_pool.stats(), {"pool": "fast"})
+    families += stats_families("jobs", deep_scan_jobs.stats(), {"kind": "shap"})
+    families += stats_families("result_cache", result_cache.stats())
+    families += stats_families("artifacts", artifact_store.stats())
+    if inference_client is not None:
+        families += stats_families("ipc", inference_client.stats(), skip=("worker",))
+    for name, shadow in shadow_stats().items():
+        families += stats_families("shadow", shadow, {"modality": name})
+        for version, candidate in shadow["candidates"].items():
+            families += stats_families("shadow_candidate", candidate, {"modality": name, "candidate": version})
+    families += startup.gauges()
+    pool = model_pool.stats()
+    families += stats_families("models", {"resident_bytes": pool["resident_bytes"], "resident": len(resident)})
+    return merge_families(families)
+
+
 # =========================
-# PREDICTION ENDPOINTS
+# EXPLANATION HELPERS
 # =========================
+# These run on the worker pools, never on the event loop. Heatmaps and SHAP
+# plots are drawn with NumPy/OpenCV (render.py), so any number of jobs can
+# render at once; SHAP_IMAGE_FORMAT picks png or webp for the SHAP image.
+SHAP_IMAGE_FORMAT = os.environ.get("SHAP_IMAGE_FORMAT", "png").lower()
+if SHAP_IMAGE_FORMAT not in ("png", "webp"):
+    print(f"⚠️ Unknown SHAP_IMAGE_FORMAT {SHAP_IMAGE_FORMAT!r}, using png")
+    SHAP_IMAGE_FORMAT = "png"
+
+
+def save_upload(filename, contents):
+    """Keep the original upload in the artifact store; returns its URL."""
+    ext = os.path.splitext(filename or "")[1] or ".bin"
+    return f"uploads/{artifact_store.put(contents, ext)}"
+
+
+def write_artifact(name, data):
+    """Store encoded artifact bytes; returns the URL.
+
+    Only the extension of `name` is kept: the stored name is a hash of `data`,
+    so the same heatmap or plot is written once however often it is served.
+    """
+    with stage("artifact_write"):
+        stored = artifact_store.put(data, os.path.splitext(name)[1])
+    return f"uploads/{stored}"
 
 
-@app.post("/predict/brain")
-async def predict_brain(image: UploadFile = File(...), deep_scan: str = Form("true")):
-    if not brain_model:
-        raise HTTPException(status_code=500, detail="Brain model not loaded")
+def decode_upload(contents):
+    """Decode upload bytes and build the model tensor (timed separately)."""
+    with stage("decode"):
+        decoded = decode_image(contents, draft=JPEG_DRAFT_DECODE)
+    with stage("preprocess"):
+        decoded.tensor
+    return decoded
 
+
+def render_heatmap(heatmap, decoded, base_name):
+    """Blend a Grad-CAM heatmap over the original image and save it.
+
+    Returns (url, jpeg_bytes), or (None, None) on failure.
+    """
     try:
-        is_deep_scan = deep_scan.lower() == "true"
-        filepath = os.path.join(UPLOAD_FOLDER, image.filename)
+        with stage("render"):
+            data = render_gradcam(heatmap, decoded.bgr)
+        return write_artifact(f"{base_name}_heatmap.jpg", data), data
 
-        with open(filepath, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
+    except Exception as e:
+        logger.exception("Grad-CAM generation failed: %s", e)
+        return None, None
 
-        # ---- Prediction ----
-        img = preprocess_image(filepath)
-        raw_pred = brain_model(img, training=False)
-        preds = np.array(raw_pred).flatten()
 
-        # Handle binary model
-        if len(preds) == 1:
-            preds = np.array([1 - preds[0], preds[0]])
+def render_shap(runtime, decoded, raw_pred, base_name, progress=None, budget_s=None, target=None):
+    """Run SHAP and save the plot.
 
-        pred_index = int(np.argmax(preds))
-        pred_label = (
-            brain_classes[pred_index] if pred_index < len(brain_classes) else "Unknown"
+    Returns (url, image_bytes, quality), or (None, None, None) on failure.
+    """
+    try:
+        data, quality = render_shap_image(
+            SerializedModel(runtime.model),
+            decoded.tensor,
+            decoded.rgb,
+            class_names=runtime.classes,
+            preds=raw_pred,
+            progress=progress,
+            shap_service=runtime.shap_service,
+            fmt=SHAP_IMAGE_FORMAT,
+            budget_s=budget_s,
+            target=target,
         )
+        if data is not None:
+            return write_artifact(shap_artifact_name(base_name), data), data, quality
+    except Exception as e:
+        logger.exception("SHAP failed: %s", e)
+    return None, None, None
 
-        # ---- Auto detect last conv layer for Grad-CAM ----
-        # ---- Auto detect last conv layer for Grad-CAM ----
-        def find_last_conv_layer(model):
-            """Recursively find the last convolutional layer in a model."""
-            with open("layer_debug.log", "a") as f:
-                f.write(f"Scanning model layers...\n")
-                
-            for layer in reversed(model.layers):
-                with open("layer_debug.log", "a") as f:
-                    f.write(f"Checking layer: {layer.name} ({type(layer).__name__})\n")
-                
-                # Check for nested models (e.g., VGG16, ResNet base)
-                if hasattr(layer, 'layers'):
-                    with open("layer_debug.log", "a") as f:
-                        f.write(f"  -> Descending into nested model: {layer.name}\n")
-                    result = find_last_conv_layer(layer)
-                    if result:
-                        return result
-                # Check for direct Conv layer
-                if 'conv' in layer.name.lower() or isinstance(layer, keras.layers.Conv2D):
-                    with open("layer_debug.log", "a") as f:
-                        f.write(f"✅ Found match: {layer.name}\n")
-                    return layer.name
-            return None
-
-        with open("layer_debug.log", "w") as f:
-            f.write("--- New Request ---\n")
-            
-        last_conv_layer = find_last_conv_layer(brain_model)
-        
-        with open("layer_debug.log", "a") as f:
-            f.write(f"Final Selection: {last_conv_layer}\n")
-
-        if last_conv_layer:
-            print(f"✅ Found last conv layer: {last_conv_layer}")
-        else:
-            print("⚠️ No convolutional layer found for Grad-CAM")
 
-        heatmap_url = None
-        shap_url = None
+def render_class_heatmaps(heatmaps, class_idx, raw_pred, decoded, base_name, classes):
+    """Overlay one heatmap per explained class; returns entries, most likely class first."""
+    probs = summarize_prediction(raw_pred, classes)
+    entries = []
+    for heatmap, index in zip(heatmaps, class_idx):
+        index = int(index)
+        label = probs["labels"][index] if index < len(probs["labels"]) else str(index)
+        url, _ = render_heatmap(heatmap, decoded, base_name)
+        entries.append({"class": label, "index": index, "probability": probs["values"][index], "heatmap": url})
+    return entries
+
+
+def parse_gradcam_classes(value):
+    """`top` -> 1 (the default single map), `all` -> None, or a positive class count."""
+    value = (value or "top").strip().lower()
+    if value == "top":
+        return 1
+    if value == "all":
+        return None
+    try:
+        top_k = int(value)
+    except ValueError:
+        top_k = 0
+    if top_k < 1:
+        raise HTTPException(status_code=400, detail="gradcam_classes must be top, all or a positive integer")
+    return top_k
+
+
+def shap_artifact_name(base_name):
+    return f"{base_name}_shap.{SHAP_IMAGE_FORMAT}"
+
+
+def summarize_prediction(raw_pred, classes):
+    """Labels, percentage values and top label for one raw model output row."""
+    preds = np.array(raw_pred).flatten()
+
+    # Handle binary model
+    if len(preds) == 1:
+        preds = np.array([1 - preds[0], preds[0]])
+
+    pred_index = int(np.argmax(preds))
+    return {
+        "labels": classes[: len(preds)],
+        "values": [round(float(p) * 100, 2) for p in preds],
+        "prediction": classes[pred_index] if pred_index < len(classes) else "Unknown",
+    }
+
+
+async def lease_model(modality):
+    """Lease a modality's live model, loading it off the event loop if needed."""
+    if model_pool.get(modality) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown modality: {modality}")
+    if inference_client is None:
+        lease = model_pool.acquire(modality, load=False)
+    else:
+        # A remote lease is a round trip to an inference process.
+        lease = await asyncio.to_thread(model_pool.acquire, modality, False)
+    if lease.runtime is None:
+        try:
+            lease = await asyncio.to_thread(model_pool.acquire, modality)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Could not load {modality} model: {e}")
+    if lease.runtime is None:
+        raise HTTPException(
+            status_code=503,
+            detail=f"{modality.capitalize()} model not available yet: federated global model training in progress",
+        )
+    return lease
+
+
+def busy_error(exc):
+    """Translate a saturated pool or queue into a 503 the client can back off from."""
+    return HTTPException(
+        status_code=503,
+        detail=f"Server busy: {exc}",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+# =========================
+# PREDICTION ENDPOINTS
+# =========================
+
+
+@app.post("/predict/{modality}")
+async def predict(
+    modality: str,
+    image: UploadFile = File(...),
+    deep_scan: str = Form("true"),
+    gradcam: str = Form("true"),
+    shap_budget_ms: Optional[float] = Form(None),
+    shap_target: Optional[float] = Form(None),
+    gradcam_classes: str = Form("top"),
+    gradcam_method: str = Form("gradcam"),
+):
+    """Brain, chest and skin scans share this path; only the model and classes differ.
+
+    gradcam=false skips the heatmap and serves the prediction from the fast
+    inference backend (see INFERENCE BACKEND). shap_budget_ms and shap_target
+    bound the deep scan's SHAP refinement (see MODEL REGISTRY).
+    gradcam_classes (top, all or k) and gradcam_method (gradcam, gradcam++)
+    add per-class heatmaps, computed in one pass (GradCamEngine.explain_classes).
+    """
+    if shap_budget_ms is None:
+        shap_budget_ms = SHAP_BUDGET_MS
+    if shap_budget_ms is not None and shap_budget_ms <= 0:
+        raise HTTPException(status_code=400, detail="shap_budget_ms must be positive")
+    if shap_target is not None and not 0 < shap_target <= 1:
+        raise HTTPException(status_code=400, detail="shap_target must be in (0, 1]")
+    if gradcam_method not in CAM_METHODS:
+        raise HTTPException(status_code=400, detail=f"gradcam_method must be one of {', '.join(CAM_METHODS)}")
+    top_k = parse_gradcam_classes(gradcam_classes)
+    # The default single top-class Grad-CAM keeps the micro-batched, cached path.
+    class_maps = None if top_k == 1 and gradcam_method == "gradcam" else (top_k, gradcam_method)
+    # The whole request, including any deep-scan job it queues, is answered by
+    # the model version that was live when it arrived.
+    with await lease_model(modality) as runtime:
+        return await scan_image(runtime, image, deep_scan, gradcam, shap_budget_ms, shap_target, class_maps)
+
+
+async def scan_image(runtime, image, deep_scan, gradcam="true", shap_budget_ms=None, shap_target=None,
+                     class_maps=None):
+    is_deep_scan = deep_scan.lower() == "true"
+    with_gradcam = gradcam.lower() == "true" and runtime.engine.layer_name is not None
+    # Reject deep scans up front rather than after the fast path has run.
+    if is_deep_scan and deep_scan_jobs.saturated():
+        raise busy_error(QueueFull(deep_scan_jobs.retry_after()))
+
+    try:
         base_name = os.path.splitext(image.filename)[0]
+        with stage("upload_read"):
+            contents = await image.read()
 
-        # ---- Safe Grad-CAM ----
-        if last_conv_layer is not None:
-            try:
-                with open("gradcam_debug.log", "a") as f:
-                    f.write(f"Calling grad_cam for layer: {last_conv_layer}\n")
-                
-                heatmap = grad_cam(brain_model, img, last_conv_layer)
-                
-                if heatmap is not None:
-                    with open("gradcam_debug.log", "a") as f:
-                        f.write(f"Grad-CAM returned heatmap with shape: {heatmap.shape}\n")
-                        
-                    heatmap = cv2.resize(heatmap, (224, 224))
-                    heatmap = cv2.applyColorMap(np.uint8(255 * heatmap), cv2.COLORMAP_JET)
-    
-                    original = cv2.imread(filepath)
-                    original = cv2.resize(original, (224, 224))
-                    overlay = cv2.addWeighted(original, 0.6, heatmap, 0.4, 0)
-    
-                    heatmap_name = f"{base_name}_heatmap.jpg"
-                    heatmap_path = os.path.join(UPLOAD_FOLDER, heatmap_name)
-                    cv2.imwrite(heatmap_path, overlay)
-                    heatmap_url = f"uploads/{heatmap_name}"
-                    
-                    with open("gradcam_debug.log", "a") as f:
-                         f.write(f"Saved heatmap to {heatmap_url}\n")
-                else:
-                    with open("gradcam_debug.log", "a") as f:
-                        f.write(f"Grad-CAM returned None\n")
+        cache_key = ResultCache.key(contents, runtime.version)
+        cached = await fast_pool.run(result_cache.get, cache_key)
+        if SAVE_UPLOADS:
+            await fast_pool.run(save_upload, image.filename, contents)
 
-            except Exception as e:
-                err_msg = f"Grad-CAM generation failed: {e}"
-                print(f"❌ {err_msg}")
-                with open("gradcam_debug.log", "a") as f:
-                    f.write(f"{err_msg}\n")
-                import traceback
-                traceback.print_exc()
-
-        # ---- Safe SHAP ----
-        if is_deep_scan:
-            try:
-                original = cv2.imread(filepath)
-                shap_name = f"{base_name}_shap.png"
-                shap_path = os.path.join(UPLOAD_FOLDER, shap_name)
+        decoded = None
+        heatmap_url = None
+        class_heatmaps = None
+        if with_gradcam and class_maps is not None:
+            # ---- Per-class Grad-CAM(++) ----
+            # One forward pass for every requested class. Not cached, so a
+            # cached single-class heatmap is left as it is.
+            decoded = await fast_pool.run(decode_upload, contents)
+            with stage("gradcam"):
+                raw_pred, class_idx, heatmaps = await fast_pool.run(
+                    runtime.explain_classes, decoded.tensor, *class_maps
+                )
+            class_heatmaps = await fast_pool.run(
+                render_class_heatmaps, heatmaps[0], class_idx[0], raw_pred, decoded, base_name, runtime.classes
+            )
+            heatmap_url = class_heatmaps[0]["heatmap"]
+            if cached is None:
+                cached = CachedResult(raw_pred)
+        elif cached is not None and (cached.heatmap is not None or not with_gradcam):
+            # ---- Cached prediction ----
+            raw_pred = cached.preds
+            if with_gradcam:
+                heatmap_url = await fast_pool.run(
+                    write_artifact, f"{base_name}_heatmap.jpg", cached.heatmap
+                )
+        else:
+            # ---- Prediction ----
+            decoded = await fast_pool.run(decode_upload, contents)
+            # Includes the wait for a micro-batch to fill.
+            if with_gradcam:
+                with stage("gradcam"):
+                    raw_pred, heatmaps = await asyncio.wrap_future(runtime.batcher.submit(decoded.tensor))
+            else:
+                with stage("inference"):
+                    raw_pred = await asyncio.wrap_future(runtime.predict_batcher.submit(decoded.tensor))
+                heatmaps = None
 
-                success = generate_shap_plot(
-                    brain_model, img, original, shap_path, class_names=brain_classes
+            # ---- Safe Grad-CAM ----
+            heatmap_bytes = None
+            if heatmaps is not None:
+                heatmap_url, heatmap_bytes = await fast_pool.run(
+                    render_heatmap, heatmaps[0], decoded, base_name
+                )
+            # Keep a SHAP plot already cached for this upload.
+            shap_bytes = cached.shap if cached is not None else None
+            cached = CachedResult(raw_pred, heatmap=heatmap_bytes, shap=shap_bytes)
+            await fast_pool.run(result_cache.put, cache_key, cached)
+
+        # ---- SHAP (background job) ----
+        shap_url = None
+        job_id = None
+        if is_deep_scan:
+            if cached.shap is not None:
+                shap_url = await fast_pool.run(
+                    write_artifact, shap_artifact_name(base_name), cached.shap
+                )
+            else:
+                if decoded is None:
+                    decoded = await fast_pool.run(decode_upload, contents)
+                payload = {
+                    "base_name": base_name,
+                    "cache_key": cache_key,
+                    "modality": runtime.name,
+                    "model_version": runtime.version,
+                    "raw_pred": np.asarray(raw_pred).tolist(),
+                    "shap_deadline": time.time() + shap_budget_ms / 1000 if shap_budget_ms else None,
+                    "shap_target": shap_target,
+                }
+                job_id = await fast_pool.run(
+                    deep_scan_jobs.submit,
+                    payload,
+                    dedupe_key=cache_key,
+                    inputs=decoded.to_bytes(),
                 )
-                if success:
-                    shap_url = f"uploads/{shap_name}"
-            except Exception as e:
-                print(f"⚠️ SHAP failed: {e}")
 
         return {
-            "labels": brain_classes[: len(preds)],
-            "values": [round(float(p) * 100, 2) for p in preds],
-            "prediction": pred_label,
+            **summarize_prediction(raw_pred, runtime.classes),
             "heatmap": heatmap_url,
+            "heatmaps": class_heatmaps,
             "shap": shap_url,
+            "job_id": job_id,
+            "job": f"/jobs/{job_id}" if job_id else None,
+            "model_version": runtime.version,
         }
+    except (PoolSaturated, QueueFull) as e:
+        raise busy_error(e)
     except Exception as e:
-        print(f"🔥 Prediction error: {e}")
+        logger.exception("Prediction error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/predict/chest")
-async def predict_chest(image: UploadFile = File(...)):
+# =========================
+# BULK PREDICTION
+# =========================
+# Whole study folders are scored in chunks of BULK_CHUNK_SIZE images, one
+# forward pass per chunk, with results streamed back as NDJSON (one JSON
+# object per line) as each chunk finishes. The next chunk is read and decoded
+# while the current one is on the model, and only those two chunks are ever
+# held in memory.
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "32"))
+BULK_MAX_FILE_MB = float(os.environ.get("BULK_MAX_FILE_MB", "50"))
+
+
+class LeasedStreamingResponse(StreamingResponse):
+    """A streamed response that releases a model lease once it is over.
+
+    The lease is released however sending ends: finished, failed, or the
+    client gone before (or while) the body was read.
+    """
+
+    def __init__(self, content, lease, **kwargs):
+        super().__init__(content, **kwargs)
+        self.lease = lease
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.lease.release()
+
+
+def decode_chunk(items, model_version):
+    """Decode (name, bytes) pairs; failures become per-item error strings."""
+    decoded = []
+    for index, name, data in items:
+        if isinstance(data, Exception):
+            decoded.append((index, name, None, None, str(data)))
+            continue
+        try:
+            image = decode_upload(data)
+            key = ResultCache.key(data, model_version)
+            decoded.append((index, name, image, key, None))
+        except Exception as e:
+            decoded.append((index, name, None, None, f"Could not decode image: {e}"))
+    return decoded
+
+
+def score_chunk(runtime, decoded, with_gradcam):
+    """One batched forward pass (plus optional Grad-CAM) for a decoded chunk."""
+    results = {}
+    pending = []
+    for index, name, image, key, error in decoded:
+        if error is not None:
+            results[index] = {"index": index, "name": name, "error": error}
+            continue
+        cached = result_cache.get(key)
+        if cached is not None and (cached.heatmap is not None or not with_gradcam):
+            heatmap_url = None
+            if with_gradcam:
+                heatmap_url = write_artifact(f"{artifact_stem(name)}_heatmap.jpg", cached.heatmap)
+            results[index] = {
+                "index": index,
+                "name": name,
+                **summarize_prediction(cached.preds, runtime.classes),
+                "heatmap": heatmap_url,
+                "model_version": runtime.version,
+            }
+        else:
+            pending.append((index, name, image, key))
+
+    if pending:
+        batch = np.concatenate([image.tensor for _, _, image, _ in pending], axis=0)
+        if with_gradcam:
+            with stage("gradcam"), model_lock:
+                preds, heatmaps = runtime.engine(batch)
+            shadow_models[runtime.name].observe(batch, preds, runtime.version)
+        else:
+            with stage("inference"):
+                preds, heatmaps = runtime.predict_fast(batch), None
+
+        for row, (index, name, image, key) in enumerate(pending):
+            heatmap_url = heatmap_bytes = None
+            if heatmaps is not None:
+                heatmap_url, heatmap_bytes = render_heatmap(
+                    heatmaps[row], image, artifact_stem(name)
+                )
+            result_cache.put(key, CachedResult(preds[row : row + 1], heatmap=heatmap_bytes))
+            results[index] = {
+                "index": index,
+                "name": name,
+                **summarize_prediction(preds[row], runtime.classes),
+                "heatmap": heatmap_url,
+                "model_version": runtime.version,
+            }
+
+    return [results[index] for index, *_ in decoded]
+
+
+def read_numbered_chunk(source, start, size):
+    return [(start + i, name, data) for i, (name, data) in enumerate(read_chunk(source, size))]
+
+
+@app.post("/predict/{modality}/batch")
+async def predict_batch(
+    modality: str,
+    images: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    gradcam: str = Form("false"),
+):
+    """Score many images (files and/or one zip/tar archive) as an NDJSON stream."""
+    if not images and archive is None:
+        raise HTTPException(status_code=400, detail="Send image files or an archive")
+    # One model version scores the whole request, even across a swap. The
+    # response releases the lease once it has been sent (or abandoned).
+    lease = await lease_model(modality)
+    try:
+        return LeasedStreamingResponse(
+            bulk_stream(lease.runtime, images, archive, gradcam), lease, media_type="application/x-ndjson"
+        )
+    except BaseException:
+        lease.release()
+        raise
+
+
+async def bulk_stream(runtime, images, archive, gradcam):
+    """NDJSON lines for predict_batch: one per image, then a summary."""
+    max_bytes = int(BULK_MAX_FILE_MB * 1024 * 1024)
+
+    def sources():
+        if images:
+            yield from iter_files(images, max_bytes)
+        if archive is not None:
+            yield from iter_archive(archive.file, max_bytes)
+
+    source = sources()
+
+    async def next_chunk(start, version):
+        items = await fast_pool.run(read_numbered_chunk, source, start, BULK_CHUNK_SIZE)
+        return await fast_pool.run(decode_chunk, items, version) if items else []
+
+    with_gradcam = gradcam.lower() == "true" and runtime.engine.layer_name is not None
+    count = errors = 0
+    upcoming = None
+    try:
+        upcoming = asyncio.ensure_future(next_chunk(0, runtime.version))
+        while True:
+            decoded = await upcoming
+            if not decoded:
+                break
+            count += len(decoded)
+            # Read + decode the next chunk while this one is on the model.
+            upcoming = asyncio.ensure_future(next_chunk(count, runtime.version))
+            for result in await fast_pool.run(score_chunk, runtime, decoded, with_gradcam):
+                errors += "error" in result
+                yield json.dumps(result) + "\n"
+    except (PoolSaturated, QueueFull) as e:
+        yield json.dumps({"error": f"Server busy: {e}", "retry_after": e.retry_after}) + "\n"
+    except ValueError as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+    finally:
+        # The client may leave while the next chunk is being read.
+        if upcoming is not None and not upcoming.done():
+            upcoming.cancel()
+    yield json.dumps(
+        {"done": True, "count": count, "errors": errors, "model_version": runtime.version}
+    ) + "\n"
+
+
+# =========================
+# VOLUME PREDICTION
+# =========================
+# A NIfTI volume or DICOM series is scored slice by slice. Chunks of
+# VOLUME_CHUNK_SLICES slices are read, windowed and resized (see volume.py),
+# then run as one batch. The next chunk is prepared while the current one is
+# on the model. Only the VOLUME_TOP_SLICES most suspicious slices are kept
+# after their chunk. They get Grad-CAMs and decide the volume-level result,
+# by averaging their probabilities (top-k pooling), so at least one is kept.
+VOLUME_CHUNK_SLICES = int(os.environ.get("VOLUME_CHUNK_SLICES", "32"))
+VOLUME_TOP_SLICES = max(1, int(os.environ.get("VOLUME_TOP_SLICES", "3")))
+VOLUME_MAX_MB = float(os.environ.get("VOLUME_MAX_MB", "2048"))
+
+
+def read_volume_chunk(volume, start):
+    with stage("decode"):
+        return volume.read(start, min(start + VOLUME_CHUNK_SLICES, len(volume)))
+
+
+def score_volume_chunk(runtime, rgb, start, top):
+    """Predictions for one chunk of slices; tracks the most suspicious ones."""
+    batch = rgb.astype(np.float32)
+    batch /= 255.0
+    with stage("inference"):
+        preds = runtime.predict_fast(batch)
+    scores = suspicion(preds, runtime.classes)
+    top.add(scores, start, rgb)
+    return preds, scores
+
+
+def explain_top_slices(runtime, ranked, stem, with_gradcam):
+    """Grad-CAM overlays for the most suspicious slices, in one forward pass."""
+    heatmaps = None
+    if with_gradcam and ranked:
+        batch = np.stack([rgb for _, _, rgb in ranked]).astype(np.float32) / 255.0
+        with stage("gradcam"), model_lock:
+            _, heatmaps = runtime.engine(batch)
+    results = []
+    for row, (score, index, rgb) in enumerate(ranked):
+        heatmap_url = None
+        if heatmaps is not None:
+            heatmap_url, _ = render_heatmap(heatmaps[row], DecodedImage(rgb), f"{stem}_slice{index:04d}")
+        results.append({"slice": index, "suspicion": round(score, 4), "heatmap": heatmap_url})
+    return results
+
+
+@app.post("/predict/{modality}/volume")
+async def predict_volume(
+    modality: str,
+    volume: UploadFile = File(...),
+    gradcam: str = Form("true"),
+    window_center: Optional[float] = Form(None),
+    window_width: Optional[float] = Form(None),
+):
+    """Score every slice of a NIfTI volume or DICOM series (zip/tar or multi-frame file).
+
+    Returns per-slice predictions, a volume-level aggregate and Grad-CAMs of
+    the most suspicious slices. window_center/window_width override the
+    intensity window (otherwise the file's, or robust percentiles).
+    """
+    if (window_center is None) != (window_width is None):
+        raise HTTPException(status_code=400, detail="Send both window_center and window_width")
+    if window_width is not None and window_width <= 0:
+        raise HTTPException(status_code=400, detail="window_width must be positive")
+
+    with await lease_model(modality) as runtime:
+        workdir = tempfile.mkdtemp(prefix="volume-")
+        upcoming = None
+        try:
+            with stage("upload_read"):
+                vol = await fast_pool.run(
+                    open_volume, volume.file, volume.filename, workdir, int(VOLUME_MAX_MB * 1024 * 1024)
+                )
+            await fast_pool.run(vol.set_window, window_center, window_width)
+
+            top = TopSlices(VOLUME_TOP_SLICES)
+            preds, scores = [], []
+            upcoming = asyncio.ensure_future(fast_pool.run(read_volume_chunk, vol, 0))
+            for start in range(0, len(vol), VOLUME_CHUNK_SLICES):
+                rgb = await upcoming
+                if start + VOLUME_CHUNK_SLICES < len(vol):
+                    # Read the next chunk while this one is on the model.
+                    upcoming = asyncio.ensure_future(
+                        fast_pool.run(read_volume_chunk, vol, start + VOLUME_CHUNK_SLICES)
+                    )
+                chunk_preds, chunk_scores = await fast_pool.run(score_volume_chunk, runtime, rgb, start, top)
+                preds.append(chunk_preds)
+                scores.append(chunk_scores)
+            preds = np.concatenate(preds, axis=0)
+            scores = np.concatenate(scores)
+
+            ranked = top.ranked()
+            with_gradcam = gradcam.lower() == "true" and runtime.engine.layer_name is not None
+            stem = artifact_stem(volume.filename or "volume")
+            suspicious = await fast_pool.run(explain_top_slices, runtime, ranked, stem, with_gradcam)
+        except (PoolSaturated, QueueFull) as e:
+            raise busy_error(e)
+        except ImportError as e:
+            raise HTTPException(status_code=501, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.exception("Volume prediction error: %s", e)
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            if upcoming is not None and not upcoming.done():
+                # A read still in flight must finish before its files go away.
+                await asyncio.gather(upcoming, return_exceptions=True)
+            await asyncio.to_thread(shutil.rmtree, workdir, True)
+
+    slices = []
+    for index, (row, score) in enumerate(zip(preds, scores)):
+        summary = summarize_prediction(row, runtime.classes)
+        slices.append({"slice": index, "prediction": summary["prediction"], "values": summary["values"],
+                       "suspicion": round(float(score), 4)})
+    for item in suspicious:
+        item["prediction"] = slices[item["slice"]]["prediction"]
+    top_rows = [index for _, index, _ in ranked]
+    pooled = summarize_prediction(preds[top_rows].mean(axis=0), runtime.classes)
     return {
-        "labels": chest_classes,
-        "values": [80.1, 12.4, 7.5],
-        "prediction": "Normal",
-        "heatmap": None,
-        "status": "Federated global model training in progress",
+        "labels": pooled["labels"],
+        "volume": {
+            "prediction": pooled["prediction"],
+            "values": pooled["values"],
+            "mean_values": summarize_prediction(preds.mean(axis=0), runtime.classes)["values"],
+            "max_suspicion": round(float(scores.max()), 4),
+            "pooled_slices": len(top_rows),
+        },
+        "suspicious_slices": suspicious,
+        "slices": slices,
+        "source": vol.describe(),
+        "model_version": runtime.version,
     }
 
 
-@app.post("/predict/skin")
-async def predict_skin(image: UploadFile = File(...)):
+# =========================
+# JOB ENDPOINTS
+# =========================
+
+
+def job_response(job):
+    result = job["result"] or {}
     return {
-        "labels": skin_classes,
-        "values": [85.2, 14.8],
-        "prediction": "Benign",
-        "heatmap": None,
-        "status": "Federated global model training in progress",
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "shap": result.get("shap"),
+        "shap_quality": result.get("shap_quality"),
+        "model_version": result.get("model_version"),
+        "error": job["error"],
     }
 
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    try:
+        job = await fast_pool.run(deep_scan_jobs.get, job_id)
+    except PoolSaturated as e:
+        raise busy_error(e)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(job)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events stream of job progress, ending when the job finishes."""
+    try:
+        job = await fast_pool.run(deep_scan_jobs.get, job_id)
+    except PoolSaturated as e:
+        raise busy_error(e)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream(job):
+        last_sent = None
+        while True:
+            body = json.dumps(job_response(job))
+            if body != last_sent:
+                yield f"event: {job['status']}\ndata: {body}\n\n"
+                last_sent = body
+            if job["status"] in (DONE, FAILED):
+                return
+            await asyncio.sleep(0.5)
+            try:
+                latest = deep_scan_jobs.peek(job_id) or await fast_pool.run(deep_scan_jobs.get, job_id)
+            except PoolSaturated:
+                continue  # the pool is busy: poll again on the next tick
+            if latest is None:
+                return  # purged while we were following it
+            job = latest
+
+    return StreamingResponse(
+        stream(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+# =========================
+# MODEL ADMIN
+# =========================
+# Set ADMIN_TOKEN to require a matching X-Admin-Token header on these routes.
+
+
+def check_admin(token):
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.get("/admin/models")
+async def list_models(x_admin_token: Optional[str] = Header(None)):
+    check_admin(x_admin_token)
+    return await asyncio.to_thread(model_pool.stats)
+
+
+@app.post("/admin/models/reload")
+async def reload_model(
+    modality: str = Form("brain"),
+    path: Optional[str] = Form(None),
+    wait: str = Form("false"),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Load a new version of a modality's model and swap it in.
+
+    `path` may name another file inside the models folder (default: the
+    modality's global model file). With wait=true the
+    call returns once the new version is live; otherwise loading continues in
+    the background and progress shows up in GET /admin/models.
+    """
+    check_admin(x_admin_token)
+    registry = model_pool.get(modality)
+    if registry is None:
+        raise HTTPException(status_code=404, detail=f"Unknown modality: {modality}")
+    if path is not None:
+        try:
+            path = model_file(path)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.exists(path or registry.path):
+        raise HTTPException(status_code=404, detail="Model file not found")
+
+    if wait.lower() != "true":
+        # Returns at once in-process; under shm_serving.py it waits for every inference process to start.
+        await asyncio.to_thread(model_pool.reload, modality, path)
+        return {"status": "loading", "version": registry.version}
+    try:
+        version = await asyncio.to_thread(model_pool.load, modality, path)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Model load failed: {e}")
+    return {"status": "live", "version": version}
+
+
+@app.get("/admin/shadow")
+async def list_shadow_models(x_admin_token: Optional[str] = Header(None)):
+    """Per modality: each candidate's agreement with production, and the shadow cost."""
+    check_admin(x_admin_token)
+    return await asyncio.to_thread(shadow_stats)
+
+
+@app.post("/admin/shadow")
+async def start_shadow(
+    path: str = Form(...),
+    modality: str = Form("brain"),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Score live `modality` traffic with the candidate model file `path` (inside the models folder)."""
+    check_admin(x_admin_token)
+    if modality not in shadow_models:
+        raise HTTPException(status_code=404, detail=f"Unknown modality: {modality}")
+    try:
+        path = model_file(path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Model file not found")
+    try:
+        version = await asyncio.to_thread(add_shadow, modality, path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Candidate load failed: {e}")
+    return {"status": "shadowing", "modality": modality, "version": version}
+
+
+@app.delete("/admin/shadow/{modality}/{version}")
+async def stop_shadow(modality: str, version: str, x_admin_token: Optional[str] = Header(None)):
+    check_admin(x_admin_token)
+    if modality not in shadow_models:
+        raise HTTPException(status_code=404, detail=f"Unknown modality: {modality}")
+    if not await asyncio.to_thread(remove_shadow, modality, version):
+        raise HTTPException(status_code=404, detail="Candidate not found")
+    return {"status": "removed", "modality": modality, "version": version}
+
+
+startup.mark("app_setup")
+
+
 if __name__ == "__main__":
     import uvicorn
 
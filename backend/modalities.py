@@ -0,0 +1,14 @@
+# =========================
+# CLASS LABELS
+# =========================
+# Shared by the API (main.py) and the offline scorer (score_offline.py).
+brain_classes = ["Glioma", "Meningioma", "Pituitary", "No Tumor"]
+chest_classes = ["Normal", "Pneumonia", "COVID"]
+skin_classes = ["Benign", "Malignant"]
+
+# Modality -> (global model file in the models folder, class labels).
+MODALITIES = {
+    "brain": ("global_Brain_model.keras", brain_classes),
+    "chest": ("global_Chest_model.keras", chest_classes),
+    "skin": ("global_Skin_model.keras", skin_classes),
+}
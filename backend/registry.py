@@ -0,0 +1,427 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cache import file_digest
+
+
+# =========================
+# HOT-SWAPPABLE MODEL REGISTRY
+# =========================
+# Each federated round produces a new global model file. The registry loads
+# and warms the new version on a background thread while the current one
+# keeps serving, then promotes it with a single reference swap. Requests
+# lease the version they started with, so an in-flight request always
+# finishes on one model; a replaced version is closed once its last lease
+# is returned.
+
+class _Version:
+    """A loaded model version plus its lease count."""
+
+    __slots__ = ("runtime", "version", "path", "loaded_at", "load_ms", "warmup_ms", "leases", "retired")
+
+    def __init__(self, runtime, version, path, load_ms, warmup_ms=0.0):
+        self.runtime = runtime
+        self.version = version
+        self.path = path
+        self.loaded_at = time.time()
+        self.load_ms = load_ms  # total, warmup included
+        self.warmup_ms = warmup_ms
+        self.leases = 0
+        self.retired = False
+
+
+class Lease:
+    """A pinned model version; use as a context manager or call release()."""
+
+    __slots__ = ("runtime", "_registry", "_entry")
+
+    def __init__(self, registry, entry):
+        self._registry = registry
+        self._entry = entry
+        self.runtime = entry.runtime if entry else None
+
+    def release(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._registry._release(entry)
+
+    def __enter__(self):
+        return self.runtime
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ModelRegistry:
+    """Serve the current version of one model file and swap in new ones live.
+
+    `factory(path, version)` loads a model file and returns a runtime object
+    (the model plus whatever serving machinery is built on it). The runtime
+    must provide `warmup()`, called before promotion, and `close()`, called
+    once a replaced version has no leases left.
+
+    New versions are picked up by `reload()` (e.g. from an admin endpoint) or,
+    when `watch_interval_s` > 0, by a thread that polls the model file and
+    reloads once its size and mtime have stopped changing for one interval,
+    so a file that is still being written is never loaded.
+
+    Args:
+        name: Label used in logs and stats (e.g. "brain").
+        path: Model file to serve and watch.
+        factory: Callable building a runtime from (path, version).
+        watch_interval_s: Poll interval for the model file; 0 disables.
+    """
+
+    def __init__(self, name, path, factory, watch_interval_s=0.0):
+        self.name = name
+        self.path = path
+        self.factory = factory
+        self.watch_interval_s = max(0.0, float(watch_interval_s))
+
+        self._lock = threading.Lock()
+        self._current = None
+        self._draining = []
+        self._load_lock = threading.Lock()  # one load at a time
+        self._loading = None
+        self._last_error = None
+        self._swaps = 0
+        self._loads = 0
+        self._stop = threading.Event()
+        self._watcher = None
+
+    # ---- serving ----
+    def current(self):
+        """Runtime of the live version, or None when nothing is loaded."""
+        with self._lock:
+            return self._current.runtime if self._current else None
+
+    @property
+    def version(self):
+        with self._lock:
+            return self._current.version if self._current else None
+
+    @property
+    def resident(self):
+        with self._lock:
+            return self._current is not None
+
+    def lease(self, version=None):
+        """Pin the live version for the duration of a request.
+
+        Returns a Lease whose runtime is None when no model is loaded. A swap
+        during the request does not affect it; the old version is closed
+        after release. Given a `version`, that exact version is pinned if it
+        is still live or draining (runtime None otherwise).
+        """
+        with self._lock:
+            entry = self._current
+            if version is not None and (entry is None or entry.version != version):
+                entry = next((e for e in self._draining if e.version == version), None)
+            if entry is not None:
+                entry.leases += 1
+        return Lease(self, entry)
+
+    # ---- loading ----
+    def load(self, path=None):
+        """Load, warm up and promote `path` (default: the watched file).
+
+        Blocks until done. Returns the promoted version, or the current one if
+        the file is unchanged. Raises if loading or warmup fails, in which case
+        the current version keeps serving.
+        """
+        path = path or self.path
+        with self._load_lock:
+            version = file_digest(path)[:12]
+            if version == self.version:
+                return version
+
+            self._loading = version
+            print(f"🔄 Loading {self.name} model version {version} from {path}...")
+            started = time.perf_counter()
+            try:
+                runtime = self.factory(path, version)
+                warmup_started = time.perf_counter()
+                runtime.warmup()
+            except Exception as e:
+                self._last_error = f"{version}: {e}"
+                print(f"❌ Could not load {self.name} model {version}: {e}")
+                raise
+            finally:
+                self._loading = None
+            finished = time.perf_counter()
+            load_ms = (finished - started) * 1000
+            warmup_ms = (finished - warmup_started) * 1000
+
+            self._promote(_Version(runtime, version, path, load_ms, warmup_ms))
+            self._loads += 1
+            self._last_error = None
+            print(
+                f"✅ {self.name} model version {version} live "
+                f"(loaded in {load_ms:.0f} ms, {warmup_ms:.0f} ms of it warming up)"
+            )
+            return version
+
+    def unload(self):
+        """Stop serving the live version; it is closed once its leases are returned."""
+        with self._lock:
+            entry = self._current
+            self._current = None
+            if entry is None:
+                return False
+            entry.retired = True
+            idle = entry.leases == 0
+            if not idle:
+                self._draining.append(entry)
+        if idle:
+            _close(self.name, entry)
+        return True
+
+    def reload(self, path=None):
+        """Start `load(path)` on a background thread and return immediately."""
+        t = threading.Thread(
+            target=self._load_quietly, args=(path,), name=f"registry-{self.name}-load", daemon=True
+        )
+        t.start()
+        return t
+
+    def start(self):
+        """Start watching the model file (no-op when watching is disabled)."""
+        if self.watch_interval_s <= 0 or self._watcher is not None:
+            return self
+        self._stop.clear()
+        self._watcher = threading.Thread(
+            target=self._watch, name=f"registry-{self.name}-watch", daemon=True
+        )
+        self._watcher.start()
+        print(f"👀 Watching {self.path} every {self.watch_interval_s:g}s")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(self.watch_interval_s + 1)
+            self._watcher = None
+        with self._lock:
+            entries = [e for e in [self._current, *self._draining] if e is not None]
+            self._current = None
+            self._draining = []
+        for entry in entries:
+            _close(self.name, entry)
+
+    def stats(self):
+        with self._lock:
+            current = self._current
+            return {
+                "name": self.name,
+                "path": self.path,
+                "resident": current is not None,
+                "version": current.version if current else None,
+                "loaded_at": current.loaded_at if current else None,
+                "load_ms": round(current.load_ms, 1) if current else None,
+                "warmup_ms": round(current.warmup_ms, 1) if current else None,
+                "active_leases": current.leases if current else 0,
+                "loading": self._loading,
+                "draining": [{"version": e.version, "leases": e.leases} for e in self._draining],
+                "loads": self._loads,
+                "swaps": self._swaps,
+                "last_error": self._last_error,
+                "watch_interval_s": self.watch_interval_s,
+            }
+
+    # ---- internals ----
+    def _promote(self, entry):
+        with self._lock:
+            previous = self._current
+            self._current = entry
+            if previous is None:
+                return
+            self._swaps += 1
+            previous.retired = True
+            idle = previous.leases == 0
+            if not idle:
+                self._draining.append(previous)
+        if idle:
+            _close(self.name, previous)
+
+    def _release(self, entry):
+        with self._lock:
+            entry.leases -= 1
+            idle = entry.retired and entry.leases == 0 and entry in self._draining
+            if idle:
+                self._draining.remove(entry)
+        if idle:
+            _close(self.name, entry)
+
+    def _load_quietly(self, path):
+        try:
+            self.load(path)
+        except Exception:
+            pass  # already logged and recorded in stats
+
+    def _watch(self):
+        last_seen = _file_signature(self.path)
+        loaded = last_seen if self.version else None
+        while not self._stop.wait(self.watch_interval_s):
+            signature = _file_signature(self.path)
+            settled = signature is not None and signature == last_seen
+            last_seen = signature
+            # Models that are not resident pick up the new file on next load.
+            if settled and signature != loaded and self.resident:
+                loaded = signature
+                self._load_quietly(None)
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _close(name, entry):
+    try:
+        entry.runtime.close()
+        print(f"♻️ Retired {name} model version {entry.version}")
+    except Exception as e:
+        print(f"⚠️ Error closing {name} model version {entry.version}: {e}")
+
+
+# =========================
+# LAZY MODEL POOL
+# =========================
+
+class ModelPool:
+    """Lazily loaded registries kept within a memory budget.
+
+    A model is loaded on its first `acquire()`. After each load, least
+    recently used models are unloaded until the resident total fits in
+    `max_bytes` (the model just loaded always stays). Memory is accounted per
+    runtime through its `nbytes` attribute.
+
+    Args:
+        max_bytes: Budget for resident models; 0 or None means unlimited.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = int(max_bytes or 0)
+        self._registries = {}
+        self._lock = threading.Lock()
+        self._recent = OrderedDict()  # name -> None, least recently used first
+        self._counters = {}
+
+    def add(self, registry):
+        self._registries[registry.name] = registry
+        self._counters[registry.name] = {"requests": 0, "evictions": 0}
+        return registry
+
+    def get(self, name):
+        return self._registries.get(name)
+
+    def names(self):
+        return list(self._registries)
+
+    def acquire(self, name, load=True):
+        """Lease the named model, loading it first if needed and `load` is set.
+
+        The lease's runtime is None when the model is not resident (and
+        `load` is False) or its file does not exist yet. Load errors raise.
+        """
+        registry = self._registries[name]
+        while True:
+            lease = registry.lease()
+            if lease.runtime is not None:
+                self._touch(name)
+                return lease
+            if not load or not os.path.exists(registry.path):
+                return lease
+            self.load(name)
+
+    def load(self, name, path=None):
+        """Load (or hot-swap) the named model now, then re-apply the budget."""
+        version = self._registries[name].load(path)
+        self._touch(name, request=False)
+        self._enforce_budget(keep=name)
+        return version
+
+    def reload(self, name, path=None):
+        """Start `load(name, path)` on a background thread and return immediately."""
+        def run():
+            try:
+                self.load(name, path)
+            except Exception:
+                pass  # logged and recorded in the registry's stats
+
+        t = threading.Thread(target=run, name=f"pool-{name}-load", daemon=True)
+        t.start()
+        return t
+
+    def resident(self):
+        """name -> runtime for every model currently loaded."""
+        runtimes = {}
+        for name, registry in self._registries.items():
+            runtime = registry.current()
+            if runtime is not None:
+                runtimes[name] = runtime
+        return runtimes
+
+    def resident_bytes(self):
+        return sum(_nbytes(r) for r in self.resident().values())
+
+    def start(self):
+        for registry in self._registries.values():
+            registry.start()
+        return self
+
+    def stop(self):
+        for registry in self._registries.values():
+            registry.stop()
+
+    def stats(self):
+        resident = self.resident()
+        with self._lock:
+            models = {}
+            for name, registry in self._registries.items():
+                models[name] = {
+                    **registry.stats(),
+                    **self._counters[name],
+                    "nbytes": _nbytes(resident[name]) if name in resident else 0,
+                }
+            lru = [name for name in self._recent if name in resident]
+        return {
+            "max_bytes": self.max_bytes,
+            "resident_bytes": sum(_nbytes(r) for r in resident.values()),
+            "lru_order": lru,
+            "models": models,
+        }
+
+    # ---- internals ----
+    def _touch(self, name, request=True):
+        with self._lock:
+            self._recent[name] = None
+            self._recent.move_to_end(name)
+            if request:
+                self._counters[name]["requests"] += 1
+
+    def _enforce_budget(self, keep):
+        if not self.max_bytes:
+            return
+        while self.resident_bytes() > self.max_bytes:
+            with self._lock:
+                victims = [n for n in self._recent if n != keep and self._registries[n].resident]
+                victims += [
+                    n for n, r in self._registries.items()
+                    if n != keep and n not in self._recent and r.resident
+                ]
+                if not victims:
+                    return
+                victim = victims[0]
+                self._counters[victim]["evictions"] += 1
+            print(f"📦 Unloading {victim} model to stay within the model memory budget")
+            self._registries[victim].unload()
+
+
+def _nbytes(runtime):
+    return int(getattr(runtime, "nbytes", 0) or 0)
@@ -0,0 +1,173 @@
+import cv2
+import numpy as np
+
+
+# =========================
+# ARTIFACT RENDERING
+# =========================
+# SHAP and Grad-CAM images are composed with NumPy/OpenCV into a plain
+# canvas and encoded in memory. Nothing here touches global state, so any
+# number of threads can render at once (pyplot could not), and a three-panel
+# SHAP image takes a few milliseconds instead of a matplotlib figure's
+# layout + savefig.
+
+# matplotlib's RdBu_r: the 11-colour ColorBrewer RdBu ramp, reversed and
+# linearly interpolated to 256 entries (identical to matplotlib's LUT).
+_RDBU_R = [
+    "053061", "2166ac", "4393c3", "92c5de", "d1e5f0", "f7f7f7",
+    "fddbc7", "f4a582", "d6604d", "b2182b", "67001f",
+]
+
+
+def _build_lut(hex_colors, n=256):
+    stops = np.array([[int(h[i : i + 2], 16) for i in (0, 2, 4)] for h in hex_colors], dtype=np.float64)
+    positions = np.linspace(0.0, 1.0, len(stops))
+    t = np.linspace(0.0, 1.0, n)
+    rgb = np.stack([np.interp(t, positions, stops[:, c]) for c in range(3)], axis=1)
+    return np.rint(rgb).astype(np.uint8)
+
+
+RDBU_R_LUT = _build_lut(_RDBU_R)  # (256, 3) RGB
+
+PANEL = 300  # pixel size of each square panel
+TITLE_H = 36
+MARGIN = 24
+COLORBAR_W = 16
+COLORBAR_GAP = 10
+COLORBAR_LABELS_W = 70
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+TEXT = (38, 38, 38)  # BGR, matplotlib's near-black
+
+ENCODINGS = {
+    "png": (".png", [cv2.IMWRITE_PNG_COMPRESSION, 3]),
+    "webp": (".webp", [cv2.IMWRITE_WEBP_QUALITY, 90]),
+    "jpg": (".jpg", [cv2.IMWRITE_JPEG_QUALITY, 95]),
+}
+
+
+def apply_lut(values, lut=RDBU_R_LUT):
+    """Map values in [0, 1] to RGB uint8 via a 256-entry LUT (matplotlib's binning)."""
+    index = np.clip((np.asarray(values, dtype=np.float32) * len(lut)).astype(np.int32), 0, len(lut) - 1)
+    return lut[index]
+
+
+def encode(bgr, fmt="png"):
+    """Encode a BGR uint8 image in memory; returns bytes."""
+    if fmt not in ENCODINGS:
+        raise ValueError(f"Unsupported image format {fmt!r}; expected one of {sorted(ENCODINGS)}")
+    ext, params = ENCODINGS[fmt]
+    ok, data = cv2.imencode(ext, bgr, params)
+    if not ok:
+        raise ValueError(f"{fmt} encoding failed")
+    return data.tobytes()
+
+
+# =========================
+# SHAP PANELS
+# =========================
+
+def shap_map(shap_values, pred_class):
+    """Collapse SHAP output for one image to a (H, W) map normalised to [0, 1].
+
+    Accepts the shapes the explainers return: a per-class list, an
+    Explanation object, or a plain array (with a trailing class axis).
+    """
+    if isinstance(shap_values, list):
+        values = np.asarray(shap_values[pred_class][0])
+    elif hasattr(shap_values, "values"):
+        values = np.asarray(shap_values.values[0])
+        if values.ndim > 3:
+            values = values[..., pred_class]
+    else:
+        values = np.asarray(shap_values[0])
+        if values.ndim > 3:
+            values = values[..., pred_class]
+
+    # Magnitude summed across colour channels.
+    if values.ndim == 3:
+        values = np.sum(np.abs(values), axis=-1)
+    values = values.astype(np.float32)
+    low, high = float(values.min()), float(values.max())
+    return (values - low) / (high - low + 1e-8)
+
+
+def render_shap_panels(rgb, saliency, title, fmt="png"):
+    """Original | SHAP map with colorbar | overlay, as one encoded image.
+
+    Args:
+        rgb: Original image, (H, W, 3) uint8 RGB.
+        saliency: SHAP map from `shap_map`, (h, w) float in [0, 1].
+        title: Middle panel title, e.g. "SHAP: Glioma".
+        fmt: "png" (default) or "webp".
+    """
+    rgb = np.asarray(rgb, dtype=np.uint8)
+    saliency = np.asarray(saliency, dtype=np.float32)
+
+    original = cv2.resize(rgb, (PANEL, PANEL), interpolation=cv2.INTER_AREA)
+    shap_panel = apply_lut(cv2.resize(saliency, (PANEL, PANEL), interpolation=cv2.INTER_NEAREST))
+
+    # Overlay at the original's resolution, as before: 0.6 image + 0.4 colour.
+    base = rgb.astype(np.float32) / 255.0
+    colored = apply_lut(cv2.resize(saliency, (rgb.shape[1], rgb.shape[0]))).astype(np.float32) / 255.0
+    overlay = np.clip(0.6 * base + 0.4 * colored, 0.0, 1.0)
+    overlay = cv2.resize((overlay * 255).astype(np.uint8), (PANEL, PANEL), interpolation=cv2.INTER_AREA)
+
+    width = MARGIN * 4 + PANEL * 3 + COLORBAR_GAP + COLORBAR_W + COLORBAR_LABELS_W
+    height = TITLE_H + PANEL + MARGIN
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)  # BGR, white
+
+    top = TITLE_H
+    x1 = MARGIN
+    x2 = x1 + PANEL + MARGIN
+    xbar = x2 + PANEL + COLORBAR_GAP
+    x3 = xbar + COLORBAR_W + COLORBAR_LABELS_W + MARGIN
+
+    for x, panel, label in (
+        (x1, original, "Original Image"),
+        (x2, shap_panel, title),
+        (x3, overlay, "SHAP Overlay"),
+    ):
+        canvas[top : top + PANEL, x : x + PANEL] = panel[..., ::-1]
+        _centered_text(canvas, label, x + PANEL // 2, top - 12)
+
+    _colorbar(canvas, xbar, top, PANEL)
+    return encode(canvas, fmt)
+
+
+def _centered_text(canvas, text, cx, baseline, scale=0.6, thickness=1):
+    (w, _), _ = cv2.getTextSize(text, FONT, scale, thickness)
+    cv2.putText(canvas, text, (int(cx - w / 2), baseline), FONT, scale, TEXT, thickness, cv2.LINE_AA)
+
+
+def _colorbar(canvas, x, top, height):
+    """Vertical RdBu_r bar (1.0 at the top) with ticks and a rotated label."""
+    ramp = apply_lut(np.linspace(1.0, 0.0, height, dtype=np.float32))[:, np.newaxis, :]
+    canvas[top : top + height, x : x + COLORBAR_W] = np.repeat(ramp, COLORBAR_W, axis=1)[..., ::-1]
+    cv2.rectangle(canvas, (x, top), (x + COLORBAR_W - 1, top + height - 1), TEXT, 1)
+
+    for tick in (0.0, 0.2, 0.4, 0.6, 0.8, 1.0):
+        y = top + int(round((1.0 - tick) * (height - 1)))
+        cv2.line(canvas, (x + COLORBAR_W, y), (x + COLORBAR_W + 4, y), TEXT, 1)
+        cv2.putText(canvas, f"{tick:.1f}", (x + COLORBAR_W + 7, y + 5), FONT, 0.42, TEXT, 1, cv2.LINE_AA)
+
+    # cv2 has no rotated text: draw horizontally on a strip, rotate it in.
+    label = "SHAP Value"
+    (w, h), base = cv2.getTextSize(label, FONT, 0.5, 1)
+    strip = np.full((h + base + 4, w + 4, 3), 255, dtype=np.uint8)
+    cv2.putText(strip, label, (2, h + 2), FONT, 0.5, TEXT, 1, cv2.LINE_AA)
+    strip = cv2.rotate(strip, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    sx = x + COLORBAR_W + COLORBAR_LABELS_W - strip.shape[1]
+    sy = top + (height - strip.shape[0]) // 2
+    canvas[sy : sy + strip.shape[0], sx : sx + strip.shape[1]] = strip
+
+
+# =========================
+# GRAD-CAM OVERLAY
+# =========================
+
+def render_gradcam(heatmap, bgr, fmt="jpg"):
+    """Blend a [0, 1] Grad-CAM heatmap (JET) over a BGR image; returns encoded bytes."""
+    heatmap = cv2.resize(np.asarray(heatmap, dtype=np.float32), (bgr.shape[1], bgr.shape[0]))
+    colored = cv2.applyColorMap(np.uint8(255 * heatmap), cv2.COLORMAP_JET)
+    overlay = cv2.addWeighted(bgr, 0.6, colored, 0.4, 0)
+    return encode(overlay, fmt)
@@ -0,0 +1,357 @@
+"""Offline bulk scoring: class probabilities for every scan in a folder or archive.
+
+Run from the backend directory:
+
+    python score_offline.py --input /data/audit --modality brain --out runs/audit.csv
+    python score_offline.py --input study.tar.gz --out runs/audit.parquet
+
+Scans are decoded exactly like the API (imaging.decode_image, with
+reduced-scale JPEG decoding unless JPEG_DRAFT_DECODE=false or --no-draft), in
+a pool of worker processes, while the parent runs large batches through the
+modality's global model. --out ending in .csv writes one CSV. Otherwise the
+output is a directory of Parquet parts (needs pyarrow). Either way, there is
+one row per scan: index, name, prediction, one p_<class> column per label
+(classes from modalities.py), error and model_version.
+
+Progress is checkpointed to <out>.checkpoint.json every --checkpoint-every
+scans. Re-running the same command resumes after the last checkpoint;
+--restart starts over. Throughput (images/sec) is printed as the run goes
+and in the final JSON summary.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from bulk import is_image_name, iter_archive
+from cache import file_digest
+from imaging import decode_image
+from modalities import MODALITIES
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_FOLDER = os.environ.get("MODEL_FOLDER") or os.path.join(BASE_DIR, "models")
+MAX_FILE_MB = 50
+
+
+# =========================
+# INPUTS
+# =========================
+
+def list_scans(source, max_bytes):
+    """Yield (name, path or bytes or error) for every scan, in a stable order.
+
+    Folders are walked recursively in sorted order and workers read the
+    files themselves. Archive members are read here, one at a time.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if is_image_name(path):
+                    yield os.path.relpath(path, source), path
+        return
+    with open(source, "rb") as f:
+        yield from iter_archive(f, max_bytes)
+
+
+def decode_batch(items, draft):
+    """Worker: decode [(name, path or bytes or error)] to (uint8 (n, H, W, 3), errors)."""
+    images = None
+    errors = []
+    for row, (_, item) in enumerate(items):
+        try:
+            if isinstance(item, Exception):
+                raise item
+            if isinstance(item, str):
+                with open(item, "rb") as f:
+                    item = f.read()
+            rgb = decode_image(item, draft=draft).rgb
+            if images is None:
+                images = np.zeros((len(items),) + rgb.shape, dtype=np.uint8)
+            images[row] = rgb
+            errors.append(None)
+        except Exception as e:
+            errors.append(f"Could not decode image: {e}")
+    return images, errors
+
+
+def chunked(iterator, size, skip=0):
+    """Lists of up to `size` (index, item) pairs, after skipping `skip` items."""
+    chunk = []
+    for index, item in enumerate(iterator):
+        if index < skip:
+            continue
+        chunk.append((index, item))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# =========================
+# OUTPUTS
+# =========================
+# Rows are only ever appended, and the checkpoint records how much output
+# belongs to the scans it counts. On resume, anything written after it is
+# dropped before appending again.
+
+class CsvOutput:
+    def __init__(self, path, columns, state=None):
+        self.path = path
+        self.columns = columns
+        if state:
+            self._file = open(path, "r+", newline="")
+            self._file.truncate(state["bytes"])
+            self._file.seek(state["bytes"])
+        else:
+            self._file = open(path, "w", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=columns)
+        if not state:
+            self._writer.writeheader()
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def checkpoint(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"bytes": self._file.tell()}
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetOutput:
+    """A directory of part-NNNNN.parquet files, one per checkpoint."""
+
+    def __init__(self, path, columns, state=None):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise SystemExit(
+                "Parquet output needs pyarrow (pip install \"pyarrow<17\" alongside numpy<2), or pass an --out ending in .csv"
+            ) from e
+        self._pa = pyarrow
+        self.path = path
+        self.columns = columns
+        self._parts = state["parts"] if state else 0
+        self._rows = []
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            # Parts past the checkpoint (or from an earlier run) are stale.
+            if name.startswith("part-") and int(name[5:10]) >= self._parts:
+                os.remove(os.path.join(path, name))
+
+    def write(self, rows):
+        self._rows.extend(rows)
+
+    def checkpoint(self):
+        if self._rows:
+            table = self._pa.table({c: [row[c] for row in self._rows] for c in self.columns})
+            part = os.path.join(self.path, f"part-{self._parts:05d}.parquet")
+            self._pa.parquet.write_table(table, part + ".tmp")
+            os.replace(part + ".tmp", part)
+            self._parts += 1
+            self._rows = []
+        return {"parts": self._parts}
+
+    def close(self):
+        pass
+
+
+def load_checkpoint(path, expected):
+    """Saved state if it belongs to the same job, None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    for key, value in expected.items():
+        if state.get(key) != value:
+            raise SystemExit(
+                f"{path} was written for {key}={state.get(key)!r}, not {value!r}; pass --restart to start over"
+            )
+    return state
+
+
+def save_checkpoint(path, state):
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# =========================
+# SCORING
+# =========================
+
+def load_engine(model_path, batch_size):
+    """Serving's compiled predict path (explain.GradCamEngine), warmed for `batch_size`."""
+    os.environ["KERAS_BACKEND"] = "tensorflow"
+    try:
+        import keras
+    except ImportError:
+        from tensorflow import keras
+    from explain import GradCamEngine
+
+    engine = GradCamEngine(keras.models.load_model(model_path, compile=False))
+    engine.warmup(batch_sizes=[batch_size])
+    return engine
+
+
+def score(args):
+    filename, classes = MODALITIES[args.modality]
+    model_path = args.model or os.path.join(MODEL_FOLDER, filename)
+    version = file_digest(model_path)[:12]
+    checkpoint_path = args.out.rstrip("/") + ".checkpoint.json"
+    job = {"input": os.path.abspath(args.input), "modality": args.modality, "model_version": version}
+    state = None if args.restart else load_checkpoint(checkpoint_path, job)
+    if state and state.get("finished"):
+        print(f"✅ {args.out} is already complete ({state['done']} scans); pass --restart to score again")
+        return state
+
+    started = time.perf_counter()
+    engine = load_engine(model_path, args.batch_size)
+    outputs = engine.model.output_shape[-1]
+    labels = classes[: max(outputs, 2)]
+    columns = ["index", "name", "prediction"] + [f"p_{label.lower().replace(' ', '_')}" for label in labels]
+    columns += ["error", "model_version"]
+    output_state = state["output"] if state else None
+    if args.out.endswith(".csv"):
+        output = CsvOutput(args.out, columns, output_state)
+    else:
+        output = ParquetOutput(args.out, columns, output_state)
+    print(f"🧠 {args.modality} model {version} ready in {time.perf_counter() - started:.1f}s")
+
+    done = state["done"] if state else 0
+    errors = state["errors"] if state else 0
+    resumed_from = done
+    if done:
+        print(f"🔄 Resuming after {done} scans")
+
+    ctx = multiprocessing.get_context("spawn")  # workers never import TensorFlow
+    pool = ctx.Pool(args.workers) if args.workers > 0 else None
+    pending = deque()
+    since_checkpoint = 0
+    decode_wait = inference = 0.0
+    run_started = last_report = time.perf_counter()
+
+    def finish(batch, result):
+        nonlocal done, errors, since_checkpoint, decode_wait, inference
+        waited = time.perf_counter()
+        images, batch_errors = result.get() if pool is not None else result
+        now = time.perf_counter()
+        decode_wait += now - waited
+        ok = [row for row, error in enumerate(batch_errors) if error is None]
+        preds = None
+        if ok:
+            tensor = images[ok].astype(np.float32)
+            tensor /= 255.0
+            preds = np.asarray(engine.predict(tensor), dtype=np.float64)
+            if preds.shape[-1] == 1:
+                preds = np.hstack([1 - preds, preds])
+        inference += time.perf_counter() - now
+
+        rows = []
+        scored = iter(preds if preds is not None else ())
+        for (index, (name, _)), error in zip(batch, batch_errors):
+            row = dict.fromkeys(columns)
+            row.update(index=index, name=name, error=error, model_version=version)
+            if error is None:
+                probs = next(scored)
+                row["prediction"] = labels[int(np.argmax(probs))]
+                row.update(zip(columns[3 : 3 + len(labels)], (round(float(p), 6) for p in probs)))
+            rows.append(row)
+        output.write(rows)
+        done += len(batch)
+        errors += len(batch) - len(ok)
+        since_checkpoint += len(batch)
+        if since_checkpoint >= args.checkpoint_every:
+            commit()
+
+    def commit(finished=False):
+        nonlocal since_checkpoint
+        save_checkpoint(
+            checkpoint_path,
+            {**job, "done": done, "errors": errors, "output": output.checkpoint(), "finished": finished},
+        )
+        since_checkpoint = 0
+
+    def report():
+        elapsed = time.perf_counter() - run_started
+        rate = (done - resumed_from) / elapsed if elapsed > 0 else 0.0
+        print(f"📊 {done} scans ({errors} errors), {rate:.1f} images/s")
+
+    max_bytes = int(MAX_FILE_MB * 1024 * 1024)
+    try:
+        for batch in chunked(list_scans(args.input, max_bytes), args.batch_size, skip=done):
+            items = [item for _, item in batch]
+            if pool is not None:
+                pending.append((batch, pool.apply_async(decode_batch, (items, args.draft))))
+            else:
+                pending.append((batch, decode_batch(items, args.draft)))
+            # Bounded read-ahead: decoded batches waiting for the model cost memory.
+            while len(pending) > max(args.workers, 1) + args.prefetch:
+                finish(*pending.popleft())
+            if time.perf_counter() - last_report >= args.report_every:
+                report()
+                last_report = time.perf_counter()
+        while pending:
+            finish(*pending.popleft())
+        commit(finished=True)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        output.close()
+
+    elapsed = time.perf_counter() - run_started
+    report()
+    scored = done - resumed_from
+    summary = {
+        **job,
+        "output": args.out,
+        "scans": done,
+        "errors": errors,
+        "scored_this_run": scored,
+        "resumed_from": resumed_from,
+        "seconds": round(elapsed, 2),
+        "images_per_sec": round(scored / elapsed, 1) if elapsed > 0 else None,
+        "decode_wait_s": round(decode_wait, 2),
+        "inference_s": round(inference, 2),
+        "workers": args.workers,
+        "batch_size": args.batch_size,
+    }
+    print(json.dumps(summary))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", required=True, help="Folder of scans (searched recursively) or a zip/tar archive")
+    parser.add_argument("--out", required=True, help="Output .csv file, or a directory for Parquet parts")
+    parser.add_argument("--modality", default="brain", choices=sorted(MODALITIES))
+    parser.add_argument("--model", help="Model file (default: the modality's global model)")
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Decode processes; 0 decodes in the main process")
+    parser.add_argument("--prefetch", type=int, default=2, help="Decoded batches kept ready beyond one per worker")
+    parser.add_argument("--checkpoint-every", type=int, default=4096, help="Scans between checkpoints")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    parser.add_argument(
+        "--draft", action=argparse.BooleanOptionalAction,
+        default=os.environ.get("JPEG_DRAFT_DECODE", "true").lower() == "true",
+        help="Reduced-scale JPEG decoding, as the API does (default: JPEG_DRAFT_DECODE, true)",
+    )
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    args = parser.parse_args()
+    score(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import random
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+import tensorflow as tf
+
+
+# =========================
+# SHADOW EVALUATION
+# =========================
+# Candidate global models, e.g. the output of the next federated round, score
+# a sample of live traffic next to the production model before anyone
+# promotes them. A modality's candidates are compiled into one stacked
+# forward pass. A background thread runs that pass over the same
+# preprocessed batch production has just answered, then compares the results
+# row by row. Clients only ever get the production result. The shadow pass
+# takes the model lock only when no serving call holds or wants it, in chunks
+# sized from the measured per-row cost, so a serving call that arrives
+# meanwhile waits at most `max_delay_ms`.
+
+class ShadowCandidates:
+    """Candidate models of one modality, evaluated as one stacked forward pass.
+
+    Args:
+        models: version -> Keras model; every model takes the same input
+            shape and returns the same number of outputs.
+        input_shape: (H, W, C) of the preprocessed inputs.
+    """
+
+    def __init__(self, models, input_shape):
+        self.versions = list(models)
+        self._models = [models[version] for version in self.versions]
+        signature = [tf.TensorSpec((None,) + tuple(input_shape), tf.float32)]
+        self._forward = tf.function(self._stacked, input_signature=signature)
+
+    def _stacked(self, x):
+        return tf.stack([model(x, training=False) for model in self._models])
+
+    def __call__(self, batch):
+        """(candidates, n, outputs) for a (n, H, W, C) batch."""
+        return self._forward(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()
+
+
+class _Comparison:
+    """Running agreement between one candidate and production."""
+
+    def __init__(self, against):
+        self.against = against  # production version the rows came from
+        self.rows = 0
+        self.agree = 0
+        self.confidence_delta = 0.0
+        self.abs_drift = 0.0
+        self.max_drift = 0.0
+        self.flips = Counter()  # "production->candidate" top-1 classes
+
+    def add(self, production, candidate):
+        prod_top = np.argmax(production, axis=1)
+        cand_top = np.argmax(candidate, axis=1)
+        drift = np.max(np.abs(candidate - production), axis=1)
+        self.rows += len(production)
+        self.agree += int(np.sum(prod_top == cand_top))
+        self.confidence_delta += float(np.sum(np.max(candidate, axis=1) - np.max(production, axis=1)))
+        self.abs_drift += float(np.sum(drift))
+        self.max_drift = max(self.max_drift, float(np.max(drift)))
+        for p, c in zip(prod_top[prod_top != cand_top], cand_top[prod_top != cand_top]):
+            self.flips[f"{p}->{c}"] += 1
+
+    def stats(self):
+        rows = max(self.rows, 1)
+        return {
+            "against": self.against,
+            "rows": self.rows,
+            "agreement": round(self.agree / rows, 4) if self.rows else None,
+            "mean_confidence_delta": round(self.confidence_delta / rows, 4) if self.rows else None,
+            "mean_abs_drift": round(self.abs_drift / rows, 4) if self.rows else None,
+            "max_drift": round(self.max_drift, 4),
+            "flips": dict(self.flips.most_common(10)),
+        }
+
+
+class ShadowEvaluator:
+    """Mirrors sampled production batches of one modality through its candidates.
+
+    `observe` is called after each production forward pass; it copies the
+    batch onto a bounded queue and returns. A single thread drains the queue.
+
+    Args:
+        name: Modality, for logs and stats.
+        lock: executor.ModelLock held around every model call.
+        max_delay_ms: Longest a production call may wait behind one shadow chunk.
+        sample_rate: Fraction of production batches mirrored.
+        max_backlog: Batches waiting for the shadow thread; more are dropped.
+    """
+
+    def __init__(self, name, lock, max_delay_ms=20.0, sample_rate=1.0, max_backlog=8):
+        self.name = name
+        self.lock = lock
+        self.max_delay_s = max_delay_ms / 1000.0
+        self.sample_rate = sample_rate
+        self.max_backlog = max_backlog
+
+        self._models = {}  # version -> (model, path)
+        self._candidates = None
+        self._comparisons = {}  # version -> _Comparison
+        self._row_s = None  # seconds per row through all candidates
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self._stats_lock = threading.Lock()
+        self._chunk_ms = deque(maxlen=2048)
+        self._sampled = 0
+        self._dropped = 0
+        self._skipped = 0
+        self._overruns = 0
+        self._errors = 0
+
+    # ---- candidates ----
+    def add(self, version, model, path=None):
+        """Start shadowing `model`; its cost is measured before it sees traffic."""
+        input_shape = tuple(model.input_shape[1:])
+        with self._cond:
+            models = {v: m for v, (m, _) in self._models.items() if v != version}
+        for other in models.values():
+            if tuple(other.input_shape[1:]) != input_shape or other.output_shape[-1] != model.output_shape[-1]:
+                raise ValueError(f"{version} does not match the shapes of the other {self.name} candidates")
+        models[version] = model
+        candidates = ShadowCandidates(models, input_shape)
+
+        sample = np.zeros((1,) + input_shape, dtype=np.float32)
+        with self.lock.idle():
+            candidates(sample)  # trace
+            started = time.perf_counter()
+            candidates(sample)
+            row_s = time.perf_counter() - started
+
+        with self._cond:
+            self._models[version] = (model, path)
+            self._candidates = candidates
+            self._comparisons.pop(version, None)
+            # A one-row pass overstates the per-row cost; batches refine it.
+            self._row_s = row_s if self._row_s is None else max(self._row_s, row_s)
+        if row_s > self.max_delay_s:
+            print(
+                f"⚠️ Shadow {self.name}: one row through {len(models)} candidate(s) takes "
+                f"{row_s * 1000:.1f} ms, over the {self.max_delay_s * 1000:g} ms limit; batches will be skipped"
+            )
+        self.start()
+        print(f"👥 Shadowing {self.name} candidate {version} ({row_s * 1000:.1f} ms per row)")
+        return version
+
+    def remove(self, version):
+        with self._cond:
+            if version not in self._models:
+                return False
+            del self._models[version]
+            self._comparisons.pop(version, None)
+            models = {v: m for v, (m, _) in self._models.items()}
+            if models:
+                input_shape = tuple(next(iter(models.values())).input_shape[1:])
+                self._candidates = ShadowCandidates(models, input_shape)
+            else:
+                self._candidates = None
+                self._row_s = None
+                self._queue.clear()
+        print(f"👥 Stopped shadowing {self.name} candidate {version}")
+        return True
+
+    def versions(self):
+        with self._cond:
+            return list(self._models)
+
+    # ---- traffic ----
+    def observe(self, batch, preds, production_version):
+        """Queue a production batch and its outputs for the candidates (never blocks)."""
+        if self._candidates is None:
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        # Copied: callers may reuse their buffers (the shared-memory ring does).
+        item = (np.array(batch, dtype=np.float32), np.array(preds, dtype=np.float64), production_version)
+        with self._cond:
+            if len(self._queue) >= self.max_backlog:
+                with self._stats_lock:
+                    self._dropped += 1
+                return
+            self._queue.append(item)
+            self._cond.notify()
+
+    # ---- lifecycle ----
+    def start(self):
+        with self._cond:
+            if self._running:
+                return self
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"shadow-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._running = False
+            self._queue.clear()
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        with self._cond:
+            comparisons = {v: c.stats() for v, c in self._comparisons.items()}
+            candidates = {
+                version: {"path": path, **comparisons.get(version, {"rows": 0})}
+                for version, (_, path) in self._models.items()
+            }
+            row_s = self._row_s
+            backlog = len(self._queue)
+        with self._stats_lock:
+            chunk_ms = np.array(self._chunk_ms) if self._chunk_ms else None
+            return {
+                "candidates": candidates,
+                "sample_rate": self.sample_rate,
+                "max_delay_ms": self.max_delay_s * 1000,
+                "row_ms": round(row_s * 1000, 2) if row_s is not None else None,
+                "backlog": backlog,
+                "sampled_batches": self._sampled,
+                "dropped_batches": self._dropped,
+                "skipped_batches": self._skipped,
+                "chunks": len(self._chunk_ms),
+                "chunk_ms_p50": round(float(np.percentile(chunk_ms, 50)), 2) if chunk_ms is not None else None,
+                "chunk_ms_max": round(float(np.max(chunk_ms)), 2) if chunk_ms is not None else None,
+                "overruns": self._overruns,
+                "errors": self._errors,
+                # Shared by every modality's evaluator.
+                **self.lock.stats(),
+            }
+
+    # ---- internals ----
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                batch, preds, production_version = self._queue.popleft()
+                candidates = self._candidates
+            if candidates is None:
+                continue
+            with self._stats_lock:
+                self._sampled += 1
+            try:
+                self._evaluate(candidates, batch, _as_probs(preds), production_version)
+            except Exception as e:
+                with self._stats_lock:
+                    self._errors += 1
+                print(f"⚠️ Shadow {self.name} evaluation failed: {e}")
+
+    def _evaluate(self, candidates, batch, production, production_version):
+        start = 0
+        while start < len(batch):
+            rows = min(len(batch) - start, int(self.max_delay_s / self._row_s) if self._row_s else 1)
+            if rows < 1:
+                with self._stats_lock:
+                    self._skipped += 1
+                return
+            chunk = batch[start : start + rows]
+            with self.lock.idle():
+                started = time.perf_counter()
+                outputs = candidates(chunk)
+                elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self._chunk_ms.append(elapsed * 1000)
+                self._overruns += elapsed > self.max_delay_s
+            with self._cond:
+                if self._candidates is not candidates:
+                    return  # the candidate set changed under us
+                # Follows the real cost, which rises under contention.
+                self._row_s = 0.8 * self._row_s + 0.2 * (elapsed / rows) if self._row_s else elapsed / rows
+                for version, output in zip(candidates.versions, outputs):
+                    comparison = self._comparisons.get(version)
+                    if comparison is None or comparison.against != production_version:
+                        # Production moved on: compare against the new version afresh.
+                        comparison = self._comparisons[version] = _Comparison(production_version)
+                    comparison.add(production[start : start + rows], _as_probs(output))
+            start += rows
+
+
+def _as_probs(preds):
+    """Single-output (sigmoid) models as two columns, like the SHAP service."""
+    preds = np.asarray(preds, dtype=np.float64)
+    if preds.shape[-1] == 1:
+        return np.hstack([1 - preds, preds])
+    return preds
@@ -0,0 +1,965 @@
+"""Multi-process serving: HTTP workers feed inference processes through shared memory.
+
+Run from the backend directory:
+
+    python shm_serving.py --workers 4 --inference-procs 1 --port 5000
+
+Each HTTP worker is a full uvicorn process running main:app (upload parsing,
+decoding, rendering and JSON on its own core and GIL), but it never loads a
+model. Decoded 224x224 tensors are copied once into a slot of a shared-memory
+ring; only the slot number travels through a pipe. The inference process(es)
+own the models: requests from every worker land in the same micro-batchers,
+and predictions and Grad-CAM heatmaps are written back into the slot.
+
+Each HTTP request leases one model version in one inference process (taken in
+turn), and every model call it makes carries that version in its slot header,
+so a request never mixes versions, even while a reload is rolling out.
+"""
+import argparse
+import itertools
+import json
+import math
+import multiprocessing as mp
+import os
+import signal
+import sys
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from executor import PoolSaturated
+
+
+# =========================
+# SHARED-MEMORY RING
+# =========================
+# One SharedMemory block holds, per slot, a small int64 header, room for
+# `rows` input tensors and `rows * out_floats` output floats, plus a table of
+# the live model version per inference process and modality. HTTP worker w
+# owns slots [w * slots_per_worker, (w + 1) * slots_per_worker), so slots are
+# never contended between processes. A data request's header names the model
+# version it must run on.
+
+HEADER_FIELDS = ("op", "model", "rows", "status", "out_cols", "heat_h", "heat_w", "nbytes", "arg", "version")
+H = {name: i for i, name in enumerate(HEADER_FIELDS)}
+META_FIELDS = ("version", "gradcam")
+M = {name: i for i, name in enumerate(META_FIELDS)}
+MAX_MODELS = 8
+
+OP_FORWARD = 0  # predictions + Grad-CAM (the model's Grad-CAM micro-batcher)
+OP_PREDICT = 1  # Keras predictions, unbatched
+OP_PREDICT_FAST = 2  # predictions through the fast-scan micro-batcher
+OP_CONTROL = 3  # JSON command in, JSON result out (stats, model loads)
+OP_EXPLAIN = 4  # predictions + per-class heatmaps; arg = explain_arg(top_k, method)
+OP_SHAP = 5  # SHAP's masked samples through the model's SHAP micro-batcher
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        # Older Pythons register the block again, but children started by
+        # serve() share the parent's resource tracker, where the name is
+        # already registered; the owner's unlink is what unregisters it.
+        return shared_memory.SharedMemory(name=name)
+
+
+class TensorRing:
+    """Slots of float32 model inputs and outputs in one shared-memory block.
+
+    Created by the supervisor (name=None) and attached by name everywhere else.
+
+    Args:
+        slots: Total number of slots.
+        rows: Input tensors per slot; larger batches span several slots.
+        input_shape: (H, W, C) of one model input.
+        out_floats: Output floats per row (predictions + heatmap).
+        procs: Number of inference processes (rows of the version table).
+        name: Existing block to attach to.
+    """
+
+    def __init__(self, slots, rows, input_shape, out_floats=4096, procs=1, name=None):
+        self.slots = int(slots)
+        self.rows = int(rows)
+        self.input_shape = tuple(int(d) for d in input_shape)
+        self.out_floats = int(out_floats)
+        self.procs = int(procs)
+
+        header_bytes = self.slots * len(HEADER_FIELDS) * 8
+        meta_bytes = self.procs * MAX_MODELS * len(META_FIELDS) * 8
+        self.input_floats = self.rows * math.prod(self.input_shape)
+        input_bytes = self.slots * self.input_floats * 4
+        output_bytes = self.slots * self.rows * self.out_floats * 4
+        size = header_bytes + meta_bytes + input_bytes + output_bytes
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = _attach(name)
+            self.owner = False
+
+        buf = self.shm.buf
+        offset = 0
+        self.header = np.ndarray((self.slots, len(HEADER_FIELDS)), np.int64, buf, offset)
+        offset += header_bytes
+        self.meta = np.ndarray((self.procs, MAX_MODELS, len(META_FIELDS)), np.int64, buf, offset)
+        offset += meta_bytes
+        self.inputs = np.ndarray((self.slots, self.rows, *self.input_shape), np.float32, buf, offset)
+        self.payloads = np.ndarray((self.slots, self.input_floats * 4), np.uint8, buf, offset)
+        offset += input_bytes
+        self.outputs = np.ndarray((self.slots, self.rows * self.out_floats), np.float32, buf, offset)
+        if self.owner:
+            self.header[:] = 0
+            self.meta[:] = 0
+
+    @property
+    def nbytes(self):
+        return self.shm.size
+
+    def spec(self):
+        """Picklable description for attaching from another process."""
+        return {
+            "slots": self.slots,
+            "rows": self.rows,
+            "input_shape": self.input_shape,
+            "out_floats": self.out_floats,
+            "procs": self.procs,
+            "name": self.shm.name,
+        }
+
+    @classmethod
+    def attach(cls, spec):
+        return cls(**spec)
+
+    def write_bytes(self, slot, data):
+        """Put a byte payload (control JSON, error text) in a slot's input area."""
+        data = data[: self.payloads.shape[1]]
+        self.payloads[slot, : len(data)] = np.frombuffer(data, dtype=np.uint8)
+        self.header[slot, H["nbytes"]] = len(data)
+
+    def read_bytes(self, slot):
+        return self.payloads[slot, : self.header[slot, H["nbytes"]]].tobytes()
+
+    def close(self):
+        self.header = self.meta = self.inputs = self.payloads = self.outputs = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def explain_arg(top_k, method):
+    """Pack explain_classes arguments into a header field (top_k 0 = all classes)."""
+    return (top_k or 0) * 2 + (method == "gradcam++")
+
+
+def _explain_args(arg):
+    top_k, plus_plus = divmod(int(arg), 2)
+    return top_k or None, "gradcam++" if plus_plus else "gradcam"
+
+
+def _version_int(version):
+    return int(version, 16) if version else 0
+
+
+def _version_str(value):
+    return f"{int(value):012x}" if value else None
+
+
+# =========================
+# INFERENCE PROCESS
+# =========================
+
+class InferenceServer:
+    """Answers ring requests from a ModelPool in an inference process.
+
+    Each inference process has its own request queue. An HTTP request first
+    leases a model version here (the "lease" command); its model calls then
+    come to this process with that version in the slot header and run on
+    exactly it, whether or not it is still the live one. Results are written
+    into the request's slot and the slot number is sent back to the worker
+    that owns it.
+
+    Args:
+        ring: Attached TensorRing.
+        index: This process's row in the ring's version table.
+        model_pool: ModelPool of ModelRuntime objects (see main.py).
+        names: Modality names; a request's model field indexes this list.
+        slots_per_worker: Slots owned by each HTTP worker.
+        requests: Queue of this process's slot numbers (data and control).
+        responses: One queue per HTTP worker for finished slot numbers.
+        commands: Extra control commands, name -> callable taking the
+            command's JSON arguments (e.g. main.py's shadow-model commands).
+    """
+
+    def __init__(self, ring, index, model_pool, names, slots_per_worker, requests, responses, threads=4,
+                 commands=None):
+        self.ring = ring
+        self.index = index
+        self.model_pool = model_pool
+        self.names = list(names)
+        self.slots_per_worker = slots_per_worker
+        self.requests = requests
+        self.responses = responses
+        self.commands = dict(commands or {})
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix=f"inference-{index}")
+        self._stop = threading.Event()
+        self._leases = {}  # token -> Lease held for an HTTP request
+        self._tokens = itertools.count(1)
+        self._leases_lock = threading.Lock()
+
+    def serve_forever(self):
+        threading.Thread(target=self._publish_versions, daemon=True).start()
+        while True:
+            slot = self.requests.get()
+            if slot is None:
+                break
+            try:
+                self._dispatch(slot)
+            except Exception as e:
+                self._fail(slot, e)
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._leases_lock:
+            leases, self._leases = list(self._leases.values()), {}
+        for lease in leases:
+            lease.release()
+
+    # ---- data requests ----
+    def _dispatch(self, slot):
+        header = self.ring.header[slot]
+        op = int(header[H["op"]])
+        if op == OP_CONTROL:
+            self._executor.submit(self._control, slot)
+            return
+        name, rows = self.names[int(header[H["model"]])], int(header[H["rows"]])
+        version = _version_str(header[H["version"]])
+        batch = self.ring.inputs[slot, :rows]  # a view: the slot stays ours until we answer
+        # The caller's lease keeps this version loaded, even once it is swapped out.
+        lease = self.model_pool.get(name).lease(version)
+        if lease.runtime is None:
+            raise RuntimeError(f"{name} model version {version} is not loaded in inference process {self.index}")
+        self._run(slot, op, lease, batch)
+
+    def _run(self, slot, op, lease, batch):
+        runtime = lease.runtime
+        try:
+            if op == OP_FORWARD:
+                future = runtime.batcher.submit(batch)
+            elif op == OP_PREDICT_FAST:
+                future = runtime.predict_batcher.submit(batch)
+            elif op == OP_PREDICT:
+                future = self._executor.submit(runtime.predict, batch)
+            elif op == OP_SHAP:
+                # Slots from every worker meet here, so a SHAP step spread
+                # over many slots is still one forward pass.
+                future = runtime.shap_service.submit(batch)
+            elif op == OP_EXPLAIN:
+                top_k, method = _explain_args(self.ring.header[slot, H["arg"]])
+                future = self._executor.submit(runtime.explain_classes, batch, top_k, method)
+            else:
+                raise ValueError(f"Unknown op {op}")
+        except Exception:
+            lease.release()
+            raise
+        future.add_done_callback(lambda f: self._finish(slot, lease, f))
+
+    def _finish(self, slot, lease, future):
+        lease.release()
+        try:
+            result = future.result()
+            class_idx = None
+            if isinstance(result, (tuple, list)) and len(result) == 3:
+                preds, class_idx, heatmaps = result
+            elif isinstance(result, (tuple, list)):
+                preds, heatmaps = result
+            else:
+                preds, heatmaps = result, None
+            self._write_outputs(slot, preds, heatmaps, class_idx)
+        except Exception as e:
+            self._fail(slot, e)
+            return
+        self._respond(slot)
+
+    def _write_outputs(self, slot, preds, heatmaps, class_idx=None):
+        """Slot layout: preds, then class indices (OP_EXPLAIN only), then heatmaps."""
+        header = self.ring.header[slot]
+        rows = int(header[H["rows"]])
+        preds = np.asarray(preds, dtype=np.float32).reshape(rows, -1)
+        heat_h = heat_w = 0
+        if heatmaps is not None:
+            heatmaps = np.asarray(heatmaps, dtype=np.float32)
+            heat_h, heat_w = heatmaps.shape[-2:]
+        extra = np.zeros(0, dtype=np.float32)
+        if class_idx is not None:
+            extra = np.asarray(class_idx, dtype=np.float32).ravel()
+            header[H["arg"]] = extra.size // rows  # classes per row, for the reader
+        needed = preds.size + extra.size + (heatmaps.size if heatmaps is not None else 0)
+        out = self.ring.outputs[slot]
+        if needed > len(out):
+            raise ValueError(f"Outputs ({needed} floats) do not fit a slot ({len(out)}); raise --out-floats")
+        out[: preds.size] = preds.ravel()
+        out[preds.size : preds.size + extra.size] = extra
+        if heatmaps is not None:
+            out[preds.size + extra.size : needed] = heatmaps.reshape(-1)
+        header[H["out_cols"]] = preds.shape[1]
+        header[H["heat_h"]] = heat_h
+        header[H["heat_w"]] = heat_w
+        header[H["status"]] = 0
+
+    # ---- control requests ----
+    def _control(self, slot):
+        try:
+            command = json.loads(self.ring.read_bytes(slot))
+            result = self._command(command.pop("cmd"), **command)
+            self.ring.write_bytes(slot, json.dumps(result, default=str).encode("utf-8"))
+            self.ring.header[slot, H["status"]] = 0
+        except Exception as e:
+            self._fail(slot, e)
+            return
+        self._respond(slot)
+
+    def _command(self, cmd, **args):
+        if cmd in self.commands:
+            return self.commands[cmd](**args)
+        return self._pool_command(cmd, **args)
+
+    def _pool_command(self, cmd, name=None, path=None, load=True, token=None):
+        pool = self.model_pool
+        if cmd == "lease":
+            lease = pool.acquire(name, load=load)
+            runtime = lease.runtime
+            if runtime is None:
+                return None
+            with self._leases_lock:
+                token = next(self._tokens)
+                self._leases[token] = lease
+            return {"token": token, "version": runtime.version, "gradcam": runtime.engine.layer_name is not None}
+        if cmd == "release":
+            with self._leases_lock:
+                lease = self._leases.pop(token, None)
+            if lease is not None:
+                lease.release()
+            return None
+        if cmd == "stats":
+            return pool.stats()
+        if cmd == "runtime_stats":
+            return {
+                name: {
+                    "gradcam": runtime.batcher.stats(),
+                    "predict": runtime.predict_batcher.stats(),
+                    "inference": runtime.describe_backend(),
+                }
+                for name, runtime in pool.resident().items()
+            }
+        if cmd == "load":
+            version = pool.load(name, path)
+            self.publish_versions()  # visible to the caller as soon as this returns
+            return version
+        if cmd == "reload":
+            pool.reload(name, path)
+            return None
+        raise ValueError(f"Unknown command {cmd!r}")
+
+    # ---- replies ----
+    def _fail(self, slot, exc):
+        self.ring.write_bytes(slot, f"{type(exc).__name__}: {exc}".encode("utf-8"))
+        self.ring.header[slot, H["status"]] = 1
+        self._respond(slot)
+
+    def _respond(self, slot):
+        self.responses[slot // self.slots_per_worker].put(slot)
+
+    def publish_versions(self):
+        """Mirror each modality's live version into the ring for the HTTP workers."""
+        for i, name in enumerate(self.names[:MAX_MODELS]):
+            runtime = self.model_pool.get(name).current()
+            row = self.ring.meta[self.index, i]
+            if runtime is None:
+                row[M["version"]] = 0
+                continue
+            row[M["gradcam"]] = int(runtime.engine.layer_name is not None)
+            row[M["version"]] = _version_int(runtime.version)
+
+    def _publish_versions(self):
+        # Hot swaps and evictions happen on their own threads; poll for them.
+        while not self._stop.wait(0.2):
+            self.publish_versions()
+
+
+# =========================
+# HTTP WORKER CLIENT
+# =========================
+
+class InferenceClient:
+    """Sends model calls from an HTTP worker through its slots of the ring.
+
+    `submit` never blocks: when all of this worker's slots are in flight the
+    request waits in a local backlog (up to `max_backlog`, then
+    PoolSaturated) and is sent as soon as a slot comes back. A receiver
+    thread copies results out of the ring and resolves the futures.
+
+    Args:
+        spec: TensorRing.spec() of the supervisor's ring.
+        worker: Index of this HTTP worker.
+        slots_per_worker: Slots owned by each worker.
+        requests: One request queue per inference process.
+        responses: This worker's response queue.
+        max_backlog: Requests allowed to wait for a slot.
+    """
+
+    def __init__(self, spec, worker, slots_per_worker, requests, responses, max_backlog=256):
+        self.ring = TensorRing.attach(spec)
+        self.worker = worker
+        self.requests = requests
+        self.responses = responses
+        self.max_backlog = max_backlog
+
+        first = worker * slots_per_worker
+        self._free = list(range(first, first + slots_per_worker))
+        self._pending = {}  # slot -> (future, op)
+        self._backlog = deque()
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._receiver = threading.Thread(target=self._receive, name="inference-client", daemon=True)
+        self._receiver.start()
+
+    @property
+    def procs(self):
+        return self.ring.procs
+
+    def submit(self, model, op, batch, arg=0, proc=0, version=None):
+        """Queue `batch` (n <= ring.rows rows) for `op`; returns a Future.
+
+        FORWARD resolves to (preds, heatmaps or None), EXPLAIN to (preds,
+        class indices, heatmaps) and the others to preds. `arg` is the op's
+        header argument (see explain_arg). The call runs in inference process
+        `proc` on model `version`, which must be loaded there (leased).
+        """
+        batch = np.asarray(batch, dtype=np.float32)
+        if len(batch) > self.ring.rows:
+            raise ValueError(f"{len(batch)} rows do not fit a slot of {self.ring.rows}; use run()")
+        if batch.shape[1:] != self.ring.input_shape:
+            raise ValueError(f"Input shape {batch.shape[1:]} does not match the ring's {self.ring.input_shape}")
+        return self._enqueue(("data", proc, model, op, batch, arg, version))
+
+    def run(self, model, op, batch, arg=0, proc=0, version=None):
+        """Blocking call for any number of rows, split across slots."""
+        batch = np.asarray(batch, dtype=np.float32)
+        # Several heatmaps per row only fit a slot's outputs one row at a time.
+        rows = 1 if op == OP_EXPLAIN else self.ring.rows
+        futures = [
+            self.submit(model, op, batch[start : start + rows], arg, proc, version)
+            for start in range(0, len(batch), rows)
+        ]
+        parts = [f.result() for f in futures]
+        if op == OP_EXPLAIN:
+            return tuple(np.concatenate(column, axis=0) for column in zip(*parts))
+        if op != OP_FORWARD:
+            return np.concatenate(parts, axis=0)
+        preds = np.concatenate([p for p, _ in parts], axis=0)
+        heatmaps = None if parts[0][1] is None else np.concatenate([h for _, h in parts], axis=0)
+        return preds, heatmaps
+
+    def control(self, cmd, proc=0, **args):
+        """Run a control command on inference process `proc`; returns its JSON result."""
+        return self._enqueue(("control", proc, {"cmd": cmd, **args})).result()
+
+    def notify(self, cmd, proc=0, **args):
+        """Send a control command without waiting for it; never refused for backlog."""
+        self._enqueue(("control", proc, {"cmd": cmd, **args}), limit=False)
+
+    def broadcast(self, cmd, **args):
+        """Run a control command on every inference process; returns the results."""
+        futures = [self._enqueue(("control", proc, {"cmd": cmd, **args})) for proc in range(self.procs)]
+        return [f.result() for f in futures]
+
+    def live(self, model, proc=0):
+        """(version, has Grad-CAM) of a modality as published by inference process `proc`."""
+        row = self.ring.meta[proc, model]
+        return _version_str(row[M["version"]]), bool(row[M["gradcam"]])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "worker": self.worker,
+                "inference_processes": self.procs,
+                "slots": len(self._free) + len(self._pending),
+                "in_flight": len(self._pending),
+                "backlog": len(self._backlog),
+                "sent": self._sent,
+                "ring_bytes": self.ring.nbytes,
+            }
+
+    # ---- internals ----
+    def _enqueue(self, request, limit=True):
+        future = Future()
+        with self._lock:
+            if not self._free:
+                if limit and len(self._backlog) >= self.max_backlog:
+                    raise PoolSaturated("inference", 1)
+                self._backlog.append((future, request))
+                return future
+            slot = self._free.pop()
+            self._pending[slot] = (future, request)
+        self._send(slot, request)
+        return future
+
+    def _send(self, slot, request):
+        header = self.ring.header[slot]
+        kind, proc = request[:2]
+        try:
+            if kind == "control":
+                command = request[2]
+                self.ring.write_bytes(slot, json.dumps(command).encode("utf-8"))
+                header[H["op"]] = OP_CONTROL
+                header[H["rows"]] = 0
+            else:
+                _, _, model, op, batch, arg, version = request
+                self.ring.inputs[slot, : len(batch)] = batch  # the only copy of the tensor
+                header[H["op"]] = op
+                header[H["model"]] = model
+                header[H["rows"]] = len(batch)
+                header[H["arg"]] = arg
+                header[H["version"]] = _version_int(version)
+            header[H["status"]] = 0
+            self.requests[proc].put(slot)
+        except Exception as e:
+            self._complete(slot, error=e)
+            return
+        with self._lock:
+            self._sent += 1
+
+    def _receive(self):
+        while True:
+            slot = self.responses.get()
+            if slot is None:
+                return
+            self._complete(slot)
+
+    def _complete(self, slot, error=None):
+        header = self.ring.header[slot]
+        with self._lock:
+            future, request = self._pending.pop(slot)
+        try:
+            if error is not None:
+                raise error
+            if header[H["status"]] != 0:
+                raise RuntimeError(self.ring.read_bytes(slot).decode("utf-8", "replace"))
+            if request[0] == "control":
+                result = json.loads(self.ring.read_bytes(slot))
+            else:
+                result = self._read_outputs(slot, request[3])
+        except Exception as e:
+            result, error = None, e
+        self._release(slot)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _read_outputs(self, slot, op):
+        header = self.ring.header[slot]
+        rows, cols = int(header[H["rows"]]), int(header[H["out_cols"]])
+        heat_h, heat_w = int(header[H["heat_h"]]), int(header[H["heat_w"]])
+        out = self.ring.outputs[slot]
+        preds = out[: rows * cols].reshape(rows, cols).copy()
+        if op == OP_EXPLAIN:
+            k = int(header[H["arg"]])
+            start = rows * cols + rows * k
+            class_idx = out[rows * cols : start].reshape(rows, k).astype(np.int64)
+            heatmaps = out[start : start + rows * k * heat_h * heat_w].reshape(rows, k, heat_h, heat_w).copy()
+            return preds, class_idx, heatmaps
+        if op != OP_FORWARD:
+            return preds
+        heatmaps = None
+        if heat_h:
+            end = rows * cols + rows * heat_h * heat_w
+            heatmaps = out[rows * cols : end].reshape(rows, heat_h, heat_w).copy()
+        return preds, heatmaps
+
+    def _release(self, slot):
+        with self._lock:
+            if not self._backlog:
+                self._free.append(slot)
+                return
+            future, request = self._backlog.popleft()
+            self._pending[slot] = (future, request)
+        self._send(slot, request)
+
+
+# =========================
+# REMOTE MODEL POOL
+# =========================
+# In an HTTP worker, main.py's model_pool is a RemotePool: the same calls the
+# endpoints make on ModelPool / ModelRuntime, answered by the inference
+# processes. acquire() is one round trip: it leases the live version in an
+# inference process (each in turn), and every call through the lease's
+# runtime goes to that process, pinned to that version, until release().
+
+class _RemoteBatcher:
+    def __init__(self, runtime, op, kind):
+        self._runtime = runtime
+        self._op = op
+        self._kind = kind
+
+    def submit(self, inputs):
+        return self._runtime._submit(self._op, inputs)
+
+    def stats(self):
+        return self._runtime._remote_stats().get(self._kind, {})
+
+
+class _RemoteEngine:
+    def __init__(self, runtime, has_gradcam, input_shape):
+        self._runtime = runtime
+        self.layer_name = "remote" if has_gradcam else None
+        self.input_shape = input_shape
+
+    def __call__(self, batch):
+        return self._runtime._run(OP_FORWARD, batch)
+
+
+class _RemoteModel:
+    """Stands in for the Keras model where only predictions are needed."""
+
+    def __init__(self, runtime):
+        self._runtime = runtime
+
+    def __call__(self, batch, **kwargs):
+        return self._runtime.predict(np.asarray(batch))
+
+    def predict(self, batch, **kwargs):
+        return self._runtime.predict(np.asarray(batch))
+
+
+class _NoShapService:
+    """Stats stand-in for a version no request has explained yet."""
+
+    def stats(self):
+        return {}
+
+
+class RemoteRuntime:
+    """ModelRuntime look-alike for one model version in one inference process.
+
+    Runtimes from RemotePool.resident() are not leased and only serve stats:
+    they report the SHAP service of their version if one exists but never
+    start one.
+    """
+
+    nbytes = 0
+
+    def __init__(self, pool, model, proc, version, has_gradcam, leased=True):
+        self._pool = pool
+        self._leased = leased
+        self._client = pool.client
+        self._model = model
+        self._proc = proc
+        self.name = pool._names[model]
+        self.version = version
+        self.classes = pool._classes[self.name]
+        self.path = pool.get(self.name).path
+        self.engine = _RemoteEngine(self, has_gradcam, self._client.ring.input_shape)
+        self.batcher = _RemoteBatcher(self, OP_FORWARD, "gradcam")
+        self.predict_batcher = _RemoteBatcher(self, OP_PREDICT_FAST, "predict")
+        self.model = _RemoteModel(self)
+
+    @property
+    def shap_service(self):
+        if not self._leased:
+            return self._pool._shap_service(self._model, self._proc, self.version, create=False) or _NoShapService()
+        return self._pool._shap_service(self._model, self._proc, self.version)
+
+    def predict(self, batch):
+        return self._run(OP_PREDICT, batch)
+
+    def predict_fast(self, batch):
+        return self._run(OP_PREDICT_FAST, batch)
+
+    def explain_classes(self, batch, top_k=None, method="gradcam"):
+        return self._run(OP_EXPLAIN, batch, explain_arg(top_k, method))
+
+    def describe_backend(self):
+        return self._remote_stats().get("inference", {})
+
+    def _submit(self, op, batch):
+        return self._client.submit(self._model, op, batch, proc=self._proc, version=self.version)
+
+    def _run(self, op, batch, arg=0):
+        return self._client.run(self._model, op, batch, arg, self._proc, self.version)
+
+    def _remote_stats(self):
+        return self._client.control("runtime_stats", proc=self._proc).get(self.name, {})
+
+
+class _RemoteLease:
+    """A version leased in an inference process; release() returns it."""
+
+    __slots__ = ("runtime", "_pool", "_token")
+
+    def __init__(self, pool, runtime, token):
+        self._pool = pool
+        self._token = token
+        self.runtime = runtime
+
+    def release(self):
+        token, self._token = self._token, None
+        if token is not None:
+            self._pool._release(self.runtime, token)
+
+    def __enter__(self):
+        return self.runtime
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class _RemoteRegistry:
+    def __init__(self, pool, name, path):
+        self._pool = pool
+        self.name = name
+        self.path = path
+
+    @property
+    def version(self):
+        return self._pool._live(self.name)[0]
+
+    @property
+    def resident(self):
+        return self.version is not None
+
+    def stats(self):
+        return self._pool.stats()["models"].get(self.name, {})
+
+
+class RemotePool:
+    """ModelPool look-alike backed by an InferenceClient.
+
+    Args:
+        client: This worker's InferenceClient.
+        models: name -> (model path, class labels), in the inference
+            processes' modality order.
+        shap_factory: Callable (forward_fn, input_shape, max_wait_ms) ->
+            ShapService; SHAP masking runs in the worker, its model calls go
+            to the ring and are batched by the inference process.
+    """
+
+    def __init__(self, client, models, shap_factory):
+        self.client = client
+        self._names = list(models)
+        self._classes = {name: classes for name, (_, classes) in models.items()}
+        self._registries = {name: _RemoteRegistry(self, name, path) for name, (path, _) in models.items()}
+        self._shap_factory = shap_factory
+        self._shap = {}  # (model, proc, version) -> ShapService
+        self._held = Counter()  # (model, proc, version) -> leases out
+        self._turns = itertools.count()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        return self._registries.get(name)
+
+    def names(self):
+        return list(self._names)
+
+    def acquire(self, name, load=True):
+        """Lease `name` in the next inference process (a blocking round trip)."""
+        model = self._names.index(name)
+        proc = next(self._turns) % self.client.procs
+        held = self.client.control("lease", proc=proc, name=name, load=load)
+        if held is None:
+            return _RemoteLease(self, None, None)
+        runtime = RemoteRuntime(self, model, proc, held["version"], held["gradcam"])
+        with self._lock:
+            self._held[(model, proc, runtime.version)] += 1
+        return _RemoteLease(self, runtime, held["token"])
+
+    def load(self, name, path=None):
+        return self.client.broadcast("load", name=name, path=path)[0]
+
+    def reload(self, name, path=None):
+        self.client.broadcast("reload", name=name, path=path)
+
+    def resident(self):
+        """name -> runtime of the first inference process's live versions (not leased)."""
+        runtimes = {}
+        for model, name in enumerate(self._names):
+            version, has_gradcam = self.client.live(model)
+            if version is not None:
+                runtimes[name] = RemoteRuntime(self, model, 0, version, has_gradcam, leased=False)
+        return runtimes
+
+    def stats(self):
+        return {**self.client.control("stats"), "inference_processes": self.client.procs}
+
+    def start(self):
+        return self
+
+    def stop(self):
+        with self._lock:
+            services, self._shap = list(self._shap.values()), {}
+        for service in services:
+            service.stop()
+
+    def _live(self, name):
+        return self.client.live(self._names.index(name))
+
+    def _release(self, runtime, token):
+        key = (runtime._model, runtime._proc, runtime.version)
+        self.client.notify("release", proc=runtime._proc, token=token)
+        with self._lock:
+            self._held[key] -= 1
+            if self._held[key] <= 0:
+                del self._held[key]
+            # SHAP services of versions nobody holds any more and that are no
+            # longer live go with them.
+            stale = [
+                k for k in self._shap
+                if k not in self._held and self.client.live(k[0], k[1])[0] != k[2]
+            ]
+            services = [self._shap.pop(k) for k in stale]
+        for service in services:
+            service.stop()
+
+    def _shap_service(self, model, proc, version, create=True):
+        key = (model, proc, version)
+        with self._lock:
+            service = self._shap.get(key)
+            if service is None and create:
+                # No waiting here: the inference process's SHAP batcher
+                # collects the slots into full batches.
+                service = self._shap[key] = self._shap_factory(
+                    lambda batch: self.client.run(model, OP_SHAP, batch, proc=proc, version=version),
+                    self.client.ring.input_shape,
+                    max_wait_ms=0,
+                )
+            return service
+
+
+# =========================
+# PROCESS ENTRY POINTS
+# =========================
+
+_client = None
+
+
+def client():
+    """This HTTP worker's InferenceClient, or None outside multi-process serving."""
+    return _client
+
+
+def _inference_main(spec, index, slots_per_worker, requests, responses):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor stops us
+    ring = TensorRing.attach(spec)
+    import main  # builds the local model pool; the app itself is not served here
+
+    server = InferenceServer(
+        ring, index, main.model_pool, list(main.MODALITIES), slots_per_worker, requests, responses,
+        commands=main.SHADOW_COMMANDS,
+    )
+    main.model_pool.start()
+    print(f"🧠 Inference process {index} serving {', '.join(main.MODALITIES)} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    finally:
+        main.model_pool.stop()
+        for evaluator in main.shadow_models.values():
+            evaluator.stop()
+        ring.close()
+
+
+def _http_main(config, sock, spec, worker, slots_per_worker, requests, responses):
+    import uvicorn
+
+    # Set on the module main.py imports; this file may be running as __main__.
+    import shm_serving
+
+    shm_serving._client = InferenceClient(spec, worker, slots_per_worker, requests, responses)
+    uvicorn.Server(uvicorn.Config("main:app", **config)).run(sockets=[sock])
+
+
+def serve(host="0.0.0.0", port=5000, workers=2, inference_procs=1, slots_per_worker=8, slot_rows=8,
+          out_floats=4096, log_level="warning"):
+    """Start the ring, inference processes and HTTP workers; block until stopped."""
+    import uvicorn
+
+    from imaging import TARGET_SIZE
+
+    ctx = mp.get_context("spawn")
+    ring = TensorRing(workers * slots_per_worker, slot_rows, (*TARGET_SIZE, 3), out_floats, inference_procs)
+    requests = [ctx.SimpleQueue() for _ in range(inference_procs)]
+    responses = [ctx.SimpleQueue() for _ in range(workers)]
+
+    config = {"host": host, "port": port, "log_level": log_level}
+    sock = uvicorn.Config("main:app", **config).bind_socket()
+    children = [
+        ctx.Process(
+            target=_inference_main,
+            args=(ring.spec(), i, slots_per_worker, requests[i], responses),
+            name=f"inference-{i}",
+        )
+        for i in range(inference_procs)
+    ] + [
+        ctx.Process(
+            target=_http_main,
+            args=(config, sock, ring.spec(), w, slots_per_worker, requests, responses[w]),
+            name=f"http-{w}",
+        )
+        for w in range(workers)
+    ]
+    for child in children:
+        child.start()
+    print(
+        f"🚀 Serving on http://{host}:{port}: {workers} HTTP worker(s), {inference_procs} inference "
+        f"process(es), {ring.nbytes / (1024 * 1024):.0f} MB ring ({ring.slots} slots x {slot_rows} rows)"
+    )
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    while not stop.wait(0.5):
+        dead = [child.name for child in children if not child.is_alive()]
+        if dead:
+            print(f"❌ {', '.join(dead)} exited; shutting down")
+            break
+
+    http, inference = children[inference_procs:], children[:inference_procs]
+    for child in http:
+        if child.is_alive():
+            child.terminate()  # SIGTERM: uvicorn finishes in-flight requests
+    for child in http:
+        child.join(30)
+    for queue in requests:
+        queue.put(None)
+    for child in inference:
+        child.join(10)
+    for child in children:
+        if child.is_alive():
+            child.kill()
+    sock.close()
+    ring.close()
+    print("👋 Stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="HTTP worker processes")
+    parser.add_argument("--inference-procs", type=int, default=1, help="Processes that load the models")
+    parser.add_argument("--slots", type=int, default=8, help="Ring slots per HTTP worker")
+    parser.add_argument("--slot-rows", type=int, default=8, help="Input tensors per slot")
+    parser.add_argument("--out-floats", type=int, default=4096, help="Output floats per row (predictions + heatmap)")
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+    serve(
+        args.host, args.port, args.workers, args.inference_procs, args.slots, args.slot_rows,
+        args.out_floats, args.log_level,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,371 @@
+import bisect
+import contextvars
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+# =========================
+# METRICS
+# =========================
+# A small Prometheus text-format registry: histograms for stage and request
+# durations, plus collectors that turn existing stats() dicts into gauges at
+# scrape time. Observing is a bisect and a few additions under a lock, cheap
+# enough for every request.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in Prometheus format."""
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), values[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(labels + [('le', _float(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {_float(values[-1])}")
+            lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Histograms plus scrape-time collectors.
+
+    A collector is a callable returning (name, help, type, samples), where
+    samples is a list of (labels dict, value); it runs on every scrape, so
+    gauges always reflect live state without any bookkeeping on the hot path.
+    """
+
+    def __init__(self):
+        self._histograms = []
+        self._collectors = []
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(name, help, labelnames, buckets)
+        self._histograms.append(histogram)
+        return histogram
+
+    def collector(self, fn):
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for histogram in self._histograms:
+            lines.extend(histogram.render())
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                lines.append(f"# collector {getattr(collect, '__name__', collect)} failed: {e}")
+                continue
+            for name, help, kind, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_labels(sorted(labels.items()))} {_float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Cumulative fields of the stats() dicts (batcher, pools, jobs, caches,
+# artifacts, IPC, shadow). They only grow while the process lives, so they are
+# exported as counters (`<name>_total`) and can be queried with rate().
+# Everything else is a point-in-time gauge.
+COUNTER_FIELDS = frozenset({
+    "batches", "items", "errors", "completed", "rejected", "failed", "sent",
+    "hits", "memory_hits", "disk_hits", "misses", "evictions",
+    "writes", "deduped", "evicted", "expired",
+    "sampled_batches", "dropped_batches", "skipped_batches", "chunks", "overruns", "serving_waits", "rows",
+})
+
+
+def stats_families(prefix, stats, labels=None, skip=(), counters=COUNTER_FIELDS):
+    """Turn the numeric fields of a stats() dict into counter and gauge families."""
+    families = []
+    for key, value in stats.items():
+        if key in skip or isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        help = f"{prefix.replace('_', ' ')} {key.replace('_', ' ')}"
+        if key in counters:
+            families.append((f"{prefix}_{key}_total", help, "counter", [(labels or {}, value)]))
+        else:
+            families.append((f"{prefix}_{key}", help, "gauge", [(labels or {}, value)]))
+    return families
+
+
+def merge_families(families):
+    """Merge families with the same name (e.g. one per modality) into one."""
+    merged = {}
+    for name, help, kind, samples in families:
+        if name in merged:
+            merged[name][3].extend(samples)
+        else:
+            merged[name] = (name, help, kind, list(samples))
+    return list(merged.values())
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _float(value):
+    if value == "+Inf":
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# =========================
+# STAGE TIMINGS
+# =========================
+
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram(
+    "stage_duration_seconds",
+    "Time spent per processing stage",
+    labelnames=("stage",),
+)
+REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds",
+    "HTTP request time until the response starts",
+    labelnames=("method", "route", "status"),
+)
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Per-request stage durations, in the order they finished."""
+
+    __slots__ = ("started", "stages")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+
+    def add(self, name, seconds):
+        self.stages.append((name, seconds))
+
+    def header(self):
+        """Server-Timing value: each stage (repeats summed) plus the total."""
+        totals = {}
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def record(name, seconds):
+    """Record a finished stage in the histogram and the current request."""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as stage `name` (recorded even if it raises)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+class TimingMiddleware:
+    """ASGI middleware: request histogram plus an optional Server-Timing header.
+
+    Stage timings recorded anywhere in the request's context - including
+    worker threads started through BoundedPool, which copies the context -
+    are attached to the response when `server_timing` is on.
+    """
+
+    def __init__(self, app, server_timing=False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                route = scope.get("route")
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - timings.started,
+                    method=scope["method"],
+                    route=getattr(route, "path", "unmatched"),
+                    status=status[0],
+                )
+                if self.server_timing:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", timings.header().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+
+
+# =========================
+# START-UP PHASES
+# =========================
+
+class StartupTimer:
+    """Wall-clock durations of start-up phases, relative to `started`.
+
+    `mark(name)` closes a phase that began where the previous mark ended
+    (module-level steps run one after another); `add` records a phase that
+    was timed elsewhere, e.g. a model load on a background thread. `ready()`
+    is called once the service can take traffic.
+    """
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self._last = self.started
+        self._phases = []  # (name, seconds, finished at, relative to started)
+        self._ready_at = None
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        now = time.perf_counter()
+        with self._lock:
+            self._phases.append((name, now - self._last, now - self.started))
+            self._last = now
+
+    def add(self, name, seconds):
+        with self._lock:
+            self._phases.append((name, seconds, time.perf_counter() - self.started))
+
+    def ready(self):
+        with self._lock:
+            if self._ready_at is None:
+                self._ready_at = time.perf_counter() - self.started
+
+    @property
+    def is_ready(self):
+        return self._ready_at is not None
+
+    def report(self):
+        with self._lock:
+            phases = list(self._phases)
+            ready_at = self._ready_at
+        return {
+            "phases": [
+                {"phase": name, "ms": round(seconds * 1000, 1), "at_ms": round(at * 1000, 1)}
+                for name, seconds, at in phases
+            ],
+            "ready_ms": round(ready_at * 1000, 1) if ready_at is not None else None,
+            "uptime_s": round(time.perf_counter() - self.started, 1),
+        }
+
+    def gauges(self):
+        """`startup_phase_seconds` gauge family for a metrics collector."""
+        with self._lock:
+            samples = [({"phase": name}, round(seconds, 6)) for name, seconds, _ in self._phases]
+            ready_at = self._ready_at
+        return [
+            ("startup_phase_seconds", "Duration of each start-up phase", "gauge", samples),
+            ("startup_ready_seconds", "Time from start until ready", "gauge", [({}, ready_at)]),
+        ]
+
+
+# =========================
+# NON-BLOCKING LOGGING
+# =========================
+# Handlers that touch files or streams run on a listener thread; request
+# threads only put records on an in-memory queue.
+
+_listener = None
+_handler = None
+
+
+def setup_logging(level="WARNING", path=None, max_queue=10000):
+    """Route all logging through a QueueHandler; returns the listener.
+
+    Records go to `path` (rotated at 10 MB) or stderr. When the queue is full
+    records are dropped rather than blocking the caller.
+    """
+    global _listener, _handler
+    if _listener is not None:
+        return _listener
+    if path:
+        target = logging.handlers.RotatingFileHandler(path, maxBytes=10 * 1024 * 1024, backupCount=3)
+    else:
+        target = logging.StreamHandler(sys.stderr)
+    target.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    _handler = _DroppingQueueHandler(queue.Queue(max_queue))
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    _listener = logging.handlers.QueueListener(_handler.queue, target, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Detach the queue handler, then flush and stop the listener."""
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        for target in _listener.handlers:
+            target.close()
+        _listener = None
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            type(self).dropped += 1
@@ -0,0 +1,195 @@
+import os
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+
+# =========================
+# TFLITE INFERENCE BACKEND
+# =========================
+# Fast scans (no Grad-CAM) can run through a converted TFLite graph instead of
+# the full Keras model. TFLite's float kernels go through XNNPACK, which the
+# interpreter applies by default and runs on `num_threads` cores. The
+# converted flatbuffer is cached next to the model, keyed by model version
+# and quantization, so a restart or a second replica reuses it.
+
+QUANT_MODES = ("none", "float16", "dynamic", "int8")
+# Quantized graphs can agree with Keras on noise and still be wrong on real
+# scans, so they only go live after a parity check on real images.
+QUANTIZED_MODES = ("float16", "dynamic", "int8")
+
+
+def convert_model(model, quantization="float16", representative=None):
+    """Convert a Keras model to a TFLite flatbuffer; returns the bytes.
+
+    Args:
+        model: Keras model with a single image input.
+        quantization: "none" (float32), "float16" (float16 weights),
+            "dynamic" (int8 weights, float activations) or "int8" (int8
+            weights and activations, calibrated on `representative`).
+        representative: Array of sample inputs (n, H, W, C) for "int8".
+    """
+    if quantization not in QUANT_MODES:
+        raise ValueError(f"Unknown quantization {quantization!r}; expected one of {QUANT_MODES}")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if representative is None or len(representative) == 0:
+            raise ValueError("int8 quantization needs representative inputs")
+
+        def samples():
+            for row in representative:
+                yield [np.asarray(row, dtype=np.float32)[np.newaxis]]
+
+        # Float input/output stay float; only the inside of the graph is int8.
+        converter.representative_dataset = samples
+    return converter.convert()
+
+
+def load_or_convert(model, model_path, version, quantization="float16", representative=None):
+    """Return TFLite bytes for this model version, converting at most once.
+
+    The flatbuffer is cached as `<model dir>/tflite/<stem>-<version>-<quant>.tflite`.
+    """
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(model_path)), "tflite")
+    cache_path = os.path.join(cache_dir, f"{stem}-{version}-{quantization}.tflite")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return f.read()
+
+    content = convert_model(model, quantization, representative)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, cache_path)
+    return content
+
+
+class TFLiteModel:
+    """Batched `predict` over a TFLite interpreter.
+
+    The interpreter's input is resized to the incoming batch size when it
+    changes, so the micro-batcher's variable batches work as with Keras.
+    Interpreters are not thread-safe; calls are serialised on the instance.
+
+    Args:
+        content: TFLite flatbuffer bytes.
+        num_threads: Interpreter (and XNNPACK) threads; all cores when None.
+        name: Label for logs and stats, e.g. "tflite-float16".
+    """
+
+    def __init__(self, content, num_threads=None, name="tflite"):
+        self.name = name
+        self.nbytes = len(content)
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self._interpreter = tf.lite.Interpreter(model_content=content, num_threads=self.num_threads)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self.input_shape = tuple(int(d) for d in self._input["shape"][1:])
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input["index"], [batch.shape[0], *self.input_shape])
+                self._interpreter.allocate_tensors()
+                self._input = self._interpreter.get_input_details()[0]
+                self._output = self._interpreter.get_output_details()[0]
+                self._batch_size = batch.shape[0]
+            self._interpreter.set_tensor(self._input["index"], _quantize_input(batch, self._input))
+            self._interpreter.invoke()
+            return _dequantize_output(self._interpreter.get_tensor(self._output["index"]), self._output)
+
+    def warmup(self, batch_sizes=(1,)):
+        for n in batch_sizes:
+            self.predict(np.zeros((n,) + self.input_shape, dtype=np.float32))
+
+    def describe(self):
+        return {"backend": self.name, "bytes": self.nbytes, "num_threads": self.num_threads}
+
+
+def _quantize_input(batch, details):
+    if details["dtype"] == np.float32:
+        return batch
+    scale, zero_point = details["quantization"]
+    info = np.iinfo(details["dtype"])
+    return np.clip(np.rint(batch / scale + zero_point), info.min, info.max).astype(details["dtype"])
+
+
+def _dequantize_output(values, details):
+    if details["dtype"] == np.float32:
+        return values.copy()
+    scale, zero_point = details["quantization"]
+    return (values.astype(np.float32) - zero_point) * scale
+
+
+# =========================
+# PARITY HARNESS
+# =========================
+
+def sample_inputs(folder=None, count=64, input_shape=(224, 224, 3), seed=0):
+    """Model inputs for parity checks and int8 calibration.
+
+    Decodes up to `count` images from `folder` (real scans give the only
+    meaningful agreement numbers); falls back to smooth random images when no
+    folder is given or it holds no readable images.
+
+    Returns (inputs, source): source is "scans" or "synthetic", and belongs
+    in any parity report made from these inputs.
+    """
+    images = []
+    if folder and os.path.isdir(folder):
+        from imaging import decode_image
+
+        for name in sorted(os.listdir(folder)):
+            if len(images) >= count:
+                break
+            path = os.path.join(folder, name)
+            if not os.path.isfile(path):
+                continue
+            try:
+                with open(path, "rb") as f:
+                    images.append(decode_image(f.read(), size=input_shape[:2]).tensor[0])
+            except Exception:
+                continue
+    if images:
+        return np.stack(images).astype(np.float32), "scans"
+
+    # Low-frequency noise looks more like a scan to a conv net than white noise.
+    rng = np.random.default_rng(seed)
+    h, w, c = input_shape
+    coarse = rng.random((count, max(1, h // 16), max(1, w // 16), c)).astype(np.float32)
+    return np.stack([tf.image.resize(img, (h, w)).numpy() for img in coarse]).clip(0, 1), "synthetic"
+
+
+def parity(reference, candidate, inputs, batch_size=16):
+    """Compare two predict functions on `inputs`.
+
+    Returns top-1 agreement and the absolute probability drift (mean, p99 and
+    max over every class of every sample) of `candidate` against `reference`.
+    """
+    ref_rows, cand_rows = [], []
+    for start in range(0, len(inputs), batch_size):
+        batch = inputs[start : start + batch_size]
+        ref_rows.append(np.asarray(reference(batch), dtype=np.float32))
+        cand_rows.append(np.asarray(candidate(batch), dtype=np.float32))
+    ref = np.concatenate(ref_rows).reshape(len(inputs), -1)
+    cand = np.concatenate(cand_rows).reshape(len(inputs), -1)
+    drift = np.abs(ref - cand)
+    agree = ref.argmax(axis=1) == cand.argmax(axis=1)
+    return {
+        "samples": int(len(inputs)),
+        "top1_agreement": round(float(agree.mean()), 4),
+        "disagreements": int((~agree).sum()),
+        "mean_abs_drift": float(drift.mean()),
+        "p99_abs_drift": float(np.percentile(drift, 99)),
+        "max_abs_drift": float(drift.max()),
+    }
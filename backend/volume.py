@@ -0,0 +1,370 @@
+import gzip
+import heapq
+import os
+import shutil
+import tarfile
+import zipfile
+
+import cv2
+import numpy as np
+
+from imaging import TARGET_SIZE
+
+
+# =========================
+# VOLUMETRIC INGEST
+# =========================
+# MRI volumes arrive as one NIfTI file or as a DICOM series (a zip/tar of
+# slice files, or one multi-frame file). The upload is spooled to a scratch
+# directory. Slices are then read on demand: NIfTI through nibabel's memory
+# map, and DICOM one slice file or frame at a time. Each chunk of slices is
+# windowed to uint8, resized and stacked to RGB at model resolution. Memory
+# therefore follows the chunk size, not the number of slices. nibabel and
+# pydicom are only imported when a volume of their format arrives.
+
+NIFTI_SUFFIXES = (".nii", ".nii.gz")
+WINDOW_PERCENTILES = (0.5, 99.5)  # intensity window when the file sets none
+WINDOW_SAMPLE_SLICES = 16
+NORMAL_CLASSES = {"no tumor", "normal", "benign"}
+
+
+def _require(module, what):
+    try:
+        return __import__(module)
+    except ImportError as e:
+        raise ImportError(f"{what} volumes need the optional `{module}` package (pip install {module})") from e
+
+
+class Volume:
+    """Slices of one scan volume, read and preprocessed a chunk at a time.
+
+    Subclasses implement `_read(start, stop)`, returning rescaled intensities
+    as float32 (n, rows, cols) in display orientation.
+
+    Attributes:
+        format: "nifti" or "dicom".
+        num_slices: Slices along the slice axis.
+        window: (low, high) intensities mapped to 0 and 255.
+    """
+
+    format = None
+
+    def __init__(self):
+        self.num_slices = 0
+        self.window = None
+
+    def __len__(self):
+        return self.num_slices
+
+    def read(self, start, stop):
+        """Slices [start, stop) as (n, H, W, 3) uint8 RGB at model resolution."""
+        raw = self._read(start, stop)
+        low, high = self.window
+        scaled = (np.nan_to_num(raw) - low) * (255.0 / (high - low))
+        gray = np.clip(scaled, 0, 255).astype(np.uint8)
+        out = np.empty((len(gray),) + TARGET_SIZE[::-1] + (3,), dtype=np.uint8)
+        for i, plane in enumerate(gray):
+            out[i] = cv2.cvtColor(cv2.resize(plane, TARGET_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_GRAY2RGB)
+        return out
+
+    def set_window(self, center=None, width=None):
+        """Use an explicit window, else the file's, else robust percentiles of sampled slices."""
+        if center is not None and width is not None:
+            self.window = (center - width / 2.0, center + width / 2.0)
+            return
+        window = self._header_window()
+        if window is None:
+            step = max(1, self.num_slices // WINDOW_SAMPLE_SLICES)
+            sample = np.concatenate(
+                [self._read(i, i + 1)[:, ::4, ::4].ravel() for i in range(0, self.num_slices, step)]
+            )
+            window = tuple(float(v) for v in np.percentile(np.nan_to_num(sample), WINDOW_PERCENTILES))
+        low, high = window
+        self.window = (low, high if high > low else low + 1.0)
+
+    def describe(self):
+        return {
+            "format": self.format,
+            "num_slices": self.num_slices,
+            "window": [round(v, 3) for v in self.window] if self.window else None,
+        }
+
+    def _header_window(self):
+        return None
+
+    def _read(self, start, stop):
+        raise NotImplementedError
+
+
+class NiftiVolume(Volume):
+    """A NIfTI-1/2 volume sliced along its most superior-inferior axis.
+
+    Uncompressed files are memory-mapped. Gzipped ones are decompressed as
+    slices are read in order. 4D series use their first volume.
+    """
+
+    format = "nifti"
+
+    def __init__(self, path):
+        super().__init__()
+        nib = _require("nibabel", "NIfTI")
+        self._img = nib.load(path, mmap=True, keep_file_open=True)
+        shape = self._img.shape
+        if len(shape) < 3:
+            raise ValueError(f"NIfTI image has shape {shape}; expected a 3D volume")
+        self.shape = shape
+        codes = nib.aff2axcodes(self._img.affine)[:3]
+        self.slice_axis = next((i for i, c in enumerate(codes) if c in ("S", "I")), 2)
+        rows, cols = [i for i in range(3) if i != self.slice_axis]
+        if codes[cols] in ("A", "P"):
+            rows, cols = cols, rows
+        # Display like a radiology viewer: anterior at the top, patient right on the left.
+        self._axes = (rows, cols)
+        self._flip = (codes[rows] == "A", codes[cols] == "R")
+        self.num_slices = shape[self.slice_axis]
+        if self.num_slices == 0:
+            raise ValueError("NIfTI volume has no slices")
+
+    def _header_window(self):
+        header = self._img.header
+        low, high = float(header["cal_min"]), float(header["cal_max"])
+        return (low, high) if high > low else None
+
+    def _read(self, start, stop):
+        index = [slice(None)] * 3 + [0] * (len(self.shape) - 3)
+        index[self.slice_axis] = slice(start, stop)
+        data = np.asarray(self._img.dataobj[tuple(index)], dtype=np.float32)
+        rows, cols = self._axes
+        data = np.transpose(data, (self.slice_axis, rows, cols))
+        if self._flip[0]:
+            data = data[:, ::-1]
+        if self._flip[1]:
+            data = data[:, :, ::-1]
+        return data
+
+    def describe(self):
+        return {**super().describe(), "shape": list(self.shape), "slice_axis": self.slice_axis}
+
+
+class DicomSeries(Volume):
+    """One DICOM series: slice files (or frames of one file) in spatial order.
+
+    Only headers are parsed up front; pixel data is decoded per slice. When
+    the files hold several series, the one with the most slices is used.
+    """
+
+    format = "dicom"
+
+    def __init__(self, paths):
+        super().__init__()
+        pydicom = _require("pydicom", "DICOM")
+        series = {}
+        for path in paths:
+            try:
+                ds = pydicom.dcmread(path, stop_before_pixels=True)
+            except Exception:
+                continue  # DICOMDIR, readme files and other non-image members
+            if "Rows" not in ds or "Columns" not in ds:
+                continue
+            series.setdefault(str(ds.get("SeriesInstanceUID", "")), []).append((path, ds))
+        if not series:
+            raise ValueError("No DICOM images found in the upload")
+        self.series_uid, members = max(series.items(), key=lambda item: len(item[1]))
+
+        self._slices = []  # (position along the slice normal, path, frame or None, header)
+        for path, ds in members:
+            frames = int(ds.get("NumberOfFrames", 1) or 1)
+            if frames > 1:
+                self._slices += [(i, path, i, ds) for i in range(frames)]
+            else:
+                self._slices.append((_slice_position(ds), path, None, ds))
+        self._slices.sort(key=lambda s: s[0])
+        self._pydicom = pydicom
+        self.num_slices = len(self._slices)
+
+    def _header_window(self):
+        ds = self._slices[0][3]
+        if "WindowCenter" not in ds or "WindowWidth" not in ds:
+            return None
+        center, width = _first(ds.WindowCenter), _first(ds.WindowWidth)
+        return (center - width / 2.0, center + width / 2.0) if width > 0 else None
+
+    def _read(self, start, stop):
+        planes = []
+        for _, path, frame, ds in self._slices[start:stop]:
+            pixels = self._decode(path, frame).astype(np.float32)
+            if pixels.ndim == 3:  # colour images: luminance
+                pixels = pixels.mean(axis=-1)
+            pixels = pixels * float(ds.get("RescaleSlope", 1) or 1) + float(ds.get("RescaleIntercept", 0) or 0)
+            if ds.get("PhotometricInterpretation") == "MONOCHROME1":
+                pixels = pixels.max() + pixels.min() - pixels
+            planes.append(pixels)
+        shape = planes[0].shape
+        # Slices of one series share a size; resample any that do not.
+        return np.stack([p if p.shape == shape else cv2.resize(p, shape[::-1]) for p in planes])
+
+    def _decode(self, path, frame):
+        pixels = getattr(self._pydicom, "pixels", None)
+        if pixels is not None and hasattr(pixels, "pixel_array"):
+            return pixels.pixel_array(path, index=frame)  # pydicom 3 decodes just this frame
+        data = self._pydicom.dcmread(path).pixel_array
+        return data if frame is None else data[frame]
+
+    def describe(self):
+        ds = self._slices[0][3]
+        return {
+            **super().describe(),
+            "series_uid": self.series_uid,
+            "modality": str(ds.get("Modality", "")) or None,
+            "shape": [self.num_slices, int(ds.Rows), int(ds.Columns)],
+        }
+
+
+def _first(value):
+    """First number of a possibly multi-valued DICOM element."""
+    try:
+        return float(value[0])
+    except TypeError:
+        return float(value)
+
+
+def _slice_position(ds):
+    """Distance along the slice normal, falling back to InstanceNumber."""
+    orientation = ds.get("ImageOrientationPatient")
+    position = ds.get("ImagePositionPatient")
+    if orientation is not None and position is not None and len(orientation) == 6:
+        normal = np.cross(np.array(orientation[:3], dtype=float), np.array(orientation[3:], dtype=float))
+        return float(np.dot(normal, np.array(position, dtype=float)))
+    return float(ds.get("InstanceNumber", 0) or 0)
+
+
+# =========================
+# UPLOAD SPOOLING
+# =========================
+
+def open_volume(fileobj, filename, workdir, max_bytes):
+    """Spool an uploaded volume into `workdir` and open it.
+
+    Accepts a NIfTI file (.nii or .nii.gz), a single DICOM file, or a zip/tar
+    archive of a DICOM series. `max_bytes` bounds the upload and, for
+    archives, the extracted total. Raises ValueError for anything else.
+    """
+    path = os.path.join(workdir, "upload")
+    _copy_limited(fileobj, path, max_bytes)
+    with open(path, "rb") as f:
+        head = f.read(352)
+
+    if head[:2] == b"\x1f\x8b":
+        with gzip.open(path, "rb") as f:
+            try:
+                inner = f.read(352)
+            except OSError as e:
+                raise ValueError(f"Corrupt gzip upload: {e}") from e
+        if _is_nifti(inner):
+            os.replace(path, path + ".nii.gz")
+            return NiftiVolume(path + ".nii.gz")
+    elif _is_nifti(head):
+        os.replace(path, path + ".nii")
+        return NiftiVolume(path + ".nii")
+    elif head[128:132] == b"DICM":
+        return DicomSeries([path])
+
+    if zipfile.is_zipfile(path) or tarfile.is_tarfile(path):
+        series_dir = os.path.join(workdir, "series")
+        os.makedirs(series_dir)
+        return DicomSeries(_extract(path, series_dir, max_bytes))
+
+    raise ValueError(
+        f"Unrecognised volume {filename!r}: expected NIfTI ({', '.join(NIFTI_SUFFIXES)}), "
+        "a DICOM file, or a zip/tar of a DICOM series"
+    )
+
+
+def _is_nifti(head):
+    return head[344:347] in (b"n+1", b"n+2") or head[4:7] == b"n+2"
+
+
+def _copy_limited(fileobj, path, max_bytes, chunk=1024 * 1024):
+    copied = 0
+    with open(path, "wb") as out:
+        while True:
+            block = fileobj.read(chunk)
+            if not block:
+                return copied
+            copied += len(block)
+            if copied > max_bytes:
+                raise ValueError("Volume exceeds the upload size limit")
+            out.write(block)
+
+
+def _extract(archive, directory, max_bytes):
+    """Write archive members to numbered files in `directory`; returns their paths.
+
+    Member names are never used as paths, so archives cannot write outside
+    `directory`.
+    """
+    paths = []
+    total = 0
+
+    def write(source, size):
+        nonlocal total
+        total += size
+        if total > max_bytes:
+            raise ValueError("Extracted series exceeds the upload size limit")
+        path = os.path.join(directory, f"{len(paths):05d}.dcm")
+        with open(path, "wb") as out:
+            shutil.copyfileobj(source, out)
+        paths.append(path)
+
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and _is_member(info.filename):
+                    with zf.open(info) as source:
+                        write(source, info.file_size)
+    else:
+        with tarfile.open(archive, mode="r:*") as tar:
+            for member in tar:
+                if member.isfile() and _is_member(member.name):
+                    write(tar.extractfile(member), member.size)
+    return paths
+
+
+def _is_member(name):
+    base = os.path.basename(name)
+    return bool(base) and not base.startswith(".") and "__MACOSX" not in name.split("/")
+
+
+# =========================
+# VOLUME SCORING
+# =========================
+
+def suspicion(preds, classes):
+    """Per-row probability of anything but the normal class (top-1 confidence without one)."""
+    preds = np.asarray(preds, dtype=np.float64)
+    if preds.shape[-1] == 1:
+        return preds[:, 0]
+    normal = [i for i, name in enumerate(classes[: preds.shape[-1]]) if name.lower() in NORMAL_CLASSES]
+    if normal:
+        return 1.0 - preds[:, normal[0]]
+    return preds.max(axis=1)
+
+
+class TopSlices:
+    """The `k` most suspicious slices seen so far, with their model-resolution pixels."""
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []  # (suspicion, slice index, rgb) min-heap
+
+    def add(self, scores, start, rgb):
+        for row, score in enumerate(scores):
+            item = (float(score), start + row)
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, item + (rgb[row].copy(),))
+            elif item > self._heap[0][:2]:
+                heapq.heapreplace(self._heap, item + (rgb[row].copy(),))
+
+    def ranked(self):
+        """(suspicion, slice index, rgb), most suspicious first."""
+        return sorted(self._heap, key=lambda item: (-item[0], item[1]))
@@ -27,6 +27,7 @@ function App() {
   const [chart, setChart] = useState(null);
   const [heatmap, setHeatmap] = useState(null);
   const [shap, setShap] = useState(null);
+  const [shapProgress, setShapProgress] = useState(null);
   const [loading, setLoading] = useState(false);
   const [deepScan, setDeepScan] = useState(false); // Default to fast mode
   const [bgOpacity, setBgOpacity] = useState(1);
@@ -38,6 +39,8 @@ function App() {
   const subtitleRef = useRef(null);
   const formRef = useRef(null);
   const resultRef = useRef(null);
+  // EventSource for the current deep scan's SHAP job (null when none)
+  const shapStreamRef = useRef(null);
 
   // Scroll listener for background fade
   // Scroll listener for background fade
@@ -97,6 +100,56 @@ function App() {
     }
   };
 
+  // Stop following a deep scan's SHAP job (a new prediction replaces it)
+  const stopShapStream = () => {
+    if (shapStreamRef.current) {
+      shapStreamRef.current.close();
+      shapStreamRef.current = null;
+    }
+    setShapProgress(null);
+  };
+
+  // Close the stream when the app unmounts
+  useEffect(() => () => {
+    if (shapStreamRef.current) shapStreamRef.current.close();
+  }, []);
+
+  // Deep scans return right away with a job id; follow its event stream
+  // until SHAP is ready. Events from a stream that is no longer the current
+  // one are ignored, so an older scan can never overwrite a newer result.
+  const followShap = (jobUrl) => {
+    stopShapStream();
+    setShapProgress(0);
+    const source = new EventSource(`http://127.0.0.1:5000${jobUrl}/events`);
+    shapStreamRef.current = source;
+    const current = () => shapStreamRef.current === source;
+
+    const onProgress = (event) => {
+      if (!current()) return;
+      setShapProgress(JSON.parse(event.data).progress || 0);
+    };
+    source.addEventListener("queued", onProgress);
+    source.addEventListener("running", onProgress);
+    source.addEventListener("done", (event) => {
+      if (!current()) return;
+      setShap(JSON.parse(event.data).shap || null);
+      stopShapStream();
+    });
+    source.addEventListener("failed", (event) => {
+      if (!current()) return;
+      console.error("SHAP job failed:", JSON.parse(event.data).error);
+      stopShapStream();
+    });
+    // EventSource reconnects by itself after a dropped connection; give up
+    // only once it has closed for good (e.g. the job no longer exists).
+    source.onerror = () => {
+      if (current() && source.readyState === EventSource.CLOSED) {
+        console.error("SHAP event stream closed");
+        stopShapStream();
+      }
+    };
+  };
+
   // Prediction function
   const predict = async () => {
     // ... existing predict function items ...
@@ -130,6 +183,7 @@ function App() {
       setChart(null);
       setHeatmap(null);
       setShap(null);
+      stopShapStream();
 
       const res = await fetch(`http://127.0.0.1:5000/predict/${task}`, {
         method: "POST",
@@ -142,6 +196,9 @@ function App() {
       setResult(data.prediction || "No prediction returned");
       setHeatmap(data.heatmap || null);
       setShap(data.shap || null);
+      if (data.job) {
+        followShap(data.job);
+      }
 
       if (data.labels && data.values) {
         setChart({
@@ -359,7 +416,7 @@ function App() {
           )}
 
           {/* Explainability Section */}
-          {(heatmap || shap) && !loading && (
+          {(heatmap || shap || shapProgress !== null) && !loading && (
             <div className="explainability-section">
               <h3>
                 <span className="gradient-text">AI Explainability</span>
@@ -375,6 +432,12 @@ function App() {
                     />
                   </div>
                 )}
+                {!shap && shapProgress !== null && (
+                  <div className="explain-card wide">
+                    <h4>SHAP Analysis</h4>
+                    <p>Deep scan running... {Math.round(shapProgress * 100)}%</p>
+                  </div>
+                )}
                 {shap && (
                   <div className="explain-card wide">
                     <h4>SHAP Analysis</h4>